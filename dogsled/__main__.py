@@ -1,11 +1,155 @@
-"""dogsled"""
+"""dogsled command line interface.
+python -m dogsled fit-reference SLIDES --output reference.npz
+python -m dogsled bench-kernels --baseline baseline.json
+python -m dogsled synthetic-slide slide.svs --width 100000 --height 80000
+python -m dogsled bench [SLIDE] --sides 2048 4096 auto --workers 1 4 --modes jpeg tif
+"""
+import argparse
+import logging
+from pathlib import Path
+from typing import List, Optional, Union
 
+from dogsled.benchmark import KernelBenchmark
+from dogsled.defaults import DEFAULTS
 
-def main():  # pragma: no cover
-    """Starter function.
-    Currently, not implemented
-    """
-    pass
+LOGGER = logging.getLogger(__name__)
+
+
+def slide_files(paths: List[Path]) -> List[Path]:
+    """Slides given directly or found in the given folders."""
+    slides = []
+    for path in paths:
+        if path.is_dir():
+            slides += sorted(slide for slide in path.iterdir()
+                             if slide.suffix in DEFAULTS.OpenSlide_formats
+                             and not slide.name.startswith("."))
+        else:
+            slides.append(path)
+    return slides
+
+
+def fit_reference(args: argparse.Namespace) -> None:
+    """Fit he_ref and max_s_ref on the reference slides and save them."""
+    from dogsled.reference import CohortReference
+    he_ref, max_s_ref = CohortReference(slide_files(args.slides),
+                                        workers=args.workers,
+                                        source=args.source).fit()
+    CohortReference.save(args.output, he_ref, max_s_ref)
+    print(f"he_ref:\n{he_ref}\nmax_s_ref: {max_s_ref}\nsaved to {args.output}")
+
+
+def bench_kernels(args: argparse.Namespace) -> None:
+    """Run the kernel micro-benchmarks; exits with 1 if they regressed against the baseline."""
+    results = KernelBenchmark(sides=args.sides, dtypes=args.dtypes, kernels=args.kernels,
+                              repeats=args.repeats).run()
+    baseline = KernelBenchmark.load(args.baseline) if args.baseline else None
+    print(KernelBenchmark.table(results, baseline))
+    if args.save:
+        KernelBenchmark.save(args.save, results)
+    if baseline:
+        regressions = KernelBenchmark.compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+def tile_side(value: str) -> Union[int, str]:
+    """Tile side in pixels or "auto" (planned from the memory model)."""
+    if value == "auto":
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"tile side has to be a number or 'auto': {value}")
+
+
+def bench(args: argparse.Namespace) -> None:
+    """Run the whole pipeline over the grid of tile sides, workers and output modes."""
+    from dogsled.benchmark import PipelineBenchmark
+    grid = {"sides": args.sides, "workers": args.workers, "modes": args.modes}
+    if args.slide:
+        benchmark = PipelineBenchmark(args.slide, work_path=args.work_path, **grid)
+    else:
+        work_path = args.work_path or Path.cwd()
+        benchmark = PipelineBenchmark.synthetic(*args.synthetic, work_path=work_path,
+                                                seed=args.seed, **grid)
+    results = benchmark.run()
+    print(PipelineBenchmark.table(results))
+    if args.output:
+        PipelineBenchmark.save(args.output, benchmark.slide_path, results)
+
+
+def synthetic_slide(args: argparse.Namespace) -> None:
+    """Write a synthetic H&E-like slide."""
+    from dogsled.synthetic import SyntheticSlide
+    SyntheticSlide(args.width, args.height, seed=args.seed, mpp=args.mpp).save(
+        args.output, tile_side=args.tile_side)
+    print(f"synthetic slide saved to {args.output}")
+
+
+def parser() -> argparse.ArgumentParser:
+    """Command line arguments."""
+    main_parser = argparse.ArgumentParser(prog="dogsled")
+    commands = main_parser.add_subparsers(dest="command")
+    fit = commands.add_parser("fit-reference",
+                              help="fit he_ref and max_s_ref on a cohort of reference slides")
+    fit.add_argument("slides", nargs="+", type=Path, help="reference slides or folders with slides")
+    fit.add_argument("--output", type=Path, required=True, help=".npz file for the reference")
+    fit.add_argument("--workers", type=int, default=1, help="slides read at once")
+    fit.add_argument("--source", choices=["level", "sampled"], default="level",
+                     help="low resolution slide or sampled level 0 regions")
+    fit.set_defaults(func=fit_reference)
+    kernels = commands.add_parser("bench-kernels",
+                                  help="micro-benchmark the normalisation kernels")
+    kernels.add_argument("--sides", nargs="+", type=int, default=[512, 1024, 2048],
+                         help="tile sides (px)")
+    kernels.add_argument("--dtypes", nargs="+", default=["float32", "float64"],
+                         help="dtypes of the float kernels")
+    kernels.add_argument("--kernels", nargs="+", default=list(KernelBenchmark.KERNELS),
+                         choices=KernelBenchmark.KERNELS)
+    kernels.add_argument("--repeats", type=int, default=3, help="timed runs per case")
+    kernels.add_argument("--baseline", type=Path, help="baseline JSON to compare against")
+    kernels.add_argument("--tolerance", type=float, default=0.25,
+                         help="allowed throughput/peak memory change against the baseline")
+    kernels.add_argument("--save", type=Path, help="save the results as a baseline JSON")
+    kernels.set_defaults(func=bench_kernels)
+    synthetic = commands.add_parser("synthetic-slide",
+                                    help="write a synthetic H&E-like pyramidal slide")
+    synthetic.add_argument("output", type=Path, help="slide path (.svs)")
+    synthetic.add_argument("--width", type=int, required=True, help="level 0 width (px)")
+    synthetic.add_argument("--height", type=int, required=True, help="level 0 height (px)")
+    synthetic.add_argument("--seed", type=int, default=0)
+    synthetic.add_argument("--mpp", type=float, default=0.25, help="microns per pixel")
+    synthetic.add_argument("--tile-side", type=int, default=256, help="TIFF tile side (px)")
+    synthetic.set_defaults(func=synthetic_slide)
+    pipeline = commands.add_parser("bench", help="benchmark the whole normalisation pipeline")
+    pipeline.add_argument("slide", nargs="?", type=Path,
+                          help="slide to normalise (a synthetic slide is generated if not given)")
+    pipeline.add_argument("--synthetic", nargs=2, type=int, default=[20000, 15000],
+                          metavar=("WIDTH", "HEIGHT"), help="size of the synthetic slide (px)")
+    pipeline.add_argument("--seed", type=int, default=0, help="seed of the synthetic slide")
+    pipeline.add_argument("--sides", nargs="+", type=tile_side, default=[2048, 4096],
+                          help="tile sides (px) or 'auto'")
+    pipeline.add_argument("--workers", nargs="+", type=int, default=[1, 2], help="tile workers")
+    pipeline.add_argument("--modes", nargs="+", default=["jpeg", "tif"],
+                          choices=["jpeg", "tif", "raw", "stream"],
+                          help="JPEG (numpy stitcher), TIF (libvips stitcher), TIF from raw "
+                               "temporary tiles or TIF streamed without temporary tiles")
+    pipeline.add_argument("--work-path", type=Path,
+                          help="folder for the synthetic slide and the temporary outputs")
+    pipeline.add_argument("--output", type=Path, help="save the results as JSON")
+    pipeline.set_defaults(func=bench)
+    return main_parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starter function."""
+    args = parser().parse_args(argv)
+    if args.command is None:
+        parser().print_help()
+        return
+    args.func(args)
 
 
 if __name__ == "__main__":  # pragma: no cover
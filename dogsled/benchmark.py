@@ -0,0 +1,521 @@
+"""Benchmarks.
+Micro-benchmarks of the Normalisation hot kernels: every kernel is timed on deterministic
+H&E-like tiles of several sides (and dtypes for the float kernels); throughput is reported in
+megapixels/s together with the peak traced allocations and compared against a stored baseline
+JSON => regressions show up.
+End-to-end benchmarks: the whole NormaliseSlides pipeline is run over a grid of tile sides,
+tile workers and output modes => wall time, throughput, peak RSS, temporary disk use
+and time per stage of every combination.
+"""
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import itertools
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+import psutil
+import pyvips
+
+from dogsled.defaults import DEFAULTS
+from dogsled.metrics import MetricsRecorder
+from dogsled.normaliser import LOGGER as PROCESS_LOGGER, Normalisation, NormaliseSlides, SlideTiler
+from dogsled.scratch import ScratchArena
+from dogsled.slides import CurrentSlide
+from dogsled.synthetic import SyntheticSlide
+from dogsled.tilestore import RawTileStore
+from dogsled.wrapping import wrapped
+
+LOGGER = logging.getLogger(__name__)
+
+
+class KernelBenchmark:
+    """Time the kernels over all tile sides & dtypes;
+    results are dicts: kernel, side, dtype, megapixels, seconds (best run), mpix_s, peak_mb.
+    """
+
+    KERNELS = ("read_sector", "convert_od", "calculate_hem", "nb_lstsq",
+               "calculate_sp", "image_restore", "fused_restore_multi", "colour_lut",
+               "lut_restore", "save_jpeg", "stitcher")
+    # kernels whose input/output follows DEFAULTS.dtype; the others always use the same dtype
+    FLOAT_KERNELS = ("convert_od", "calculate_hem", "nb_lstsq", "image_restore")
+    FIXED_DTYPES = {"read_sector": "uint8", "calculate_sp": "float32",
+                    "fused_restore_multi": "uint8", "colour_lut": "uint8", "lut_restore": "uint8",
+                    "save_jpeg": "uint8", "stitcher": "uint8"}
+
+    def __init__(self, sides: Sequence[int] = (512, 1024, 2048),
+                 dtypes: Sequence[str] = ("float32", "float64"),
+                 kernels: Sequence[str] = KERNELS, repeats: int = 3) -> None:
+        unknown = set(kernels) - set(self.KERNELS)
+        if unknown:
+            raise ValueError(f"unknown kernels: {sorted(unknown)}")
+        self.sides = list(sides)
+        self.dtypes = [np.dtype(dtype).name for dtype in dtypes]
+        self.kernels = list(kernels)
+        self.repeats = max(repeats, 1)
+
+    @staticmethod
+    def synthetic_tile(side: int, seed: int = 0) -> npt.NDArray[Any]:
+        """Deterministic H&E-like (side, side, 3) uint8 tile: smooth stain concentrations
+        restored with DEFAULTS.he_ref, pixel noise and ~30 % bright background.
+        """
+        rng = np.random.default_rng(seed)
+        cells = side // 8 + 1
+        concentrations = rng.gamma(2, (0.35, 0.45), size=(cells, cells, 2))
+        concentrations[rng.random((cells, cells)) < 0.3] = 0
+        concentrations = np.repeat(np.repeat(concentrations, 8, axis=0), 8, axis=1)[:side, :side]
+        od = concentrations @ DEFAULTS.he_ref.astype(np.float64).T
+        rgb = DEFAULTS.normalising_c * np.exp(-od) - rng.integers(0, 12, size=od.shape)
+        return np.clip(rgb, 0, 255).astype(np.uint8)
+
+    def cases(self) -> Iterator[Tuple[str, int, str]]:
+        """kernel, side, dtype of every benchmark."""
+        for kernel in self.kernels:
+            for side in self.sides:
+                dtypes = self.dtypes if kernel in self.FLOAT_KERNELS else [self.FIXED_DTYPES[kernel]]
+                for dtype in dtypes:
+                    yield kernel, side, dtype
+
+    @staticmethod
+    def megapixels(kernel: str, side: int) -> float:
+        """Pixels processed by the kernel: the tile, or the table colours for colour_lut
+        (DEFAULTS.colour_lut_bits, 8 if off; independent of the tile side).
+        """
+        if kernel == "colour_lut":
+            bits = DEFAULTS.colour_lut_bits or 8
+            return (2 ** bits + (bits < 8)) ** 3 / 1e6
+        return side * side / 1e6
+
+    @staticmethod
+    def setup(kernel: str, tile: npt.NDArray[Any], work_path: Path) -> Callable[[], Any]:
+        """Inputs of the kernel prepared as in the pipeline (DEFAULTS.dtype already set);
+        returns the call to be timed.
+        """
+        side = tile.shape[0]
+        c = DEFAULTS.normalising_c
+        if kernel == "read_sector":
+            path = Path(work_path, "sector.tif")
+            pyvips.Image.new_from_memory(np.ascontiguousarray(tile).data, side, side,
+                                         bands=3, format="uchar").tiffsave(
+                str(path), tile=True, tile_width=256, tile_height=256,
+                compression="jpeg", Q=DEFAULTS.jpeg_quality)
+            slide = pyvips.Image.new_from_file(str(path))
+            return lambda: Normalisation.read_sector(slide, (0, 0), (side, side))
+        if kernel == "save_jpeg":
+            return lambda: Normalisation.save_jpeg(Path(work_path, "tile"), tile)
+        if kernel == "stitcher":
+            return KernelBenchmark.stitch_setup(tile, work_path)
+
+        img = tile.reshape((-1, 3))
+        if kernel == "convert_od":
+            return lambda: Normalisation.convert_od(img, c).astype(DEFAULTS.dtype)
+        od = Normalisation.convert_od(img, c).astype(DEFAULTS.dtype)
+        if kernel == "calculate_hem":
+            return lambda: Normalisation.calculate_hem(od, DEFAULTS.beta, DEFAULTS.alpha)
+        he = Normalisation.calculate_hem(od, DEFAULTS.beta, DEFAULTS.alpha)
+        y = np.reshape(od, (-1, 3)).T
+        if kernel == "nb_lstsq":
+            return lambda: Normalisation.nb_lstsq(y, he)
+        s_cut = Normalisation.nb_lstsq(y, he)
+        if kernel == "calculate_sp":
+            return lambda: Normalisation.calculate_sp(s_cut)
+        tmp = np.divide(Normalisation.calculate_sp(s_cut), DEFAULTS.max_s_ref).astype(DEFAULTS.dtype)
+        stain_types = DEFAULTS.stain_types()
+        if kernel == "fused_restore_multi":
+            tables = Normalisation.restore_tables(he, tmp, c, DEFAULTS.he_ref, stain_types)
+            return lambda: Normalisation.fused_restore_multi(tile, he, tmp, c, DEFAULTS.he_ref,
+                                                             stain_types, tables=tables)
+        bits = DEFAULTS.colour_lut_bits or 8
+        if kernel == "colour_lut":
+            return lambda: Normalisation.colour_lut(he, tmp, c, DEFAULTS.he_ref, stain_types, bits=bits)
+        if kernel == "lut_restore":
+            lut = Normalisation.colour_lut(he, tmp, c, DEFAULTS.he_ref, stain_types, bits=bits)
+            return lambda: Normalisation.lut_restore(tile, lut)
+        s2 = Normalisation.s_final(s_cut, tmp)
+        return lambda: Normalisation.image_restore(s2, c, DEFAULTS.he_ref, (side, side))
+
+    @staticmethod
+    def stitch_setup(tile: npt.NDArray[Any], work_path: Path) -> Callable[[], Any]:
+        """2x2 JPEG tiles of the tile stitched back to the whole tile (thumbnail disabled)."""
+        side = tile.shape[0]
+        half = side // 2
+        current_slide = CurrentSlide(slide_path=Path(work_path, "benchmark.svs"),
+                                     norm_path=work_path, temp_subpath=work_path,
+                                     wh=(half * 2, half * 2), mn=(2, 2))
+        current_slide.tile_map = OrderedDict()
+        for i, (top, left) in enumerate(((0, 0), (0, half), (half, 0), (half, half))):
+            current_slide.tile_map[i] = ((left, top), (half, half))
+            Normalisation.save_jpeg(Path(work_path, f"{i}_norm"),
+                                    np.ascontiguousarray(tile[top:top + half, left:left + half]))
+
+        def stitch() -> None:
+            thumbnail, DEFAULTS.thumbnail = DEFAULTS.thumbnail, False
+            try:
+                SlideTiler.stitcher("norm", current_slide)
+            finally:
+                DEFAULTS.thumbnail = thumbnail
+        return stitch
+
+    def measure(self, call: Callable[[], Any], megapixels: float) -> Dict[str, float]:
+        """Best of the timed runs (after a warm-up run compiling the numba kernels)
+        and the peak allocations traced during one more run.
+        """
+        call()
+        seconds = []
+        for _ in range(self.repeats):
+            start = perf_counter()
+            call()
+            seconds.append(perf_counter() - start)
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        best = min(seconds)
+        return {"seconds": best,
+                "mpix_s": megapixels / best if best > 0 else float("inf"),
+                "peak_mb": peak / 1024 ** 2}
+
+    def run(self) -> List[Dict[str, Any]]:
+        """Results of all cases."""
+        results = []
+        dtype = DEFAULTS.dtype
+        with tempfile.TemporaryDirectory(prefix="dogsled_benchmark_") as work_dir:
+            try:
+                for kernel, side, case_dtype in self.cases():
+                    DEFAULTS.dtype = (np.dtype(case_dtype).type if kernel in self.FLOAT_KERNELS
+                                      else dtype)
+                    tile = self.synthetic_tile(side)
+                    megapixels = self.megapixels(kernel, side)
+                    LOGGER.info(f"benchmarking {kernel} ({side} px, {case_dtype})")
+                    result = {"kernel": kernel, "side": side, "dtype": case_dtype,
+                              "megapixels": megapixels}
+                    result.update(self.measure(self.setup(kernel, tile, Path(work_dir)), megapixels))
+                    results.append(result)
+            finally:
+                DEFAULTS.dtype = dtype
+        return results
+
+    @staticmethod
+    def key(result: Dict[str, Any]) -> Tuple[str, int, str]:
+        """Identity of a benchmark case."""
+        return result["kernel"], result["side"], result["dtype"]
+
+    @staticmethod
+    def save(path: Union[str, Path], results: List[Dict[str, Any]]) -> None:
+        """Save results as a baseline JSON."""
+        with open(path, "w", encoding="utf-8") as baseline:
+            json.dump({"results": results}, baseline, indent=2)
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> List[Dict[str, Any]]:
+        """Results of a baseline JSON."""
+        with open(path, "r", encoding="utf-8") as baseline:
+            return json.load(baseline)["results"]
+
+    @staticmethod
+    def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                tolerance: float = 0.25) -> List[str]:
+        """Regressions against the baseline: throughput lower or peak memory higher than
+        the baseline by more than tolerance (fraction); cases missing in the baseline are ignored.
+        """
+        baseline_results = {KernelBenchmark.key(result): result for result in baseline}
+        regressions = []
+        for result in results:
+            base = baseline_results.get(KernelBenchmark.key(result))
+            if base is None:
+                continue
+            name = "{} {} px {}".format(*KernelBenchmark.key(result))
+            if result["mpix_s"] < base["mpix_s"] * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {result['mpix_s']:.1f} MPix/s (baseline {base['mpix_s']:.1f})")
+            if result["peak_mb"] > base["peak_mb"] * (1 + tolerance) + 1:
+                regressions.append(
+                    f"{name}: peak {result['peak_mb']:.1f} MB (baseline {base['peak_mb']:.1f})")
+        return regressions
+
+    @staticmethod
+    def table(results: List[Dict[str, Any]],
+              baseline: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Results as a text table (with the throughput change against the baseline)."""
+        baseline_results = {KernelBenchmark.key(result): result for result in baseline or []}
+        lines = [f"{'kernel':<20}{'side':>6}{'dtype':>9}{'ms':>11}{'MPix/s':>10}{'peak MB':>10}"
+                 + (f"{'change':>9}" if baseline else "")]
+        for result in results:
+            line = (f"{result['kernel']:<20}{result['side']:>6}{result['dtype']:>9}"
+                    f"{result['seconds'] * 1000:>11.2f}{result['mpix_s']:>10.1f}{result['peak_mb']:>10.1f}")
+            base = baseline_results.get(KernelBenchmark.key(result))
+            if base:
+                line += f"{(result['mpix_s'] / base['mpix_s'] - 1) * 100:>+8.1f}%"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+@contextmanager
+def defaults_override(**values: Any) -> Iterator[None]:
+    """Temporarily set DEFAULTS attributes."""
+    previous = {name: getattr(DEFAULTS, name) for name in values}
+    for name, value in values.items():
+        setattr(DEFAULTS, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(DEFAULTS, name, value)
+
+
+class StageTimer:
+    """Wall time spent in the pipeline stages, summed over all threads (stage totals
+    of a MetricsRecorder).
+    The stage functions are wrapped only while the timer is active; a stage called
+    from within another stage in the same thread (e.g. the JPEG save of the stitcher)
+    is counted as part of the outer stage.
+    """
+
+    STAGES = {"read": [(Normalisation, "read_sector")],
+              "estimate": [(Normalisation, "region_s")],
+              "restore": [(Normalisation, "fused_restore"), (Normalisation, "fused_restore_multi"),
+                          (Normalisation, "lut_restore"), (Normalisation, "colour_lut"),
+                          (Normalisation, "vips_restore")],
+              "encode": [(Normalisation, "save_jpeg"), (RawTileStore, "write")],
+              "stitch": [(SlideTiler, "jpeg_stitcher"), (SlideTiler, "vips_writer"),
+                         (SlideTiler, "save_tif")],
+              "thumbnail": [(SlideTiler, "thumbnail_from_image"), (SlideTiler, "thumbnail_from_np")],
+              "tissue": [(SlideTiler, "tissue_mask")]}
+
+    def __init__(self) -> None:
+        # stage events are only totalled in memory (no events file)
+        self.metrics = MetricsRecorder(collect=True)
+        self.active = threading.local()
+
+    @property
+    def seconds(self) -> Dict[str, float]:
+        """Wall time of every stage."""
+        with self.metrics.lock:
+            return {stage: self.metrics.totals.get(stage, {}).get("seconds", 0.0)
+                    for stage in self.STAGES}
+
+    def wrap(self, stage: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """func timed as stage (unless another stage is running in the thread)."""
+        @wraps(func)
+        def timed(*args, **kwargs):
+            if getattr(self.active, "stage", None):
+                return func(*args, **kwargs)
+            self.active.stage = stage
+            try:
+                with self.metrics.stage(stage):
+                    return func(*args, **kwargs)
+            finally:
+                self.active.stage = None
+        return timed
+
+    @contextmanager
+    def timing(self) -> Iterator["StageTimer"]:
+        """Wrap the stage functions, restore them afterwards."""
+        stages = {(cls, name): stage for stage, functions in self.STAGES.items()
+                  for cls, name in functions}
+        with wrapped(stages, lambda cls, name, func: self.wrap(stages[cls, name], func)):
+            yield self
+
+
+class RSSSampler:
+    """Peak resident set size of the process, sampled in a background thread."""
+
+    def __init__(self, interval: float = 0.02) -> None:
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        """Keep the highest RSS until stopped."""
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self) -> "RSSSampler":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+class PipelineBenchmark:
+    """Normalise one slide with every combination of tile side, tile workers and output mode;
+    results are dicts: mode, side, workers, seconds, megapixels, mpix_s, peak_rss_mb,
+    temp_bytes, tiles and seconds per stage.
+    """
+
+    # DEFAULTS of the output modes
+    MODES = {"jpeg": {"vips_stitcher": False},
+             "tif": {"vips_stitcher": True},
+             "raw": {"vips_stitcher": True, "temp_tile_format": "raw"},
+             "stream": {"stream_tiles": True}}
+
+    def __init__(self, slide_path: Path, sides: Sequence[Union[int, str]] = (2048, 4096),
+                 workers: Sequence[int] = (1, 2), modes: Sequence[str] = ("jpeg", "tif"),
+                 work_path: Optional[Path] = None) -> None:
+        unknown = set(modes) - set(self.MODES)
+        if unknown:
+            raise ValueError(f"unknown output modes: {sorted(unknown)}")
+        self.slide_path = Path(slide_path)
+        self.sides = list(sides)
+        self.workers = list(workers)
+        self.modes = list(modes)
+        self.work_path = work_path
+
+    @classmethod
+    def synthetic(cls, width: int, height: int, work_path: Path, seed: int = 0,
+                  **kwargs: Any) -> "PipelineBenchmark":
+        """Benchmark of a synthetic slide written to work_path."""
+        slide_path = Path(work_path, f"synthetic-{width}x{height}-{seed}.svs")
+        if not slide_path.exists():
+            SyntheticSlide(width, height, seed=seed).save(slide_path)
+        return cls(slide_path, work_path=work_path, **kwargs)
+
+    @staticmethod
+    def folder_bytes(path: Path) -> int:
+        """Total size of the files in the folder."""
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+    def run_once(self, side: Union[int, str], workers: int, mode: str,
+                 work_path: Path) -> Dict[str, Any]:
+        """Normalise the slide once; side "auto" plans the tile side (DEFAULTS.tile_autotune)."""
+        norm_path = Path(work_path, f"{mode}_{side}_{workers}")
+        norm_path.mkdir(parents=True)
+        timer = StageTimer()
+        try:
+            with defaults_override(tile_workers=workers, tile_autotune=side == "auto",
+                                   remove_temporary_files=False, resume=False,
+                                   **self.MODES[mode]):
+                normaliser = NormaliseSlides(source_path=self.slide_path.parent,
+                                             slide_names=self.slide_path.name,
+                                             norm_path=norm_path,
+                                             rewrite=True)
+                if side != "auto":
+                    normaliser.max_side_px = int(side)
+                with timer.timing(), RSSSampler() as rss:
+                    start = perf_counter()
+                    normaliser.start()
+                    seconds = perf_counter() - start
+            width, height = normaliser.current_slide.wh
+            temp_path = Path(norm_path, DEFAULTS.temporary_folder_name)
+            temp_bytes = self.folder_bytes(temp_path) if temp_path.exists() else 0
+        finally:
+            # the log file added by NormaliseSlides points into the removed folder
+            PROCESS_LOGGER.close_log_file(Path(norm_path, "dogsled.log"))
+            shutil.rmtree(norm_path, ignore_errors=True)
+        megapixels = width * height / 1e6
+        return {"mode": mode, "side": normaliser.current_slide.max_side_px, "workers": workers,
+                "seconds": seconds, "megapixels": megapixels, "mpix_s": megapixels / seconds,
+                "peak_rss_mb": rss.peak / 1024 ** 2, "temp_bytes": temp_bytes,
+                "tiles": len(normaliser.current_slide.tile_map), "stages": timer.seconds}
+
+    def run(self) -> List[Dict[str, Any]]:
+        """Results of all combinations."""
+        results = []
+        with tempfile.TemporaryDirectory(prefix="dogsled_bench_", dir=self.work_path) as work_dir:
+            for mode, side, workers in itertools.product(self.modes, self.sides, self.workers):
+                LOGGER.info(f"benchmarking {self.slide_path.name}: {mode}, {side} px, {workers} workers")
+                results.append(self.run_once(side, workers, mode, Path(work_dir)))
+        return results
+
+    @staticmethod
+    def save(path: Union[str, Path], slide_path: Path, results: List[Dict[str, Any]]) -> None:
+        """Save the results as JSON."""
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump({"slide": str(slide_path), "results": results}, output, indent=2)
+
+    @staticmethod
+    def table(results: List[Dict[str, Any]]) -> str:
+        """Results as a text table (seconds per stage summed over the threads)."""
+        stages = list(StageTimer.STAGES)
+        lines = [f"{'mode':<8}{'side':>7}{'workers':>8}{'tiles':>7}{'s':>9}{'MPix/s':>9}"
+                 f"{'RSS MB':>9}{'temp MB':>9}" + "".join(f"{stage:>10}" for stage in stages)]
+        for result in results:
+            lines.append(f"{result['mode']:<8}{result['side']:>7}{result['workers']:>8}"
+                         f"{result['tiles']:>7}{result['seconds']:>9.2f}{result['mpix_s']:>9.1f}"
+                         f"{result['peak_rss_mb']:>9.0f}{result['temp_bytes'] / 1024 ** 2:>9.1f}"
+                         + "".join(f"{result['stages'][stage]:>10.2f}" for stage in stages))
+        return "\n".join(lines)
+
+
+class MemoryCalibration:
+    """Bytes per tile pixel of the tile stages (ResourceEstimator.MEMORY_MODEL) measured on
+    a synthetic tile: every stage is run as in the pipeline (RGBA sector as read from OpenSlide,
+    fresh worker arena) and its peak growth of the traced allocations (NumPy) or of the RSS
+    (libvips, numba), whichever is larger, is divided by the tile pixels.
+    The restore is measured for one and for all three stain types: the growth per stain type
+    is the restore coefficient, the rest (contiguous copy of the sector) is added to scratch.
+    """
+
+    STAIN_TYPES = ("norm", "he", "eo")
+
+    def __init__(self, side: int = 2048) -> None:
+        self.side = side
+
+    @staticmethod
+    def peak_growth(call: Callable[[], Any]) -> int:
+        """Peak bytes allocated by the call (after a warm-up call compiling the numba kernels)."""
+        call()
+        tracemalloc.start()
+        try:
+            rss = psutil.Process().memory_info().rss
+            with RSSSampler(interval=0.005) as sampler:
+                call()
+            _, traced = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return max(traced, sampler.peak - rss)
+
+    @staticmethod
+    def sector_bytes(img: npt.NDArray[Any]) -> int:
+        """Size of the buffer the sector is a view of (allocated by libvips => not traced);
+        kept while the tile is processed.
+        """
+        while isinstance(img.base, np.ndarray):
+            img = img.base
+        return img.nbytes
+
+    def run(self) -> Dict[str, float]:
+        """Bytes per pixel of read, estimate, restore & scratch."""
+        side = self.side
+        pixels = side * side
+        c = DEFAULTS.normalising_c
+        tile = KernelBenchmark.synthetic_tile(side)
+        with tempfile.TemporaryDirectory(prefix="dogsled_memory_") as work_dir:
+            path = Path(work_dir, "sector.tif")
+            rgba = np.concatenate([tile, np.full((side, side, 1), 255, dtype=np.uint8)], axis=2)
+            pyvips.Image.new_from_memory(rgba.data, side, side, bands=4, format="uchar").tiffsave(
+                str(path), tile=True, tile_width=256, tile_height=256)
+            slide = pyvips.Image.new_from_file(str(path))
+            img = Normalisation.read_sector(slide, (0, 0), (side, side))
+            read = max(self.peak_growth(lambda: Normalisation.read_sector(slide, (0, 0), (side, side))),
+                       self.sector_bytes(img))
+            estimate = self.peak_growth(lambda: Normalisation.region_s(
+                img, c, DEFAULTS.alpha, DEFAULTS.beta, DEFAULTS.max_s_ref))
+            _, tmp, he = Normalisation.region_s(img, c, DEFAULTS.alpha, DEFAULTS.beta, DEFAULTS.max_s_ref)
+            restore = {}
+            for stain_types in (self.STAIN_TYPES[:1], self.STAIN_TYPES):
+                tables = Normalisation.restore_tables(he, tmp, c, DEFAULTS.he_ref, stain_types)
+                restore[len(stain_types)] = self.peak_growth(lambda: Normalisation.fused_restore_multi(
+                    img, he, tmp, c, DEFAULTS.he_ref, stain_types, tables=tables,
+                    out=ScratchArena().array("tiles", (len(stain_types), side, side, 3), np.uint8)))
+        per_stain_type = (restore[3] - restore[1]) / 2
+        background = self.peak_growth(lambda: ScratchArena().array("tile", (side, side, 3), np.uint8))
+        return {"read": read / pixels, "estimate": estimate / pixels,
+                "restore": per_stain_type / pixels,
+                "scratch": (restore[1] - per_stain_type + background) / pixels}
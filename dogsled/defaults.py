@@ -23,6 +23,16 @@ DEFAULTS_VALS = {
     "show_results": False,
     "ram_megapixel": {12000: 12000,
                       12001: 24500},  # {MB: pixel} under 8000MB: 12000px; over: 24500px
+    # tiles normalised in parallel after the reference tile (limited by RAM)
+    "tile_workers": 1,
+    "worker_memory_mb": None,  # None: estimated from the tile size
+    # slides normalised at once (admitted while their estimated peak RAM fits the budget)
+    "slide_workers": 1,
+    "memory_budget_mb": None,  # None: available RAM (limited by the cgroup memory limit)
+    # tile side planned from the memory model & budget instead of ram_megapixel
+    "tile_autotune": False,
+    "memory_headroom": 0.8,  # fraction of the budget the planned tiles may use
+    "memory_model": None,  # {stage: bytes per pixel} overriding the built-in model
     # normalisation parameters:
     # "output_type": [StainTypes.norm, StainTypes.he, StainTypes.eo],
     "output_type": [StainTypes.norm],
@@ -32,17 +42,58 @@ DEFAULTS_VALS = {
     # (alpha_th - (100 - alpha_th)) percentiles for stain vectors
     "alpha": 0.0001,
     "beta": 0.0015,  # threshold value for for pixels with low OD values
+    # histogram percentile error; 0: exact (same as np.percentile)
+    "percentile_tolerance": 0.0,
     "temporary_folder_name": "dogsled_temp",
     "remove_temporary_files": True,
+    # "jpeg": one JPEG per tile; "raw": lossless memory-mapped canvas per stain type
+    "temp_tile_format": "jpeg",
+    # finished tiles/slides (recorded in a manifest per slide) are skipped on restart
+    "resume": False,
     "jpeg_quality": 95,
     "vips_tiff_compression": "lzw",
+    # TIF pyramid levels written in the same pass; "aperio" (spoofed description) or "ome" layout
+    "tiff_pyramid": False,
+    "tiff_format": "aperio",
     "thumbnail": True,
     "thumbnail_max_side": 6000,
     "vips_stitcher": False,
+    # normalised tiles are streamed into a pyramidal TIF (no temporary tiles or stitching)
+    "stream_tiles": False,
     "OpenSlide_formats": [".svs", ".tif", ".tiff", ".scn",
                           ".vms", ".vmu", ".ndpi", ".mrxs",
                           ".svslide", ".bif"],
     "first_tile": "middle",
+    # tiles without tissue on the thumbnail are written as constant background
+    "tissue_mask": False,
+    # pixels with all channels >= this value are treated as background
+    "background_intensity": 220,
+    # he/tmp estimation: "tile" (first tile), "level" (low resolution slide) or "sampled"
+    "stain_estimation": "tile",
+    # "numpy": tiles normalised with numba & stitched; "vips": whole slide as a lazy libvips pipeline
+    "engine": "numpy",
+    # numpy engine: 0 computes every pixel; 8 maps the pixels through a 256^3 colour table per slide,
+    # 4-7 through a quantised table (2^bits + 1 nodes per channel, trilinear interpolation)
+    "colour_lut_bits": 0,
+    "estimation_max_side": 4096,
+    "estimation_samples": 16,
+    "estimation_sample_side": 1024,
+    # he/tmp of normalised slides kept on disk; None: user cache folder
+    "stain_cache": False,
+    "stain_cache_path": None,
+    "stain_cache_entries": 1000,
+    "stain_cache_key": "stat",  # "stat": path, size & mtime; "content": size & md5 of the file ends
+    # stage events in norm_path/metrics.jsonl; totals per stage as Prometheus textfile (None: off)
+    "metrics": False,
+    "metrics_prometheus_path": None,
+    # Chrome/Perfetto trace of the stages (None: norm_path/trace.json)
+    "trace": False,
+    "trace_path": None,
+    # "cprofile" (per slide), "tracemalloc" (per stage), "line" (@profile functions);
+    # also set by the DOGSLED_PROFILE environment variable, e.g. DOGSLED_PROFILE=cprofile,line
+    "profiling": [],
+    # minimal number of seconds between the tile status messages (0: every message)
+    "log_interval": 0.5,
     "libvips_url": "https://github.com/libvips/build-win64-mxe/releases/download/v8.12.0/vips-dev-w64-web-8.12.0-static.zip",
     "libvips_md5": "9a5dc27f6e9aae423ea620447dc67f1e"
 }
@@ -70,8 +121,8 @@ class Defaults:
     """Class for holding explicit attributes
     will not allow the user set an incorrect attribute e.g. misspell
     """
-    __slots__ = ['show_results', 'ram_megapixel', 'output_type', 'dtype', 'numba_dtype', 'normalising_c', 'alpha', 'beta', 'temporary_folder_name', 'remove_temporary_files',
-                 'jpeg_quality', 'vips_tiff_compression', 'thumbnail', 'thumbnail_max_side', 'vips_stitcher', 'OpenSlide_formats', 'first_tile', 'libvips_url', 'libvips_md5', 'he_ref', 'max_s_ref']
+    __slots__ = ['show_results', 'ram_megapixel', 'tile_workers', 'worker_memory_mb', 'slide_workers', 'memory_budget_mb', 'tile_autotune', 'memory_headroom', 'memory_model', 'output_type', 'dtype', 'numba_dtype', 'normalising_c', 'alpha', 'beta', 'percentile_tolerance', 'temporary_folder_name', 'remove_temporary_files', 'temp_tile_format', 'resume',
+                 'jpeg_quality', 'vips_tiff_compression', 'tiff_pyramid', 'tiff_format', 'thumbnail', 'thumbnail_max_side', 'vips_stitcher', 'stream_tiles', 'OpenSlide_formats', 'first_tile', 'tissue_mask', 'background_intensity', 'stain_estimation', 'engine', 'colour_lut_bits', 'estimation_max_side', 'estimation_samples', 'estimation_sample_side', 'stain_cache', 'stain_cache_path', 'stain_cache_entries', 'stain_cache_key', 'metrics', 'metrics_prometheus_path', 'trace', 'trace_path', 'profiling', 'log_interval', 'libvips_url', 'libvips_md5', 'he_ref', 'max_s_ref']
 
     def __init__(self, defaults_dict) -> None:
         """Take dictionary as an input, assign atributes & their values"""
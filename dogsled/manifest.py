@@ -0,0 +1,100 @@
+"""Per-slide tile manifest.
+Append-only JSON lines file in the temporary subfolder of the slide recording the tile grid,
+the slide-specific stain parameters, every finished tile (with the checksum of its output)
+and whether the slide was finished => an interrupted normalisation can be resumed.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TileManifest:
+    """Manifest of one slide; records are flushed to disk one by one (crash-safe)."""
+
+    file_name = "manifest.jsonl"
+
+    def __init__(self, temp_subpath: Path) -> None:
+        self.path = Path(temp_subpath, self.file_name)
+        self.lock = threading.Lock()
+        self.grid: Optional[Dict[str, Any]] = None
+        self.stains: Optional[Tuple[npt.NDArray[Any], npt.NDArray[Any]]] = None
+        self.tiles: Dict[Tuple[int, str], str] = {}
+        self.finished = False
+        self.load()
+
+    def load(self) -> None:
+        """Read the records written so far; a truncated last record is ignored."""
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as manifest:
+            for line in manifest:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    LOGGER.warning(f"ignoring incomplete manifest record in {self.path}")
+                    break
+                if "grid" in record:
+                    self.grid = record["grid"]
+                elif "he" in record:
+                    self.stains = (np.array(record["he"]),
+                                   np.array(record["tmp"], dtype=np.float32))
+                elif "tile" in record:
+                    self.tiles[(record["tile"], record["stain_type"])] = record["md5"]
+                elif record.get("finished"):
+                    self.finished = True
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append one record and make sure it is on disk."""
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as manifest:
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+    def start(self, grid: Dict[str, Any]) -> bool:
+        """Continue the manifest if it was written for the same tile grid, reset it otherwise.
+        Returns True if the manifest is continued.
+        """
+        if self.grid == grid:
+            return True
+        if self.path.exists():
+            LOGGER.warning("tile grid changed, previously normalised tiles are not reused")
+            self.path.unlink()
+        self.grid, self.stains, self.tiles, self.finished = grid, None, {}, False
+        self.append({"grid": grid})
+        return False
+
+    def set_stains(self, he: npt.NDArray[Any], tmp: npt.NDArray[Any]) -> None:
+        """Record the stain parameters used for all tiles of the slide."""
+        self.stains = (he, tmp)
+        self.append({"he": np.asarray(he).tolist(), "tmp": np.asarray(tmp).tolist()})
+
+    def add(self, tile: int, stain_type: str, md5: str) -> None:
+        """Record a finished tile."""
+        self.tiles[(tile, stain_type)] = md5
+        self.append({"tile": tile, "stain_type": stain_type, "md5": md5})
+
+    def done(self, tile: int, stain_type: str, md5: Optional[str]) -> bool:
+        """Whether the tile was finished and its output is still the same."""
+        return md5 is not None and self.tiles.get((tile, stain_type)) == md5
+
+    def finish(self) -> None:
+        """Record that the slide was normalised."""
+        self.finished = True
+        self.append({"finished": True})
+
+    @staticmethod
+    def checksum(data: Any) -> str:
+        """md5 of bytes or of a (C-contiguous) array."""
+        if isinstance(data, np.ndarray):
+            data = memoryview(np.ascontiguousarray(data)).cast("B")
+        return hashlib.md5(data).hexdigest()
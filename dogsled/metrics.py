@@ -0,0 +1,99 @@
+"""Structured normalisation metrics.
+Every slide and tile stage (read, estimate, restore, encode, stitch...) is recorded as a JSON lines
+event with its duration, pixel count and bytes read/written; totals per stage can be exported
+as a Prometheus textfile (node_exporter textfile collector) => throughput and slow stages
+can be monitored across many slides.
+"""
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, Optional, Union
+
+from dogsled.defaults import DEFAULTS
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MetricsRecorder:
+    """Stage events of the normalised slides; nothing is recorded if disabled."""
+
+    file_name = "metrics.jsonl"
+    # event field, Prometheus metric name, help text
+    TOTALS = (("calls", "dogsled_stage_calls_total", "Number of times the stage was run."),
+              ("seconds", "dogsled_stage_seconds_total", "Wall time spent in the stage."),
+              ("pixels", "dogsled_stage_pixels_total", "Pixels processed by the stage."),
+              ("bytes_read", "dogsled_stage_bytes_read_total", "Bytes read by the stage."),
+              ("bytes_written", "dogsled_stage_bytes_written_total", "Bytes written by the stage."),
+              ("errors", "dogsled_stage_errors_total", "Number of times the stage failed."))
+
+    def __init__(self, path: Optional[Union[str, Path]] = None,
+                 prometheus_path: Optional[Union[str, Path]] = None,
+                 collect: bool = False) -> None:
+        self.path = Path(path) if path else None
+        self.prometheus_path = Path(prometheus_path) if prometheus_path else None
+        # collect: totals are kept in memory even without any output
+        self.enabled = bool(self.path or self.prometheus_path or collect)
+        self.lock = threading.Lock()
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_defaults(cls, norm_path: Path) -> "MetricsRecorder":
+        """Events in norm_path/metrics.jsonl if DEFAULTS.metrics,
+        Prometheus textfile at DEFAULTS.metrics_prometheus_path.
+        """
+        path = Path(norm_path, cls.file_name) if DEFAULTS.metrics else None
+        return cls(path, DEFAULTS.metrics_prometheus_path)
+
+    @contextmanager
+    def stage(self, stage: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Time the block as one stage event; fields (slide, tile, stain_type, pixels,
+        bytes_read, bytes_written...) can also be added to the yielded dict within the block.
+        """
+        if not self.enabled:
+            yield fields
+            return
+        timestamp = time()
+        start = perf_counter()
+        try:
+            yield fields
+        except BaseException as error:
+            fields["error"] = type(error).__name__
+            raise
+        finally:
+            self.record(dict(stage=stage, ts=timestamp, seconds=perf_counter() - start,
+                             thread=threading.current_thread().name, pid=os.getpid(), **fields))
+
+    def record(self, event: Dict[str, Any]) -> None:
+        """Add the event to the totals of its stage and append it to the events file."""
+        with self.lock:
+            totals = self.totals.setdefault(event["stage"],
+                                            {field: 0 for field, _, _ in self.TOTALS})
+            totals["calls"] += 1
+            totals["errors"] += "error" in event
+            for field in ("seconds", "pixels", "bytes_read", "bytes_written"):
+                totals[field] += event.get(field) or 0
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as events:
+                    events.write(json.dumps(event, default=str) + "\n")
+
+    def prometheus(self) -> str:
+        """Totals in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for field, name, help_text in self.TOTALS:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f'{name}{{stage="{stage}"}} {totals[field]}'
+                          for stage, totals in sorted(self.totals.items())]
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> None:
+        """Write the Prometheus textfile (atomically => never read half-written)."""
+        if not self.prometheus_path:
+            return
+        temp_path = self.prometheus_path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(self.prometheus(), encoding="utf-8")
+        os.replace(temp_path, self.prometheus_path)
@@ -1,16 +1,25 @@
 """Normaliser."""
 import os
+import copy
 import platform
 import logging
-from time import time
+import queue
+import atexit
+import threading
+import itertools
+import logging.handlers
+from time import time, monotonic
 from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Union, Any, Tuple, List
+from typing import Optional, Union, Any, Tuple, List, Dict, Iterator, ContextManager, Sequence, Callable
 
 import numpy as np
 import numpy.typing as npt
 import numba as nb
 import numexpr as ne
+from scipy import ndimage
 
 from dogsled.user_input import FileData
 from dogsled.defaults import DEFAULTS
@@ -18,6 +27,15 @@ from dogsled.errors import CleaningError, UserInputError, LibVipsError
 from dogsled.paths import PathCreator
 from dogsled.slides import CurrentSlide
 from dogsled.resources import ResourceChecker
+from dogsled.scheduler import SlideScheduler
+from dogsled.streaming import TileStream, RowFanOut
+from dogsled.tilestore import RawTileStore
+from dogsled.manifest import TileManifest
+from dogsled.stain_cache import StainCache
+from dogsled.metrics import MetricsRecorder
+from dogsled.tracing import Tracer
+from dogsled.profiling import Profiler, profile
+from dogsled.scratch import ScratchArena, ScratchPool
 from dogsled.libvips_downloader import GetLibvips
 
 LOGGER = logging.getLogger(__name__)
@@ -52,31 +70,60 @@ except ModuleNotFoundError:  # pragma: no cover
         pass
 
 
-if "line_profiler" not in dir() and "profile" not in dir():
-    def profile(func):
-        """Line_profiler/memory_profiler decorator deactivation."""
-        return func
-
 # yet to be done
-# TODO further profile
 # TODO add more tests
 
 
+class RootForwarder(logging.Handler):
+    """Hand queued records to the root logger handlers (terminal, pytest etc.)
+    as if they propagated from the original logger.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger().callHandlers(record)
+
+
 class ProcessLogger:
     """Class for user-friendly logging.
     - regular logging with newlines in terminal
-    - logging with clearing previous output in Jupyter.
+    - logging with clearing previous output in Jupyter
+    - slide/tile progress is kept per thread (several slides may be normalised at once)
+    - records are only queued by the normalising threads; a background listener (started with
+      the first record or log file) writes them to the terminal and log files
+    - per-tile progress messages are rate-limited to one per DEFAULTS.log_interval in every thread,
+      status messages and other records are always written
+    - tile worker threads log with the slide progress of the thread which started them.
     """
 
     def __init__(self, logger: logging.Logger) -> None:
         self.logger = logger
-        self.slide_name = None  # for testing runs set initially to None
         self.slide_names = None
-        self.slide_n = None
-        self.tiles = None
+        # slide_name, slide_n, tile_n, tiles of the slide processed by the thread
+        # ..and last_progress: time of the last progress message of the thread
+        self.progress = threading.local()
+        # log file path: handler (one per path, however many normalisers are created)
+        self.log_files: Dict[str, logging.Handler] = {}
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, RootForwarder(),
+                                                       respect_handler_level=True)
+        self.logger.addHandler(logging.handlers.QueueHandler(self.queue))
+        self.logger.propagate = False  # root handlers are called by the listener
+        self.running = False
+
+    def start(self) -> None:
+        """Start the background listener (records queued so far are written)."""
+        if self.running:
+            return
+        with self.lock:
+            if not self.running:
+                self.listener.start()
+                atexit.register(self.close)  # write the queued records at exit
+                self.running = True
 
     def info_regular(self, message: str):
         """For regular .info logging."""
+        self.start()
         self.logger.info(message)
 
     def slide_list(self, slides: List[Path]) -> None:
@@ -88,36 +135,120 @@ class ProcessLogger:
         """Current slide info: current tile, slide name,
         slide"s order within all other slides.
         """
-        self.tile_n = 0  # starting tile number; set to 0 with each next slide
-        self.slide_name = slide.name
-        self.slide_n = self.slide_names.index(slide.name)
+        self.progress.tile_n = 0  # starting tile number; set to 0 with each next slide
+        self.progress.slide_name = slide.name
+        self.progress.slide_n = self.slide_names.index(slide.name)
 
     def total_tiles(self, tiles):
         """Total number of tiles of the current slide."""
-        self.tiles = len(tiles)
+        self.progress.tiles = len(tiles)
 
     def next_tile(self):
         """Currently processed tile number increment."""
-        self.tile_n += 1
+        self.progress.tile_n += 1
+
+    # slide progress handed over to the worker threads
+    CONTEXT = ("slide_name", "slide_n", "tiles", "tile_n")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Slide progress of the calling thread for tile_context (the tiles of the workers
+        are counted on from the current tile).
+        """
+        context = {name: getattr(self.progress, name, None) for name in self.CONTEXT}
+        context["counter"] = itertools.count((context["tile_n"] or 0) + 1)
+        return context
+
+    @contextmanager
+    def tile_context(self, context: Dict[str, Any]) -> Iterator[None]:
+        """Log the block (the next tile, usually in a worker thread) with the slide progress
+        of the snapshot; the previous progress of the thread is restored afterwards.
+        """
+        previous = {name: getattr(self.progress, name, None) for name in self.CONTEXT}
+        for name in self.CONTEXT:
+            setattr(self.progress, name, context[name])
+        self.progress.tile_n = next(context["counter"])  # atomic => unique tile numbers
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                setattr(self.progress, name, value)
+
+    def progress_info(self, message: str):
+        """Per-tile progress (at most one message per DEFAULTS.log_interval seconds
+        in every thread, see info).
+        """
+        now = monotonic()
+        if now - getattr(self.progress, "last_progress", float("-inf")) < DEFAULTS.log_interval:
+            return
+        self.progress.last_progress = now
+        self.info(message)
 
     def info(self, message: str):
         """Main status logger.
         Format: Slide 1/12 SlideName.svs tile 1/12 operation_name.
         """
-        if not self.slide_name:  # for testing runs or status logging outside of normalisation
+        progress = self.progress
+        self.start()
+        # for testing runs or status logging outside of normalisation
+        if not getattr(progress, "slide_name", None):
             self.info_regular(message)
         else:  # formatted logging when slide actually normalised
             self.logger.info(
-                f"Slide {self.slide_n + 1}/{len(self.slide_names)} {self.slide_name} tile {self.tile_n}/{self.tiles} {message}")
+                f"Slide {progress.slide_n + 1}/{len(self.slide_names)} {progress.slide_name} tile {progress.tile_n}/{progress.tiles} {message}")
         clear_output(wait=True)
 
     def warning(self, message: str):
         """Regular .warning logging."""
+        self.start()
         self.logger.warning(message)
 
     def addHandler(self, handler):
-        """For adding file handler while normalising."""
-        self.logger.addHandler(handler)
+        """Add a handler written by the background listener."""
+        with self.lock:
+            self.listener.handlers += (handler,)
+
+    def removeHandler(self, handler):
+        """Remove a handler added using addHandler."""
+        with self.lock:
+            self.listener.handlers = tuple(listener_handler for listener_handler in self.listener.handlers
+                                           if listener_handler is not handler)
+
+    def log_file(self, path: Path) -> None:
+        """Also log into the file (once, if several normalisers log into the same file)."""
+        path = str(Path(path).resolve())
+        with self.lock:
+            if path in self.log_files:
+                return
+            file_handler = logging.FileHandler(path)
+            file_handler.setLevel(logging.INFO)
+            file_handler.setFormatter(logging.Formatter(
+                "%(asctime)s %(module)s %(levelname)s: [ %(message)s ]", "%m/%d/%Y %I:%M:%S %p"))
+            self.log_files[path] = file_handler
+        self.addHandler(file_handler)
+        self.start()
+
+    def close_log_file(self, path: Path) -> None:
+        """Stop logging into the file (queued records are written first)."""
+        self.flush()
+        file_handler = self.log_files.pop(str(Path(path).resolve()), None)
+        if file_handler:
+            self.removeHandler(file_handler)
+            file_handler.close()
+
+    def flush(self) -> None:
+        """Wait until all queued records are written."""
+        with self.lock:
+            if self.running:
+                self.listener.stop()
+                self.listener.start()
+
+    def close(self) -> None:
+        """Write the queued records and stop the listener."""
+        atexit.unregister(self.close)
+        with self.lock:
+            if self.running:
+                self.listener.stop()
+                self.running = False
 
 
 LOGGER = ProcessLogger(LOGGER)
@@ -131,7 +262,7 @@ class Normalisation:
     def read_sector(slide: pyvips.vimage.Image, location: Tuple[int, int],
                     size_wh: Tuple[int, int]) -> npt.NDArray[Any]:
         """Read a slide sector, swap the channels, return as numpy array."""
-        LOGGER.info("reading slide sector")
+        LOGGER.progress_info("reading slide sector")
         left, top = location  # inversed for pyvips?
         width, height = size_wh
 
@@ -142,10 +273,12 @@ class Normalisation:
         return img[..., 0:3].reshape((-1, 3))
 
     @staticmethod
-    def convert_od(img, normalising_c):
+    def convert_od(img, normalising_c, out=None):
         """Normalise the RGB raw values, convert to optical density.
-        Using NumExpr as it in this case it was faster than vanilla NumPy and Numba"""
-        return ne.evaluate('-log((img + 1) / normalising_c)', optimization="aggressive")
+        Using NumExpr as it in this case it was faster than vanilla NumPy and Numba;
+        out: preallocated array (e.g. float32) the result is cast into."""
+        return ne.evaluate('-log((img + 1) / normalising_c)', optimization="aggressive",
+                           out=out, casting="same_kind")
 
     # @staticmethod
     # @nb.njit(cache=True)
@@ -158,26 +291,117 @@ class Normalisation:
     #         out = np.logical_or(out, x[:, i])
     #     return out
 
+    @staticmethod
+    @nb.njit(cache=True)
+    def nb_histogram(values: npt.NDArray[Any], lo: float, scale: float,
+                     bins: int) -> npt.NDArray[Any]:
+        """Fixed-bin histogram in one pass (out of range values go to the first/last bin)."""
+        counts = np.zeros(bins, dtype=np.int64)
+        for i in range(values.size):
+            counts[min(max(int((values[i] - lo) * scale), 0), bins - 1)] += 1
+        return counts
+
+    @staticmethod
+    @nb.njit(cache=True)
+    def nb_bin_select(values: npt.NDArray[Any], lo: float, scale: float, bins: int,
+                      first_bin: int, last_bin: int, n_selected: int) -> npt.NDArray[Any]:
+        """Collect the values falling into bins first_bin..last_bin."""
+        selected = np.empty(n_selected, dtype=values.dtype)
+        j = 0
+        for i in range(values.size):
+            b = min(max(int((values[i] - lo) * scale), 0), bins - 1)
+            if first_bin <= b <= last_bin:
+                selected[j] = values[i]
+                j += 1
+        return selected
+
+    @staticmethod
+    def hist_percentile(values: npt.NDArray[Any], q: Union[float, Tuple[float, ...]],
+                        lo: Optional[float] = None, hi: Optional[float] = None,
+                        tolerance: Optional[float] = None,
+                        bins: int = 4096) -> Union[float, npt.NDArray[Any]]:
+        """Linear-time, constant-memory replacement of np.percentile (linear method).
+        Values are binned into a fixed histogram over lo..hi (data range if not given).
+        tolerance == 0: only the values in the bins holding the two order statistics
+        around the percentile are selected & sorted => same result as np.percentile;
+        tolerance > 0: the order statistics are interpolated inside their bins
+        (bin width = tolerance => error <= tolerance, no selection pass).
+        """
+        if tolerance is None:
+            tolerance = DEFAULTS.percentile_tolerance
+        values = np.ravel(values)
+        if lo is None or hi is None:
+            lo, hi = float(values.min()), float(values.max())
+        if tolerance > 0:
+            bins = max(int(np.ceil((hi - lo) / tolerance)), 1)
+        width = (hi - lo) / bins
+        scale = 1 / width if width > 0 else 0.0
+        counts = Normalisation.nb_histogram(values, lo, scale, bins)
+        cumulative = np.cumsum(counts)
+
+        results = []
+        for q_i in np.atleast_1d(q):
+            virtual = q_i / 100 * (values.size - 1)
+            k = int(np.floor(virtual))
+            ranks = (k, min(k + 1, values.size - 1))
+            gamma = virtual - k
+            # bins holding the k-th and (k+1)-th order statistics & counts before them
+            rank_bins = [int(np.searchsorted(cumulative, rank, side="right"))
+                         for rank in ranks]
+            befores = [int(cumulative[b - 1]) if b else 0 for b in rank_bins]
+            if tolerance > 0:
+                low, high = (lo + (b + (rank - before + 0.5) / counts[b]) * width
+                             for rank, b, before in zip(ranks, rank_bins, befores))
+            else:
+                selected = Normalisation.nb_bin_select(values, lo, scale, bins,
+                                                       rank_bins[0], rank_bins[1],
+                                                       int(cumulative[rank_bins[1]]) - befores[0])
+                positions = [rank - befores[0] for rank in ranks]
+                selected.partition(np.unique(positions))
+                low, high = selected[positions[0]], selected[positions[1]]
+            # same interpolation as np.percentile
+            if gamma >= 0.5:
+                results.append(high - (high - low) * (1 - gamma))
+            else:
+                results.append(low + (high - low) * gamma)
+        results = np.array(results, dtype=np.result_type(values.dtype, np.float32))
+        if np.ndim(q) == 0:
+            return results[0]
+        return results
+
     @staticmethod
     @profile
-    def calculate_hem(od: npt.NDArray[Any], beta: float, alpha: float) -> npt.NDArray[Any]:
-        """Calculate hematoxylin stain."""
+    def calculate_hem(od: npt.NDArray[Any], beta: float, alpha: float,
+                      scratch: Optional[ScratchArena] = None) -> npt.NDArray[Any]:
+        """Calculate hematoxylin stain.
+        The mask, thresholded OD, projection and angle arrays are taken from scratch if given.
+        """
+        if scratch is None:
+            scratch = ScratchArena()
         LOGGER.info("thresholding OD values")
         # od_clean = od[~Normalisation.np_any_axis1(np.less(od, beta))]
-        od_clean = od[~np.any(od < beta, axis=1)]
+        below = np.less(od, beta, out=scratch.array("below", od.shape, np.bool_))
+        keep = np.any(below, axis=1, out=scratch.array("keep", od.shape[:1], np.bool_))
+        np.logical_not(keep, out=keep)
+        od_clean = np.compress(keep, od, axis=0,
+                               out=scratch.array("od_clean", (np.count_nonzero(keep), 3), od.dtype))
 
         LOGGER.info("calculating eigenvectors & eigenvalues")
         _, eigenvecs = np.linalg.eigh(np.cov(od_clean.T))
 
         # eigenvectors are returned in ascending order, largest two are used
         LOGGER.info("projecting OD values onto the plane")
-        projection = np.dot(od_clean, eigenvecs[:, 1:3].astype(DEFAULTS.dtype))
+        plane = eigenvecs[:, 1:3].astype(DEFAULTS.dtype)
+        projection = np.dot(od_clean, plane,
+                            out=scratch.array("projection", (od_clean.shape[0], 2),
+                                              np.result_type(od_clean, plane)))
 
         LOGGER.info("calculation angles of the points")
-        angs = np.arctan2(projection[:, 1], projection[:, 0])
+        angs = np.arctan2(projection[:, 1], projection[:, 0],
+                          out=scratch.array("angles", od_clean.shape[:1], projection.dtype))
 
-        ang_min = np.percentile(angs, alpha)
-        ang_max = np.percentile(angs, 100 - alpha)
+        ang_min, ang_max = Normalisation.hist_percentile(angs, (alpha, 100 - alpha),
+                                                         -np.pi, np.pi)
 
         c_min = np.dot(eigenvecs[:, 1:3],
                        np.array([(np.cos(ang_min), np.sin(ang_min))]).T)
@@ -194,22 +418,47 @@ class Normalisation:
         return hem
 
     @staticmethod
-    @nb.njit
-    def nb_lstsq(y: npt.NDArray[Any], he: npt.NDArray[Any],
-                 s_cut: npt.NDArray[Any]) -> npt.NDArray[Any]:
-        """Calculate lstsq in batches (saturation of the stains)."""
-        for batch in np.array_split(y, 10, axis=1):
-            saturation = (
-                np.linalg.lstsq(he, batch)[0]
-            ).astype(NB_DTYPE)
-            s_cut = np.concatenate((s_cut, saturation), axis=1)
+    def stain_pinv(he: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """Pseudo-inverse of the 3x2 stain matrix.
+        The stain matrix is shared by all pixels of a tile => computed only once.
+        """
+        return np.linalg.pinv(he.astype(np.float64)).astype(np.float32)
+
+    @staticmethod
+    @nb.njit(parallel=True, cache=True)
+    def nb_concentrations(y: npt.NDArray[Any], pinv: npt.NDArray[Any],
+                          s_cut: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """Apply the stain pseudo-inverse to the 3xN OD values in one pass
+        writing into the preallocated 2xN s_cut.
+        """
+        for j in nb.prange(y.shape[1]):
+            od_r, od_g, od_b = y[0, j], y[1, j], y[2, j]
+            s_cut[0, j] = pinv[0, 0] * od_r + pinv[0, 1] * od_g + pinv[0, 2] * od_b
+            s_cut[1, j] = pinv[1, 0] * od_r + pinv[1, 1] * od_g + pinv[1, 2] * od_b
         return s_cut
 
+    # single-threaded variant for slides normalised in several threads at once
+    nb_concentrations_nogil = staticmethod(nb.njit(nogil=True)(nb_concentrations.__func__.py_func))
+
+    @staticmethod
+    def nb_lstsq(y: npt.NDArray[Any], he: npt.NDArray[Any],
+                 s_cut: Optional[npt.NDArray[Any]] = None,
+                 parallel: bool = True) -> npt.NDArray[Any]:
+        """Calculate lstsq (saturation of the stains) in closed form.
+        he has full column rank => lstsq solution equals pinv(he) @ y;
+        s_cut is reused if it already has the 2xN float32 shape.
+        """
+        if s_cut is None or s_cut.shape != (2, y.shape[1]) or s_cut.dtype != np.float32:
+            s_cut = np.empty((2, y.shape[1]), dtype=np.float32)
+        kernel = Normalisation.nb_concentrations if parallel else Normalisation.nb_concentrations_nogil
+        return kernel(y, Normalisation.stain_pinv(he), s_cut)
+
     @staticmethod
     def calculate_sp(s_cut: npt.NDArray[Any]) -> npt.NDArray[Any]:
         """Calculate saturation percentiles."""
         return np.array(
-            [np.percentile(s_cut[0, :], 99), np.percentile(s_cut[1, :], 99)]
+            [Normalisation.hist_percentile(s_cut[0, :], 99),
+             Normalisation.hist_percentile(s_cut[1, :], 99)]
         )
 
     @staticmethod
@@ -218,30 +467,37 @@ class Normalisation:
                  alpha: float, beta: float,
                  max_s_ref: npt.NDArray[Any],
                  he_vals: Optional[npt.NDArray[Any]] = None,
+                 parallel: bool = True,
+                 out: Optional[npt.NDArray[Any]] = None,
+                 scratch: Optional[ScratchArena] = None,
                  ) -> Tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
-        """Calculate saturation of region."""
+        """Calculate saturation of region.
+        out: preallocated 2xN float32 saturation (s_cut);
+        scratch: arena of the OD & calculate_hem arrays (s_cut is taken from it if out is None
+        => valid only until the arena is used again).
+        """
+        if scratch is None:
+            scratch = ScratchArena()
         LOGGER.info("od calculation")
         od = Normalisation.convert_od(
-            img, normalising_c).astype(DEFAULTS.dtype)
+            img, normalising_c, out=scratch.array("od", img.shape, DEFAULTS.dtype))
         del img
 
         if he_vals is not None:
             hem = he_vals
         else:
-            hem = Normalisation.calculate_hem(od, beta, alpha)
+            hem = Normalisation.calculate_hem(od, beta, alpha, scratch=scratch)
 
         y = np.reshape(od, (-1, 3)).T
         del od
 
-        s_cut = np.empty(shape=[2, 0], dtype=DEFAULTS.dtype)
-
         t1 = time()
-        LOGGER.info("calculating lstsq in batches (stain saturation)")
-        # + converting to float32 for numba..
-        s_cut = Normalisation.nb_lstsq(y.astype(np.float32), hem.astype(
-            np.float32), s_cut.astype(np.float32))
+        LOGGER.info("calculating lstsq (stain saturation)")
+        if out is None:
+            out = scratch.array("s_cut", (2, y.shape[1]), np.float32)
+        s_cut = Normalisation.nb_lstsq(y, hem, s_cut=out, parallel=parallel)
         t2 = time()
-        LOGGER.info(f"batches done in {int(t2-t1)} seconds")
+        LOGGER.info(f"lstsq done in {t2-t1:.2f} seconds")
 
         max_s = Normalisation.calculate_sp(s_cut)
         tmp = np.divide(max_s, max_s_ref).astype(DEFAULTS.dtype)
@@ -260,35 +516,293 @@ class Normalisation:
     @profile
     def image_restore(s2: npt.NDArray[Any], normalising_c: int,
                       he_ref: npt.NDArray[Any], wh: tuple,
-                      output_type: str = "norm") -> npt.NDArray[Any]:
-        """Restore image to valid RGB values."""
+                      output_type: str = "norm",
+                      out: Optional[npt.NDArray[Any]] = None,
+                      scratch: Optional[ScratchArena] = None) -> npt.NDArray[Any]:
+        """Restore image to valid RGB values.
+        out: preallocated (height, width, 3) uint8 image;
+        scratch: arena of the 3xN optical density & intensity arrays.
+        """
         width, height = wh  # for convinient np.reshape use
-        LOGGER.info(f"{output_type} image generation")
+        LOGGER.progress_info(f"{output_type} image generation")
+        if scratch is None:
+            scratch = ScratchArena()
+        if out is None:
+            out = np.empty((height, width, 3), dtype=np.uint8)
         if output_type == "norm":
-            img = np.multiply(
-                normalising_c, np.exp(np.dot(-he_ref,
-                                             s2).astype(DEFAULTS.dtype))
-            )
+            stains, s2_rows = -he_ref, s2
         else:
             # TODO check if re-definition is less efficient
             i = 0  # if output_type == "he"
             if output_type == "eo":
                 i = 1
-            img = np.multiply(
-                normalising_c,
-                np.exp(np.dot(np.expand_dims(-he_ref[:, i], axis=1),
-                              np.expand_dims(s2[i, :], axis=0)).astype(DEFAULTS.dtype)),
-            )
-        img = img.astype(np.uint8)
-        img[img > 255] = 254
-        img = np.reshape(img.T, (height, width, 3))
-        return img
+            stains = np.expand_dims(-he_ref[:, i], axis=1)
+            s2_rows = np.expand_dims(s2[i, :], axis=0)
+        od = np.dot(stains, s2_rows,
+                    out=scratch.array("restore_od", (3, s2.shape[1]),
+                                      np.result_type(stains, s2_rows)))
+        img = scratch.array("restore", od.shape, DEFAULTS.dtype)
+        np.copyto(img, od, casting="same_kind")
+        np.multiply(normalising_c, np.exp(img, out=img), out=img)
+        # clip before casting, out of range float => uint8 casts wrap around
+        np.minimum(img, 255, out=img)
+        np.copyto(out.reshape((-1, 3)), img.T, casting="unsafe")
+        return out
+
+    @staticmethod
+    def od_lut(normalising_c: int) -> npt.NDArray[Any]:
+        """OD values of all 256 possible uint8 intensities (same maths as convert_od)."""
+        return Normalisation.convert_od(np.arange(256, dtype=np.uint8),
+                                        normalising_c).astype(np.float32)
+
+    # kernel codes of the output types
+    STAIN_CODES = {"norm": -1, "he": 0, "eo": 1}
+
+    @staticmethod
+    @nb.njit(parallel=True, cache=True)
+    def nb_fused_restore(img: npt.NDArray[Any], od_lut: npt.NDArray[Any],
+                         pinv: npt.NDArray[Any], he_ref: npt.NDArray[Any],
+                         normalising_c: float, stains: npt.NDArray[Any],
+                         bg_lut: npt.NDArray[Any], bg_min: int,
+                         out: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """uint8 RGB (Nx3) => normalised uint8 RGB (KxNx3) of K output types pixel by pixel.
+        pinv is the stain pseudo-inverse already divided by tmp;
+        stains: output type codes (-1 for norm, 0 for he, 1 for eo);
+        every output type is computed the same way whatever the other output types are;
+        background pixels (all channels >= bg_min) are looked up in bg_lut (KxBxBxBx3).
+        """
+        has_norm, has_h, has_e = False, False, False
+        for k in range(stains.size):
+            has_norm = has_norm or stains[k] == -1
+            has_h = has_h or stains[k] == 0
+            has_e = has_e or stains[k] == 1
+        for j in nb.prange(img.shape[0]):
+            red, green, blue = img[j, 0], img[j, 1], img[j, 2]
+            if red >= bg_min and green >= bg_min and blue >= bg_min:
+                for k in range(stains.size):
+                    for c in range(3):
+                        out[k, j, c] = bg_lut[k, red - bg_min, green - bg_min, blue - bg_min, c]
+                continue
+            od_r, od_g, od_b = od_lut[red], od_lut[green], od_lut[blue]
+            s_h = pinv[0, 0] * od_r + pinv[0, 1] * od_g + pinv[0, 2] * od_b
+            s_e = pinv[1, 0] * od_r + pinv[1, 1] * od_g + pinv[1, 2] * od_b
+            for c in range(3):
+                od_h = he_ref[c, 0] * s_h
+                od_e = he_ref[c, 1] * s_e
+                exp_n, exp_h, exp_e = np.float32(0), np.float32(0), np.float32(0)
+                if has_h:
+                    exp_h = np.exp(-od_h)
+                if has_e:
+                    exp_e = np.exp(-od_e)
+                if has_norm:
+                    exp_n = np.exp(-(od_h + od_e))
+                for k in range(stains.size):
+                    if stains[k] == -1:
+                        val = normalising_c * exp_n
+                    elif stains[k] == 0:
+                        val = normalising_c * exp_h
+                    else:
+                        val = normalising_c * exp_e
+                    out[k, j, c] = np.uint8(min(val, 255))
+        return out
+
+    # single-threaded, GIL-free variant for concurrent calls from tile worker threads
+    # (numba's default workqueue threading layer does not allow concurrent parallel kernels)
+    nb_fused_restore_nogil = staticmethod(nb.njit(nogil=True)(nb_fused_restore.__func__.py_func))
+
+    @staticmethod
+    def restore_tables(he: npt.NDArray[Any], tmp: npt.NDArray[Any], normalising_c: int,
+                       he_ref: npt.NDArray[Any], output_types: Sequence[str],
+                       bg_min: Optional[int] = None,
+                       parallel: bool = True) -> Tuple[Any, ...]:
+        """Kernel arguments of fused_restore_multi that depend only on he and tmp
+        (OD table, scaled pseudo-inverse, background colour cube, ...)
+        => built once per slide and output types instead of once per tile.
+        """
+        kernel = Normalisation.nb_fused_restore if parallel else Normalisation.nb_fused_restore_nogil
+        if bg_min is None:
+            bg_min = DEFAULTS.background_intensity
+        args = (Normalisation.od_lut(normalising_c),
+                (Normalisation.stain_pinv(he) / tmp[:, np.newaxis]).astype(np.float32),
+                he_ref.astype(np.float32),
+                np.float32(normalising_c),
+                np.array([Normalisation.STAIN_CODES[output_type] for output_type in output_types],
+                         dtype=np.int64))
+        # background colours are rendered once with the full maths (lookup disabled)
+        bg_side = 256 - bg_min
+        bg_rgb = (np.indices((bg_side,) * 3).reshape((3, -1)).T + bg_min).astype(np.uint8)
+        bg_lut = kernel(np.ascontiguousarray(bg_rgb), *args,
+                        np.empty((0, 0, 0, 0, 3), dtype=np.uint8), 256,
+                        np.empty((len(output_types),) + bg_rgb.shape, dtype=np.uint8))
+        return args + (bg_lut.reshape((len(output_types),) + (bg_side,) * 3 + (3,)), bg_min)
+
+    @staticmethod
+    @profile
+    def fused_restore_multi(img: npt.NDArray[Any], he: npt.NDArray[Any],
+                            tmp: npt.NDArray[Any], normalising_c: int,
+                            he_ref: npt.NDArray[Any], output_types: Sequence[str],
+                            out: Optional[npt.NDArray[Any]] = None,
+                            bg_min: Optional[int] = None,
+                            parallel: bool = True,
+                            tables: Optional[Tuple[Any, ...]] = None) -> npt.NDArray[Any]:
+        """Restore the images of all output types in one pass over the uint8 slide sector
+        once he and tmp are known (no intermediate float arrays).
+        Returns a (len(output_types), *img.shape) array (out if given: any preallocated
+        C-contiguous uint8 buffer with len(output_types) * img.size elements);
+        pixels with all channels >= bg_min take a lookup fast path with the same result;
+        tables: restore_tables of the same arguments (built here if not given);
+        parallel=False has to be used when called from several threads at once.
+        """
+        kernel = Normalisation.nb_fused_restore if parallel else Normalisation.nb_fused_restore_nogil
+        LOGGER.progress_info(f"{', '.join(output_types)} image generation (fused)")
+        if out is None:
+            out = np.empty((len(output_types),) + img.shape, dtype=np.uint8)
+        if tables is None:
+            tables = Normalisation.restore_tables(he, tmp, normalising_c, he_ref, output_types,
+                                                  bg_min=bg_min, parallel=parallel)
+        kernel(np.ascontiguousarray(img).reshape((-1, 3)), *tables,
+               out.reshape((len(output_types), -1, 3)))
+        return out
+
+    @staticmethod
+    def fused_restore(img: npt.NDArray[Any], he: npt.NDArray[Any],
+                      tmp: npt.NDArray[Any], normalising_c: int,
+                      he_ref: npt.NDArray[Any], output_type: str = "norm",
+                      out: Optional[npt.NDArray[Any]] = None,
+                      bg_min: Optional[int] = None,
+                      parallel: bool = True) -> npt.NDArray[Any]:
+        """Restore image of one output type to valid RGB values (see fused_restore_multi);
+        out can be any preallocated C-contiguous uint8 buffer with img.size elements.
+        """
+        if out is None:
+            out = np.empty(img.shape, dtype=np.uint8)
+        Normalisation.fused_restore_multi(img, he, tmp, normalising_c, he_ref, (output_type,),
+                                          out=out, bg_min=bg_min, parallel=parallel)
+        return out
+
+    @staticmethod
+    def colour_lut(he: npt.NDArray[Any], tmp: npt.NDArray[Any], normalising_c: int,
+                   he_ref: npt.NDArray[Any], output_types: Sequence[str], bits: int = 8,
+                   parallel: bool = True) -> npt.NDArray[Any]:
+        """RGB => normalised RGB table of the output types (Kx256x256x256x3 uint8) for bits == 8:
+        every possible colour rendered by the fused kernel => lookup gives identical results;
+        bits < 8: (2^bits + 1)^3 nodes spaced 2^(8 - bits) apart (Kx(2^bits+1)^3x3 float32)
+        for trilinear interpolation.
+        """
+        LOGGER.info(f"building {bits} bit colour table")
+        if bits == 8:
+            colours = np.indices((256,) * 3, dtype=np.uint8).reshape((3, -1)).T
+            # background lookup disabled: the whole table is rendered with the full maths
+            return Normalisation.fused_restore_multi(np.ascontiguousarray(colours), he, tmp,
+                                                     normalising_c, he_ref, output_types,
+                                                     bg_min=256, parallel=parallel
+                                                     ).reshape((len(output_types),) + (256,) * 3 + (3,))
+        side = 2 ** bits + 1
+        nodes = np.arange(side, dtype=np.float32) * 2 ** (8 - bits)
+        rgb = np.stack(np.meshgrid(nodes, nodes, nodes, indexing="ij"), axis=-1).reshape((-1, 3))
+        # same maths as the fused kernel, on float node colours
+        od = -np.log((rgb + 1) / np.float32(normalising_c))
+        saturation = od @ (Normalisation.stain_pinv(he) / tmp[:, np.newaxis]).astype(np.float32).T
+        he_ref = he_ref.astype(np.float32)
+        stain_masks = {"norm": (1, 1), "he": (1, 0), "eo": (0, 1)}
+        lut = np.empty((len(output_types), rgb.shape[0], 3), dtype=np.float32)
+        for k, output_type in enumerate(output_types):
+            stains = he_ref * np.array(stain_masks[output_type], dtype=np.float32)
+            lut[k] = np.minimum(normalising_c * np.exp(-(saturation @ stains.T)), 255)
+        return lut.reshape((len(output_types),) + (side,) * 3 + (3,))
+
+    @staticmethod
+    @nb.njit(parallel=True, cache=True)
+    def nb_lut_restore(img: npt.NDArray[Any], lut: npt.NDArray[Any],
+                       out: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """uint8 RGB (Nx3) => normalised uint8 RGB (KxNx3) by table lookup
+        (exact 256^3 table or trilinear interpolation of a quantised one).
+        """
+        side = lut.shape[1]
+        if side == 256:
+            for j in nb.prange(img.shape[0]):
+                red, green, blue = img[j, 0], img[j, 1], img[j, 2]
+                for k in range(lut.shape[0]):
+                    for c in range(3):
+                        out[k, j, c] = lut[k, red, green, blue, c]
+            return out
+        step = 256 // (side - 1)
+        scale = np.float32(1 / step)
+        for j in nb.prange(img.shape[0]):
+            r_i, g_i, b_i = img[j, 0] // step, img[j, 1] // step, img[j, 2] // step
+            r_f = np.float32(img[j, 0] - r_i * step) * scale
+            g_f = np.float32(img[j, 1] - g_i * step) * scale
+            b_f = np.float32(img[j, 2] - b_i * step) * scale
+            for k in range(lut.shape[0]):
+                for c in range(3):
+                    low = ((lut[k, r_i, g_i, b_i, c] * (1 - b_f) + lut[k, r_i, g_i, b_i + 1, c] * b_f)
+                           * (1 - g_f)
+                           + (lut[k, r_i, g_i + 1, b_i, c] * (1 - b_f)
+                              + lut[k, r_i, g_i + 1, b_i + 1, c] * b_f) * g_f)
+                    high = ((lut[k, r_i + 1, g_i, b_i, c] * (1 - b_f)
+                             + lut[k, r_i + 1, g_i, b_i + 1, c] * b_f) * (1 - g_f)
+                            + (lut[k, r_i + 1, g_i + 1, b_i, c] * (1 - b_f)
+                               + lut[k, r_i + 1, g_i + 1, b_i + 1, c] * b_f) * g_f)
+                    out[k, j, c] = np.uint8(min(low * (1 - r_f) + high * r_f, 255))
+        return out
+
+    # single-threaded, GIL-free variant for concurrent calls from tile worker threads
+    nb_lut_restore_nogil = staticmethod(nb.njit(nogil=True)(nb_lut_restore.__func__.py_func))
+
+    @staticmethod
+    @profile
+    def lut_restore(img: npt.NDArray[Any], lut: npt.NDArray[Any],
+                    out: Optional[npt.NDArray[Any]] = None,
+                    parallel: bool = True) -> npt.NDArray[Any]:
+        """Map the uint8 slide sector through the colour table of colour_lut
+        => (K, *img.shape) array (or out: any preallocated C-contiguous uint8 buffer
+        with K * img.size elements); memory-bound gather instead of OD/lstsq/exp.
+        """
+        kernel = Normalisation.nb_lut_restore if parallel else Normalisation.nb_lut_restore_nogil
+        LOGGER.progress_info("image generation (colour table)")
+        if out is None:
+            out = np.empty((lut.shape[0],) + img.shape, dtype=np.uint8)
+        kernel(np.ascontiguousarray(img).reshape((-1, 3)), lut, out.reshape((lut.shape[0], -1, 3)))
+        return out
+
+    @staticmethod
+    def restore_matrix(he: npt.NDArray[Any], tmp: npt.NDArray[Any], normalising_c: int,
+                       he_ref: npt.NDArray[Any], output_type: str = "norm"
+                       ) -> Tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """The whole restore as one linear map in log space:
+        out = exp(matrix @ log(rgb + 1) + offset)
+        (od = log(c) - log(rgb + 1); s = pinv(he) @ od / tmp; out = c * exp(-he_ref @ s)).
+        """
+        pinv = np.linalg.pinv(he.astype(np.float64)) / tmp[:, np.newaxis]
+        if output_type == "he":
+            pinv[1] = 0
+        elif output_type == "eo":
+            pinv[0] = 0
+        od_matrix = -he_ref.astype(np.float64) @ pinv
+        log_c = np.log(normalising_c)
+        return -od_matrix, log_c * (od_matrix.sum(axis=1) + 1)
+
+    @staticmethod
+    def vips_restore(slide: pyvips.vimage.Image, he: npt.NDArray[Any], tmp: npt.NDArray[Any],
+                     normalising_c: int, he_ref: npt.NDArray[Any],
+                     output_type: str = "norm") -> pyvips.vimage.Image:
+        """Lazy libvips pipeline for the whole slide (log => recomb => linear => exp),
+        evaluated by libvips' own threads only when the image is saved.
+        """
+        LOGGER.info(f"{output_type} image generation (vips)")
+        matrix, offset = Normalisation.restore_matrix(he, tmp, normalising_c, he_ref, output_type)
+        # casting to uchar clips & truncates as the numba kernel
+        return (slide[0:3].linear(1, 1).log()
+                .recomb(matrix.tolist())
+                .linear([1, 1, 1], offset.tolist())
+                .exp()
+                .cast("uchar"))
 
     @staticmethod
     @profile
     def save_jpeg(path: Path, img: npt.NDArray[Any]) -> None:
         """vips jpeg save at path."""
-        LOGGER.info(f"saving jpeg image: {path.stem}")
+        LOGGER.progress_info(f"saving jpeg image: {path.stem}")
         height, width, bands = img.shape
         linear = img.reshape(width * height * 3)
         vips_image = pyvips.Image.new_from_memory(
@@ -367,15 +881,62 @@ class SlideTiler:
             mapping.move_to_end(DEFAULTS.first_tile, last=False)
         return mapping
 
+    @staticmethod
+    def low_res_sector(slide_path: Path, max_side_px: int) -> npt.NDArray[Any]:
+        """Read the whole slide downsampled to max_side_px
+        (pyvips picks the closest lower pyramid level for OpenSlide formats).
+        """
+        LOGGER.info("reading low resolution slide")
+        slide = pyvips.Image.thumbnail(str(slide_path), max_side_px,
+                                       height=max_side_px, size="down")
+        return Normalisation.read_sector(slide, (0, 0), (slide.width, slide.height))
+
+    @staticmethod
+    def sampled_sectors(slide: pyvips.vimage.Image, samples: int,
+                        side_px: int) -> npt.NDArray[Any]:
+        """Read level 0 regions placed on a regular grid over the whole slide
+        and return their pixels as one Nx3 array.
+        """
+        LOGGER.info(f"reading {samples} sampled slide sectors")
+        side_px = min(side_px, slide.width, slide.height)
+        grid = int(np.ceil(np.sqrt(samples)))
+        step_x = (slide.width - side_px) / max(grid - 1, 1)
+        step_y = (slide.height - side_px) / max(grid - 1, 1)
+        sectors = [Normalisation.read_sector(slide, (int(n * step_x), int(m * step_y)),
+                                             (side_px, side_px))
+                   for m in range(grid) for n in range(grid)][:samples]
+        return np.concatenate(sectors, axis=0)
+
+    @staticmethod
+    def aligned_slice_points(slide_width_px: int, slide_height_px: int,
+                             max_side_px: int) -> Tuple[Tuple[int, int],
+                                                        List[Tuple[Tuple[int, int], Tuple[int, int]]]]:
+        """Tiles of max_side_px starting at multiples of max_side_px (last row/column get the rest)
+        => with max_side_px aligned to the source tile grid, no source tile is read twice.
+        """
+        m_rows = -(slide_height_px // -max_side_px)
+        n_columns = -(slide_width_px // -max_side_px)
+        cutting_cooridinates = []
+        for m in range(m_rows):
+            for n in range(n_columns):
+                left, top = n * max_side_px, m * max_side_px
+                cutting_cooridinates.append(((left, top),
+                                             (min(max_side_px, slide_width_px - left),
+                                              min(max_side_px, slide_height_px - top))))
+        return (m_rows, n_columns), cutting_cooridinates
+
     @staticmethod
     @profile
     def slicer(width_height_px: Tuple[int, int],
-               max_side_px: int) -> Tuple[Tuple[int, int], OrderedDict[int,
-                                                                       Tuple[Tuple[int, int], Tuple[int, int]]]]:
+               max_side_px: int, aligned: bool = False) -> Tuple[Tuple[int, int], OrderedDict[int,
+                                                                                          Tuple[Tuple[int, int], Tuple[int, int]]]]:
         """Combine calculation of row/column number and slice points/sizes."""
         width_px, height_px = width_height_px
-        m_n = SlideTiler.rows_columns(width_px, height_px, max_side_px)
-        slices = SlideTiler.slice_points(width_px, height_px, m_n)
+        if aligned:
+            m_n, slices = SlideTiler.aligned_slice_points(width_px, height_px, max_side_px)
+        else:
+            m_n = SlideTiler.rows_columns(width_px, height_px, max_side_px)
+            slices = SlideTiler.slice_points(width_px, height_px, m_n)
         slices = SlideTiler.coordinates_dict(slices)
         return m_n, slices
 
@@ -405,12 +966,23 @@ class SlideTiler:
     def jpeg_stitcher(*args) -> None:
         """Stitch normalised slide tiles (located in the temporary folder) together."""
         LOGGER.info("stitching image together")
+        # lossless canvas instead of JPEG tiles
+        if DEFAULTS.temp_tile_format == "raw":
+            SlideTiler.raw_stitcher(*args)
         # if libvips stitching is prefered by the user
-        if DEFAULTS.vips_stitcher:
+        elif DEFAULTS.vips_stitcher:
             SlideTiler.vips_stitcher(*args)
         else:
             SlideTiler.stitcher(*args)
 
+    @staticmethod
+    def raw_stitcher(stain_type: str, current_slide: CurrentSlide) -> None:
+        """Save the memory-mapped canvas holding all tiles (nothing to stitch)."""
+        LOGGER.info("stitching using the raw canvas")
+        SlideTiler.vips_writer(RawTileStore.image(current_slide, stain_type),
+                               stain_type, current_slide)
+        LOGGER.info("stitching finished")
+
     @staticmethod
     def vips_imread(path: str) -> npt.NDArray[Any]:
         """Wrap for vips imare reading."""
@@ -468,26 +1040,69 @@ class SlideTiler:
                    f"thumbnail_{stain_type}_{current_slide.slide_path.stem}.jpeg"))
         thumbnail.jpegsave(str(path), Q=90)
 
+    @staticmethod
+    def source_thumbnail(slide: CurrentSlide) -> pyvips.vimage.Image:
+        """Thumbnail of the source slide (read from a lower pyramid level if available)."""
+        twidth, theight = SlideTiler.thumbnail_size(slide.wh)
+        return pyvips.Image.thumbnail(str(slide.slide_path), twidth, height=theight)
+
+    @staticmethod
+    def tissue_mask(thumbnail: pyvips.vimage.Image,
+                    background_intensity: int) -> Tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """Tissue mask of the thumbnail: pixels with any channel darker than the background
+        intensity, dilated to keep the tissue borders
+        ..and the median RGB of the background pixels.
+        """
+        LOGGER.info("detecting tissue")
+        pixels = Normalisation.read_sector(thumbnail, (0, 0),
+                                           (thumbnail.width, thumbnail.height))
+        tissue = pixels.min(axis=1) < background_intensity
+        background = pixels[~tissue] if not tissue.all() else np.full((1, 3), 255, dtype=np.uint8)
+        background = np.median(background, axis=0).astype(np.uint8).reshape((1, 3))
+        mask = ndimage.binary_dilation(tissue.reshape((thumbnail.height, thumbnail.width)),
+                                       iterations=2)
+        return mask, background
+
+    @staticmethod
+    def tissue_fractions(mask: npt.NDArray[Any], slide_wh: Tuple[int, int],
+                         tile_map: OrderedDict[int, Tuple[Tuple[int, int], Tuple[int, int]]]
+                         ) -> Dict[int, float]:
+        """Fraction of tissue pixels of every tile {tile index: fraction}
+        the tiles are mapped onto the (thumbnail sized) mask.
+        """
+        scale_x, scale_y = mask.shape[1] / slide_wh[0], mask.shape[0] / slide_wh[1]
+        fractions = {}
+        for i, ((left, top), (width, height)) in tile_map.items():
+            x_0, y_0 = int(left * scale_x), int(top * scale_y)
+            x_1 = max(int(np.ceil((left + width) * scale_x)), x_0 + 1)
+            y_1 = max(int(np.ceil((top + height) * scale_y)), y_0 + 1)
+            fractions[i] = float(mask[y_0:y_1, x_0:x_1].mean())
+        return fractions
+
     @staticmethod
     def thumbnail_from_image(slide: CurrentSlide,
                              stain_type: Optional[str] = None,
-                             slide_extension: Optional[str] = None) -> None:
+                             slide_extension: Optional[str] = None) -> pyvips.vimage.Image:
         """Create thumbnail from the sourde slide."""
         twidth, theight = SlideTiler.thumbnail_size(slide.wh)
         if stain_type:  # creating normalised thumbnail
             LOGGER.info(f"creating {stain_type} thumbnail")
             slide_path = Path(
                 slide.norm_path, f"{stain_type}_{slide.slide_path.stem}.{slide_extension}")
-            thumbnail = pyvips.Image.thumbnail(
-                str(slide_path), twidth, height=theight)
+            if slide_extension == "tif" and DEFAULTS.tiff_pyramid:
+                thumbnail = SlideTiler.pyramid_thumbnail(slide_path, twidth, theight)
+            else:
+                thumbnail = pyvips.Image.thumbnail(
+                    str(slide_path), twidth, height=theight)
             path = Path(slide.norm_path,
                         f"thumbnail_{stain_type}_{slide.slide_path.stem}.jpeg")
         else:  # creating thumbnail from source slide
             LOGGER.info("creating slide thumbnail")
-            thumbnail = slide.os_slide.thumbnail_image(twidth, height=theight)
+            thumbnail = SlideTiler.source_thumbnail(slide)
             path = Path(slide.norm_path,
                         f"thumbnail_{slide.slide_path.stem}.jpeg")
         thumbnail.jpegsave(str(path), Q=DEFAULTS.jpeg_quality)
+        return thumbnail
 
     @staticmethod
     def vips_stitcher(stain_type: str, current_slide: CurrentSlide) -> None:
@@ -500,34 +1115,123 @@ class SlideTiler:
                  for tile_path in tile_paths]
         normalised_slide = pyvips.Image.arrayjoin(tiles,
                                                   across=current_slide.mn[1])
+        SlideTiler.save_tif(normalised_slide, stain_type, current_slide)
+        LOGGER.info("stitching finished & TIF saved")
+
+        if DEFAULTS.thumbnail:
+            SlideTiler.thumbnail_from_image(slide=current_slide,
+                                            stain_type=stain_type,
+                                            slide_extension='tif')
+
+    @staticmethod
+    def slide_resolution(os_slide: pyvips.vimage.Image) -> Tuple[Optional[float], Optional[float],
+                                                                 Optional[str]]:
+        """Source slide mpp-x, mpp-y and objective power (None if not present)."""
+        values = []
+        for field in ("openslide.mpp-x", "openslide.mpp-y", "openslide.objective-power"):
+            values.append(os_slide.get(field) if os_slide.get_typeof(field) else None)
+        mpp_x, mpp_y, magnification = values
+        return (float(mpp_x) if mpp_x else None, float(mpp_y) if mpp_y else None,
+                magnification)
+
+    @staticmethod
+    def ome_xml(name: str, width: int, height: int, mpp_x: Optional[float] = None,
+                mpp_y: Optional[float] = None, magnification: Optional[str] = None) -> str:
+        """Minimal OME-XML of an interleaved 8 bit RGB image (pyramid levels are SubIFDs)."""
+        physical = ""
+        if mpp_x and mpp_y:
+            physical = (f' PhysicalSizeX="{mpp_x}" PhysicalSizeXUnit="µm"'
+                        f' PhysicalSizeY="{mpp_y}" PhysicalSizeYUnit="µm"')
+        instrument, objective = "", ""
+        if magnification:
+            instrument = ('<Instrument ID="Instrument:0"><Objective ID="Objective:0" '
+                          f'NominalMagnification="{float(magnification)}"/></Instrument>')
+            objective = '<InstrumentRef ID="Instrument:0"/><ObjectiveSettings ID="Objective:0"/>'
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06"
+     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+     xsi:schemaLocation="http://www.openmicroscopy.org/Schemas/OME/2016-06 http://www.openmicroscopy.org/Schemas/OME/2016-06/ome.xsd">
+    {instrument}
+    <Image ID="Image:0" Name="{name}">
+        {objective}
+        <Pixels DimensionOrder="XYCZT" ID="Pixels:0" Interleaved="true" SizeC="3" SizeT="1" SizeZ="1"
+                SizeX="{width}" SizeY="{height}" Type="uint8"{physical}>
+            <Channel ID="Channel:0:0" SamplesPerPixel="3"><LightPath/></Channel>
+            <TiffData IFD="0" PlaneCount="1"/>
+        </Pixels>
+    </Image>
+</OME>"""
+
+    @staticmethod
+    def save_tif(normalised_slide: pyvips.vimage.Image, stain_type: str,
+                 current_slide: CurrentSlide) -> None:
+        """Save the normalised slide as tiled BigTIFF, pyramidal if DEFAULTS.tiff_pyramid
+        (all levels are built while level 0 is written); the source resolution is kept
+        in (spoofed Aperio) or OME-XML metadata.
+        """
         # TODO check for size limit 65535
+        ome = DEFAULTS.tiff_format == "ome"
+        name = f"{stain_type}_{current_slide.slide_path.stem}"
+        mpp_x, mpp_y, magnification = None, None, None
         if platform.system() != "Windows":
             # not implemented for Windows
             # vips-dev-w64-all-X.XX.X.zip hangs
             # vips-dev-w64-web-8.12.0-static.zip cent read metadata
-            mpp_x = current_slide.os_slide.get("openslide.mpp-x")
-            # mpp_y = current_slide.os_slide.properties["openslide.mpp-y"] # used for Aperio metadata
-            magnification = current_slide.os_slide.get(
-                "openslide.objective-power")
+            mpp_x, mpp_y, magnification = SlideTiler.slide_resolution(current_slide.os_slide)
+        normalised_slide = normalised_slide.copy()  # metadata is set on a private copy
+        if ome:
+            description = SlideTiler.ome_xml(name, normalised_slide.width, normalised_slide.height,
+                                             mpp_x, mpp_y, magnification)
+        else:
             # currently spoofs Aperio metadata ( Magnification in OME Schema is not recognised by QuPath..)
-            normalised_slide.set_type(pyvips.GValue.gstr_type,
-                                      "image-description",
-                                      f"""Aperio Image Library v12.4.0 {normalised_slide.width}x{normalised_slide.height}] | AppMag = {magnification}| MPP={mpp_x}
-                """,
-                                      )
+            description = f"""Aperio Image Library v12.4.0 {normalised_slide.width}x{normalised_slide.height}] | AppMag = {magnification}| MPP={mpp_x}
+                """
+        normalised_slide.set_type(pyvips.GValue.gstr_type, "image-description", description)
+        resolution = {}
+        if mpp_x and mpp_y:  # pixels per mm
+            resolution = {"xres": 1000 / mpp_x, "yres": 1000 / mpp_y, "resunit": "cm"}
         # writes a binary file
-        normalised_slide.tiffsave(str(Path(current_slide.norm_path,
-                                           f"{stain_type}_{current_slide.slide_path.stem}.tif")),
+        normalised_slide.tiffsave(str(Path(current_slide.norm_path, f"{name}.tif")),
                                   compression=DEFAULTS.vips_tiff_compression,
                                   bigtiff=True,
                                   tile=True,
-                                  Q=DEFAULTS.jpeg_quality)
-        LOGGER.info("stitching finished & TIF saved")
+                                  pyramid=DEFAULTS.tiff_pyramid,
+                                  subifd=ome and DEFAULTS.tiff_pyramid,
+                                  Q=DEFAULTS.jpeg_quality,
+                                  **resolution)
+
+    @staticmethod
+    def pyramid_thumbnail(path: Path, twidth: int, theight: int) -> pyvips.vimage.Image:
+        """Thumbnail from the smallest pyramid level which is still larger than the thumbnail."""
+        image = pyvips.Image.new_from_file(str(path))
+        if image.get_typeof("n-subifds"):  # OME: levels in SubIFDs
+            levels = [image] + [pyvips.Image.new_from_file(str(path), subifd=i)
+                                for i in range(image.get("n-subifds"))]
+        else:  # levels as pages
+            levels = [pyvips.Image.new_from_file(str(path), page=i)
+                      for i in range(image.get_n_pages())]
+        level = min((level for level in levels if level.width >= twidth and level.height >= theight),
+                    key=lambda level: level.width, default=image)
+        return level.thumbnail_image(twidth, height=theight)
 
+    @staticmethod
+    def vips_writer(normalised_slide: pyvips.vimage.Image, stain_type: str,
+                    current_slide: CurrentSlide) -> None:
+        """Evaluate a lazy normalised slide straight into the output file
+        (TIF if DEFAULTS.vips_stitcher, JPEG otherwise).
+        """
+        slide_extension = "tif" if DEFAULTS.vips_stitcher else "jpeg"
+        LOGGER.info(f"writing {slide_extension} slide: {current_slide.slide_path.name}")
+        if DEFAULTS.vips_stitcher:
+            SlideTiler.save_tif(normalised_slide, stain_type, current_slide)
+        else:
+            normalised_slide.jpegsave(str(Path(current_slide.norm_path,
+                                               f"{stain_type}_{current_slide.slide_path.stem}.jpeg")),
+                                      Q=DEFAULTS.jpeg_quality)
         if DEFAULTS.thumbnail:
             SlideTiler.thumbnail_from_image(slide=current_slide,
                                             stain_type=stain_type,
-                                            slide_extension='tif')
+                                            slide_extension=slide_extension)
 
     @staticmethod
     def thumbnail_size(slide_width_height: Tuple[int, int]) -> Tuple[int, int]:
@@ -590,17 +1294,23 @@ class NormaliseSlides:
                                           norm_path=self.file_data.path_info.norm_slide_path)
         self.check_resources()
 
-        logger_fh = logging.FileHandler(
-            Path(self.file_data.path_info.norm_slide_path, "dogsled.log"))
-        logger_fh.setLevel(logging.INFO)
-        logger_fh.setFormatter(logging.Formatter(
-            "%(asctime)s %(module)s %(levelname)s: [ %(message)s ]", "%m/%d/%Y %I:%M:%S %p"))
-        LOGGER.addHandler(logger_fh)
+        LOGGER.log_file(Path(self.file_data.path_info.norm_slide_path, "dogsled.log"))
         LOGGER.slide_list(self.slide_paths)
 
         # intercepting rewrite kwarg for temp path creation
         # as the temporary subfolders are creaetd when the actual normalisation starts
         self.rewrite = rewrite
+        # parallel numba kernels; off for slides normalised in several threads at once
+        self.parallel = True
+        # he and tmp of previously normalised slides
+        self.stain_cache = StainCache.from_defaults() if DEFAULTS.stain_cache else None
+        # stage events (shared by the slide workers)
+        self.metrics = MetricsRecorder.from_defaults(self.file_data.path_info.norm_slide_path)
+        self.profiler = Profiler.from_defaults(self.file_data.path_info.norm_slide_path)
+        # scratch buffers of the tile workers (shared by the slide workers)
+        self.scratch = ScratchPool()
+        # colour table of the current slide is built once (by the first tile needing it)
+        self.lut_lock = threading.Lock()
 
     def check_resources(self) -> None:
         """Check required resources (RAM and space)."""
@@ -623,23 +1333,151 @@ class NormaliseSlides:
 
     def start(self) -> None:
         """Full :strike:`fire` normalisation starter."""
-        for slide_path in self.slide_paths:
-            self.current_slide.slide_path = slide_path
-            LOGGER.current_slide(self.current_slide.slide_path)
-            self.process_slide(max_side_px=self.max_side_px)
+        with Tracer.session(self.current_slide.norm_path):
+            if DEFAULTS.slide_workers > 1 and len(self.slide_paths) > 1:
+                scheduler = SlideScheduler.from_defaults()
+                jobs = scheduler.slide_jobs(self.slide_paths, self.max_side_px,
+                                            len(DEFAULTS.stain_types()))
+                scheduler.run(jobs, lambda slide_path: self.slide_worker(slide_path).start_slide())
+            else:
+                for slide_path in self.slide_paths:
+                    self.current_slide.slide_path = slide_path
+                    self.start_slide()
+        self.scratch.clear()
         LOGGER.info_regular("so far, so good")  # when everything is finisehed
 
-    def slide_pre_processing(self, max_side_px: int) -> None:
-        """Re-usable slide pre-processing."""
+    def start_slide(self) -> None:
+        """Normalise self.current_slide."""
+        LOGGER.current_slide(self.current_slide.slide_path)
+        with self.profiler.slide(self.current_slide.slide_path), self.stage("slide") as event:
+            self.process_slide(max_side_px=self.max_side_px)
+            width, height = self.current_slide.wh
+            event.update(pixels=width * height, tiles=len(self.current_slide.tile_map),
+                         bytes_read=self.current_slide.slide_path.stat().st_size)
+        self.metrics.export()
+
+    def stage(self, stage: str, **fields: Any) -> ContextManager[Dict[str, Any]]:
+        """Metrics stage of the current slide (see MetricsRecorder.stage),
+        with its allocation peak if profiled.
+        """
+        slide = self.current_slide.slide_path.name
+        context = self.metrics.stage(stage, slide=slide, **fields)
+        if self.profiler.allocations:
+            return self.profiler.stage(context, stage, slide)
+        return context
+
+    def restore(self, img: npt.NDArray[Any], stain_types: Sequence[str],
+                out: Optional[npt.NDArray[Any]] = None, parallel: bool = True) -> npt.NDArray[Any]:
+        """Normalised images of all stain types of the slide sector (see fused_restore_multi),
+        mapped through the colour table of the slide if DEFAULTS.colour_lut_bits.
+        """
+        if DEFAULTS.colour_lut_bits:
+            return Normalisation.lut_restore(img, self.colour_lut(stain_types),
+                                             out=out, parallel=parallel)
+        return Normalisation.fused_restore_multi(img,
+                                                 self.current_slide.he,
+                                                 self.current_slide.tmp,
+                                                 DEFAULTS.normalising_c,
+                                                 DEFAULTS.he_ref,
+                                                 output_types=stain_types,
+                                                 out=out,
+                                                 parallel=parallel,
+                                                 tables=self.restore_tables(stain_types))
+
+    def restore_tables(self, stain_types: Sequence[str]) -> Tuple[Any, ...]:
+        """Fused kernel tables of the current slide (built on the first call once he and tmp are known)."""
+        key = tuple(stain_types)
+        with self.lut_lock:
+            if key not in self.current_slide.restore_tables:
+                self.current_slide.restore_tables[key] = Normalisation.restore_tables(
+                    self.current_slide.he, self.current_slide.tmp, DEFAULTS.normalising_c,
+                    DEFAULTS.he_ref, stain_types, parallel=self.parallel)
+            return self.current_slide.restore_tables[key]
+
+    def colour_lut(self, stain_types: Sequence[str]) -> npt.NDArray[Any]:
+        """Colour table of the stain types of the current slide (built on the first call once he
+        and tmp are known; the other tile workers wait meanwhile => the parallel kernel is used
+        unless slide workers run).
+        """
+        bits = DEFAULTS.colour_lut_bits
+        if bits not in range(4, 9):
+            raise UserInputError(incorrect_data=str(bits),
+                                 message="colour_lut_bits has to be 0 (off) or between 4 and 8")
+        key = tuple(stain_types)
+        with self.lut_lock:
+            if key not in self.current_slide.colour_lut:
+                with self.stage("lut", bits=bits, pixels=(2 ** bits + (bits < 8)) ** 3):
+                    self.current_slide.colour_lut[key] = Normalisation.colour_lut(self.current_slide.he,
+                                                                                  self.current_slide.tmp,
+                                                                                  DEFAULTS.normalising_c,
+                                                                                  DEFAULTS.he_ref,
+                                                                                  stain_types,
+                                                                                  bits=bits,
+                                                                                  parallel=self.parallel)
+            return self.current_slide.colour_lut[key]
+
+    def output_bytes(self, stain_type: str) -> int:
+        """Size of the normalised slide (JPEG or TIF) of the stain type."""
+        path = Path(self.current_slide.norm_path,
+                    f"{stain_type}_{self.current_slide.slide_path.stem}")
+        outputs = (path.with_suffix(".jpeg"), path.with_suffix(".tif"))
+        return sum(output.stat().st_size for output in outputs if output.exists())
+
+    def slide_worker(self, slide_path: Path) -> "NormaliseSlides":
+        """Shallow copy of the normaliser with its own CurrentSlide
+        => several slides can be normalised at once.
+        """
+        worker = copy.copy(self)
+        worker.parallel = False
+        worker.lut_lock = threading.Lock()
+        worker.current_slide = CurrentSlide(slide_path=slide_path,
+                                            temp_path=self.current_slide.temp_path,
+                                            norm_path=self.current_slide.norm_path)
+        return worker
+
+    def estimate_stains(self) -> None:
+        """Estimate slide-wide he and tmp before the tiles are processed
+        from a low resolution pyramid level or from sampled level 0 regions.
+        """
+        LOGGER.info_regular(f"estimating stains using {DEFAULTS.stain_estimation}")
+        with self.stage("read", source=DEFAULTS.stain_estimation) as event:
+            if DEFAULTS.stain_estimation == "level":
+                img = SlideTiler.low_res_sector(self.current_slide.slide_path,
+                                                DEFAULTS.estimation_max_side)
+            elif DEFAULTS.stain_estimation == "sampled":
+                img = SlideTiler.sampled_sectors(self.current_slide.os_slide,
+                                                 DEFAULTS.estimation_samples,
+                                                 DEFAULTS.estimation_sample_side)
+            else:
+                raise UserInputError(incorrect_data=str(DEFAULTS.stain_estimation),
+                                     message="stain_estimation has to be 'tile', 'level' or 'sampled'")
+            event.update(pixels=img.size // 3, bytes_read=img.nbytes)
+        # transient estimation buffers: released once he and tmp are set
+        with self.stage("estimate", pixels=img.size // 3, source=DEFAULTS.stain_estimation):
+            _, self.current_slide.tmp, self.current_slide.he = Normalisation.region_s(
+                img,
+                DEFAULTS.normalising_c,
+                DEFAULTS.alpha,
+                DEFAULTS.beta,
+                DEFAULTS.max_s_ref,
+                parallel=self.parallel)
+
+    def slide_pre_processing(self, max_side_px: int) -> int:
+        """Re-usable slide pre-processing.
+        Returns the maximum tile side used (planned for the slide if DEFAULTS.tile_autotune).
+        """
         os_slide = pyvips.Image.new_from_file(
             str(self.current_slide.slide_path), access="sequential")
         slide_wh = (os_slide.width, os_slide.height)
         self.current_slide.wh = slide_wh
         self.current_slide.os_slide = os_slide
+        max_side_px = ResourceChecker.slide_tile_size(os_slide, max_side_px, len(DEFAULTS.stain_types()))
+        self.current_slide.max_side_px = max_side_px
         LOGGER.info_regular(f"using maximum tile size of {max_side_px} pixel")
         self.current_slide.mn, self.current_slide.tile_map = SlideTiler.slicer(
-            slide_wh, max_side_px)
+            slide_wh, max_side_px, aligned=DEFAULTS.tile_autotune)
         LOGGER.total_tiles(self.current_slide.tile_map)
+        return max_side_px
 
     def repeat_stitching(self, stain_types: Union[str, List[str]] = DEFAULTS.stain_types()) -> None:
         """In case the slide tiles were processed, but the stitching caused a crash
@@ -648,6 +1486,9 @@ class NormaliseSlides:
         if len(self.slide_paths) > 1:
             raise UserInputError(
                 message="only one slide has to be selected for repeated stitching")
+        if DEFAULTS.stream_tiles:
+            raise UserInputError(
+                message="streamed slides have no temporary tiles to stitch")
         self.current_slide.slide_path = self.slide_paths[0]
         self.slide_pre_processing(max_side_px=self.max_side_px)
         self.current_slide.temp_subpath = Path(self.current_slide.temp_path,
@@ -667,6 +1508,7 @@ class NormaliseSlides:
                          f"{stain_type}_{current_slide.slide_path.stem}")
         i_range = len(current_slide.tile_map)
         if norm_path.with_suffix(".jpeg").exists() or norm_path.with_suffix(".tif").exists():
+            RawTileStore.remove(current_slide, stain_type)
             if not (False in [Path(current_slide.temp_subpath, f"{i}_{stain_type}.jpeg").exists() for i in range(i_range)]):
                 for i in range(i_range):
                     Path(current_slide.temp_subpath,
@@ -678,84 +1520,433 @@ class NormaliseSlides:
     @profile
     def process_slide(self, max_side_px: int) -> None:
         """Wrap for full slide processing."""
-        self.slide_pre_processing(max_side_px)
+        if DEFAULTS.engine not in ("numpy", "vips"):
+            raise UserInputError(message=f"unknown normalisation engine: {DEFAULTS.engine}")
+        if DEFAULTS.temp_tile_format not in ("jpeg", "raw"):
+            raise UserInputError(message=f"unknown temporary tile format: {DEFAULTS.temp_tile_format}")
+        max_side_px = self.slide_pre_processing(max_side_px)
+        self.scratch.reserve(self.current_slide.tile_map)
+        # flag indicates whether there is only one tile
+        single_run = len(self.current_slide.tile_map) == 1
+        # only tiles kept in the temporary folder can be resumed
+        self.current_slide.manifest = None
+        if DEFAULTS.resume and not single_run and DEFAULTS.engine == "numpy" and not DEFAULTS.stream_tiles:
+            if self.resume_manifest(max_side_px):
+                LOGGER.info_regular(
+                    f"{self.current_slide.slide_path.name} was already normalised, skipping")
+                return
         LOGGER.info_regular(
             f"normalising {self.current_slide.slide_path.name}")
         thumbnail_path = Path(self.current_slide.norm_path,
                               f"thumbnail_{self.current_slide.slide_path.stem}.jpeg")
         # creates thumbnail only if it is defined in DEFAULTS and if it does not exist already
+        thumbnail = None
         if DEFAULTS.thumbnail and not thumbnail_path.exists():
-            SlideTiler.thumbnail_from_image(self.current_slide)
-        # for the first run of the normaliser on the tile in the middle:
-        first_run = True
-        # flag indicates whether there is only one tile
-        single_run = len(self.current_slide.tile_map) == 1
-        if not single_run:
-            # create a subfolder for the tiles
-            self.current_slide.temp_subpath = Path(self.current_slide.temp_path,
-                                                   self.current_slide.slide_path.stem)
-            PathCreator.create_path(path=self.current_slide.temp_subpath,
-                                    rewrite=self.rewrite)
+            with self.stage("thumbnail"):
+                thumbnail = SlideTiler.thumbnail_from_image(self.current_slide)
+        # for the first run of the normaliser on the tile in the middle
+        # ..unless he and tmp are estimated for the whole slide beforehand
+        first_run = DEFAULTS.stain_estimation == "tile"
+        manifest = self.current_slide.manifest
+        stains = None
+        if manifest and manifest.stains:
+            stains = manifest.stains
+        elif self.stain_cache:
+            stains = self.stain_cache.get(self.current_slide.slide_path,
+                                          StainCache.params(max_side_px))
+        if stains:  # resumed or cached slide: the reference estimation is not repeated
+            self.current_slide.he, self.current_slide.tmp = stains
+            first_run = False
+            if manifest and not manifest.stains:
+                manifest.set_stains(self.current_slide.he, self.current_slide.tmp)
+        elif not first_run:
+            self.estimate_stains()
+            self.record_stains()
+        self.current_slide.tissue = None
+        self.current_slide.colour_lut = {}
+        self.current_slide.restore_tables = {}
+        if DEFAULTS.tissue_mask and not single_run:
+            self.tissue_detection(thumbnail)
+        if DEFAULTS.engine == "vips":
+            if first_run:
+                self.reference_stains()
+                self.record_stains()
+            self.vips_normalisation()
+            return
+        if DEFAULTS.stream_tiles:
+            if first_run:
+                self.reference_stains()
+                self.record_stains()
+            self.stream_normalisation(max_side_px)
+            return
+        if not single_run and not manifest:
+            self.create_temp_subpath(self.rewrite)
 
         # run normalisation for all tiles in tile_map
-        for i, location_size in self.current_slide.tile_map.items():
+        tile_items = list(self.current_slide.tile_map.items())
+        if manifest and not first_run:
+            tile_items = [(i, location_size) for i, location_size in tile_items
+                          if not self.tile_done(i, location_size)]
+            LOGGER.info_regular(
+                f"resuming: {len(self.current_slide.tile_map) - len(tile_items)}/{len(self.current_slide.tile_map)} tiles already normalised")
+        tiles = iter(tile_items)
+        if first_run:  # the reference tile has to be finished before the others
             LOGGER.next_tile()
             LOGGER.info(f"first run execution: {first_run}")
-            self.slice_normalisation(i, location_size, single_run, first_run)
-            first_run = False
-        # run tile stitching
+            self.tile_normalisation(*next(tiles), single_run, first_run=True,
+                                    parallel=self.parallel)
+        workers = ResourceChecker.tile_workers(max_side_px, len(DEFAULTS.stain_types()))
+        if workers > 1:
+            LOGGER.info_regular(f"normalising tiles using {workers} workers")
+            context = LOGGER.snapshot()
+
+            def tile_worker(tile: Tuple[int, Tuple[Tuple[int, int], Tuple[int, int]]]) -> None:
+                with LOGGER.tile_context(context):
+                    self.tile_normalisation(*tile, single_run, parallel=False)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for _ in pool.map(tile_worker, tiles):
+                    LOGGER.next_tile()
+        else:
+            for i, location_size in tiles:
+                LOGGER.next_tile()
+                self.tile_normalisation(i, location_size, single_run, parallel=self.parallel)
+        # run tile stitching (the numpy stitcher holds the whole slide => one output at a time)
         if not single_run:
-            for stain_type in DEFAULTS.stain_types():
-                SlideTiler.jpeg_stitcher(stain_type, self.current_slide)
-                if (DEFAULTS.remove_temporary_files is True):  # check explicitly for True
-                    self.cleaner(stain_type, self.current_slide)
+            self.output_writers(self.stitch_output,
+                                concurrent=DEFAULTS.temp_tile_format == "raw" or DEFAULTS.vips_stitcher)
+            if manifest:
+                manifest.finish()
+
+    def stitch_output(self, stain_type: str) -> None:
+        """Stitch the temporary tiles of the stain type into the normalised slide."""
+        with self.stage("stitch", stain_type=stain_type) as event:
+            SlideTiler.jpeg_stitcher(stain_type, self.current_slide)
+            event.update(pixels=self.current_slide.wh[0] * self.current_slide.wh[1],
+                         bytes_written=self.output_bytes(stain_type))
+        if (DEFAULTS.remove_temporary_files is True):  # check explicitly for True
+            self.cleaner(stain_type, self.current_slide)
+
+    @staticmethod
+    def output_writers(write: Callable[[str], None], concurrent: bool = True) -> None:
+        """Write the outputs of all stain types, at the same time (one thread per output)
+        if concurrent; errors are raised once all writers finished.
+        """
+        stain_types = DEFAULTS.stain_types()
+        if not concurrent or len(stain_types) == 1:
+            for stain_type in stain_types:
+                write(stain_type)
+            return
+        with ThreadPoolExecutor(max_workers=len(stain_types),
+                                thread_name_prefix="dogsled-writer") as pool:
+            futures = [pool.submit(write, stain_type) for stain_type in stain_types]
+        for future in futures:
+            future.result()
+
+    def record_stains(self) -> None:
+        """Keep the estimated he and tmp in the manifest and in the stain cache."""
+        if self.current_slide.manifest:
+            self.current_slide.manifest.set_stains(self.current_slide.he, self.current_slide.tmp)
+        if self.stain_cache:
+            self.stain_cache.put(self.current_slide.slide_path, StainCache.params(self.current_slide.max_side_px),
+                                 self.current_slide.he, self.current_slide.tmp)
+
+    def invalidate_stains(self) -> int:
+        """Remove the cached stain parameters of the selected slides
+        => they are estimated again on the next run. Returns the number of removed entries.
+        """
+        cache = self.stain_cache or StainCache.from_defaults()
+        return sum(cache.invalidate(slide_path) for slide_path in self.slide_paths)
+
+    def create_temp_subpath(self, rewrite: bool) -> None:
+        """Create the temporary subfolder (and raw canvases) of the current slide."""
+        self.current_slide.temp_subpath = Path(self.current_slide.temp_path,
+                                               self.current_slide.slide_path.stem)
+        PathCreator.create_path(path=self.current_slide.temp_subpath,
+                                rewrite=rewrite)
+        if DEFAULTS.temp_tile_format == "raw":
+            RawTileStore.create(self.current_slide, DEFAULTS.stain_types())
+
+    def resume_manifest(self, max_side_px: int) -> bool:
+        """Open (or start) the tile manifest of the current slide in its temporary subfolder.
+        Returns True if the slide was finished and all its outputs exist.
+        """
+        self.create_temp_subpath(rewrite=True)
+        manifest = TileManifest(self.current_slide.temp_subpath)
+        manifest.start({"wh": list(self.current_slide.wh),
+                        "max_side_px": max_side_px,
+                        "temp_tile_format": DEFAULTS.temp_tile_format})
+        self.current_slide.manifest = manifest
+        stem = self.current_slide.slide_path.stem
+        return manifest.finished and all(
+            Path(self.current_slide.norm_path, f"{stain_type}_{stem}.jpeg").exists()
+            or Path(self.current_slide.norm_path, f"{stain_type}_{stem}.tif").exists()
+            for stain_type in DEFAULTS.stain_types())
+
+    def tile_checksum(self, slice_index: int,
+                      location_size: Tuple[Tuple[int, int], Tuple[int, int]],
+                      stain_type: str) -> Optional[str]:
+        """Checksum of a saved tile (None if the tile file does not exist)."""
+        if DEFAULTS.temp_tile_format == "raw":
+            (left, top), (width, height) = location_size
+            canvas = RawTileStore.canvas(self.current_slide, stain_type, mode="r")
+            return TileManifest.checksum(canvas[top:top + height, left:left + width])
+        path = Path(self.current_slide.temp_subpath, f"{slice_index}_{stain_type}.jpeg")
+        if not path.exists():
+            return None
+        return TileManifest.checksum(path.read_bytes())
+
+    def tile_done(self, slice_index: int,
+                  location_size: Tuple[Tuple[int, int], Tuple[int, int]]) -> bool:
+        """Whether all outputs of the tile were saved by a previous (interrupted) run."""
+        return all(self.current_slide.manifest.done(slice_index, stain_type,
+                                                    self.tile_checksum(slice_index, location_size,
+                                                                       stain_type))
+                   for stain_type in DEFAULTS.stain_types())
+
+    def reference_stains(self) -> None:
+        """Estimate he and tmp on the first (reference) tile only."""
+        slice_index, (location, size) = next(iter(self.current_slide.tile_map.items()))
+        with self.stage("read", tile=slice_index, pixels=size[0] * size[1],
+                        bytes_read=size[0] * size[1] * 3):
+            img = Normalisation.read_sector(self.current_slide.os_slide, location, size)
+        # transient estimation buffers: released once he and tmp are set
+        with self.stage("estimate", tile=slice_index, pixels=size[0] * size[1]):
+            _, self.current_slide.tmp, self.current_slide.he = Normalisation.region_s(
+                img,
+                DEFAULTS.normalising_c,
+                DEFAULTS.alpha,
+                DEFAULTS.beta,
+                DEFAULTS.max_s_ref,
+                parallel=self.parallel)
+
+    def vips_normalisation(self) -> None:
+        """Normalise the whole slide as a lazy libvips pipeline
+        => no tiles, temporary files or stitching; memory does not grow with the slide size.
+        """
+        width, height = self.current_slide.wh
+
+        def write(stain_type: str) -> None:
+            with self.stage("write", stain_type=stain_type, pixels=width * height) as event:
+                # sequential access: every output streams the source slide once, top to bottom
+                slide = pyvips.Image.new_from_file(str(self.current_slide.slide_path),
+                                                   access="sequential")
+                normalised_slide = Normalisation.vips_restore(slide,
+                                                              self.current_slide.he,
+                                                              self.current_slide.tmp,
+                                                              DEFAULTS.normalising_c,
+                                                              DEFAULTS.he_ref,
+                                                              output_type=stain_type)
+                SlideTiler.vips_writer(normalised_slide, stain_type, self.current_slide)
+                event.update(bytes_written=self.output_bytes(stain_type))
+        # the outputs are written at the same time (each with its own source read)
+        self.output_writers(write)
+
+    def stream_normalisation(self, max_side_px: int) -> None:
+        """Normalise the slide row by row of tiles, streaming every row straight into
+        a TIF (pyramidal if DEFAULTS.tiff_pyramid) => one encode pass, no temporary tiles or stitching.
+        Every row is rendered once for all stain types; the TIFs are written at the same time.
+        """
+        width, height = self.current_slide.wh
+        stain_types = DEFAULTS.stain_types()
+        workers = ResourceChecker.tile_workers(max_side_px, len(stain_types))
+        LOGGER.info_regular(f"streaming tiles using {workers} workers")
+        fan_out = RowFanOut(self.stream_rows(stain_types, workers, LOGGER.snapshot()),
+                            len(stain_types))
+
+        def write(stain_type: str) -> None:
+            output = stain_types.index(stain_type)
+            try:
+                with self.stage("write", stain_type=stain_type, pixels=width * height) as event:
+                    stream = TileStream(width, height, fan_out.rows(output))
+                    SlideTiler.save_tif(stream.image(), stain_type, self.current_slide)
+                    stream.check()
+                    event.update(bytes_written=self.output_bytes(stain_type))
+            finally:  # rows not read by a failed writer would block the other outputs
+                fan_out.drain(output)
+            LOGGER.info_regular(f"{stain_type} TIF saved")
+            if DEFAULTS.thumbnail:
+                SlideTiler.thumbnail_from_image(slide=self.current_slide,
+                                                stain_type=stain_type,
+                                                slide_extension="tif")
+        fan_out.start()
+        try:
+            self.output_writers(write)
+        finally:
+            fan_out.check()
+
+    def stream_rows(self, stain_types: Sequence[str], workers: int = 1,
+                    context: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[npt.NDArray[Any], ...]]:
+        """Yield the normalised rows of tiles (top to bottom) of the current slide,
+        one row per stain type; the tiles are logged with the slide progress of context
+        (LOGGER.snapshot of the thread the rows are streamed for).
+        """
+        if context is None:
+            context = LOGGER.snapshot()
+        m_rows, n_cols = self.current_slide.mn
+        tile_map = self.current_slide.tile_map
+        for m in range(m_rows):
+            indexes = range(m * n_cols, (m + 1) * n_cols)
+            _, (_, row_height) = tile_map[indexes[0]]
+            rows = np.empty((len(stain_types), row_height, self.current_slide.wh[0], 3),
+                            dtype=np.uint8)
+
+            # rendered next to the libvips writer threads => single-threaded nogil kernels
+            def render(i: int) -> None:
+                (left, _), (tile_width, tile_height) = tile_map[i]
+                with LOGGER.tile_context(context), self.scratch.arena() as scratch:
+                    tiles = scratch.array("tiles", (len(stain_types), tile_height, tile_width, 3),
+                                          np.uint8)
+                    rows[:, :, left:left + tile_width] = self.render_tile(i, tile_map[i], stain_types,
+                                                                          parallel=False, out=tiles)
+            LOGGER.info_regular(f"streaming row {m + 1}/{m_rows}")
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(render, indexes))
+            else:
+                for i in indexes:
+                    render(i)
+            yield tuple(rows)
+
+    def render_tile(self, slice_index: int,
+                    location_size: Tuple[Tuple[int, int], Tuple[int, int]],
+                    stain_types: Sequence[str], parallel: bool = True,
+                    out: Optional[npt.NDArray[Any]] = None) -> npt.NDArray[Any]:
+        """Normalised tile of all stain types as a (stain types, height, width, 3) uint8 array,
+        written into out if given (broadcast background colours for tiles without tissue).
+        """
+        location, (width, height) = location_size
+        if self.current_slide.tissue and self.current_slide.tissue[slice_index] == 0:
+            colours = self.restore(self.current_slide.background, stain_types, parallel=parallel)
+            return np.broadcast_to(colours.reshape((len(stain_types), 1, 1, 3)),
+                                   (len(stain_types), height, width, 3))
+        with self.stage("read", tile=slice_index, pixels=width * height,
+                        bytes_read=width * height * 3):
+            img = Normalisation.read_sector(self.current_slide.os_slide, location, (width, height))
+        with self.stage("restore", tile=slice_index, stain_types=list(stain_types),
+                        pixels=width * height):
+            return self.restore(img, stain_types, out=out, parallel=parallel).reshape(
+                (len(stain_types), height, width, 3))
+
+    def tissue_detection(self, thumbnail: Optional[pyvips.vimage.Image] = None) -> None:
+        """Map the thumbnail tissue mask onto the tiles.
+        If the first tile contains no tissue, the tile with most tissue is processed first.
+        """
+        with self.stage("tissue"):
+            if thumbnail is None:
+                thumbnail = SlideTiler.source_thumbnail(self.current_slide)
+            mask, self.current_slide.background = SlideTiler.tissue_mask(
+                thumbnail, DEFAULTS.background_intensity)
+            tissue = SlideTiler.tissue_fractions(mask, self.current_slide.wh,
+                                                 self.current_slide.tile_map)
+        self.current_slide.tissue = tissue
+        LOGGER.info_regular(
+            f"tiles without tissue: {sum(fraction == 0 for fraction in tissue.values())}/{len(tissue)}")
+        first_tile = next(iter(self.current_slide.tile_map))
+        if tissue[first_tile] == 0 and max(tissue.values()) > 0:
+            self.current_slide.tile_map.move_to_end(max(tissue, key=tissue.get),
+                                                    last=False)
+
+    def tile_normalisation(self, slice_index: int,
+                           location_size: Tuple[Tuple[int, int], Tuple[int, int]],
+                           single_run: bool, first_run: bool = False,
+                           parallel: bool = True) -> None:
+        """Normalise one tile; tiles without tissue are written as background."""
+        with self.scratch.arena() as scratch:
+            if not first_run and self.current_slide.tissue and self.current_slide.tissue[slice_index] == 0:
+                self.background_normalisation(slice_index, location_size, parallel, scratch)
+            else:
+                self.slice_normalisation(slice_index, location_size, single_run, first_run, parallel,
+                                         scratch)
+
+    def background_normalisation(self, slice_index: int,
+                                 location_size: Tuple[Tuple[int, int], Tuple[int, int]],
+                                 parallel: bool = True,
+                                 scratch: Optional[ScratchArena] = None) -> None:
+        """Write a tile without tissue as constant (normalised) background colour."""
+        if scratch is None:
+            scratch = ScratchArena()
+        location, (width, height) = location_size
+        stain_types = DEFAULTS.stain_types()
+        # same restore as the tissue tiles (colour table if used) => no seams at tissue borders
+        colours = self.restore(self.current_slide.background, stain_types, parallel=parallel)
+        for stain_type, colour in zip(stain_types, colours):
+            tile = scratch.array("tile", (height, width, 3), np.uint8)
+            tile[:] = colour
+            self.save_tile(slice_index, location, stain_type, tile)
+
+    def save_tile(self, slice_index: int, location: Tuple[int, int], stain_type: str,
+                  tile: npt.NDArray[Any]) -> None:
+        """Save a normalised tile in the temporary folder (JPEG or in place on the raw canvas)."""
+        path = Path(self.current_slide.temp_subpath, f"{slice_index}_{stain_type}")
+        with self.stage("encode", tile=slice_index, stain_type=stain_type,
+                        pixels=tile.shape[0] * tile.shape[1]) as event:
+            if DEFAULTS.temp_tile_format == "raw":
+                RawTileStore.write(self.current_slide, stain_type, location, tile)
+                event.update(bytes_written=tile.shape[0] * tile.shape[1] * 3)
+            else:
+                Normalisation.save_jpeg(path, tile)
+                if self.metrics.enabled:
+                    event.update(bytes_written=path.with_suffix(".jpeg").stat().st_size)
+        # recorded only once the tile is saved
+        if self.current_slide.manifest:
+            if DEFAULTS.temp_tile_format == "raw":
+                md5 = TileManifest.checksum(tile)
+            else:
+                md5 = TileManifest.checksum(path.with_suffix(".jpeg").read_bytes())
+            self.current_slide.manifest.add(slice_index, stain_type, md5)
 
     @profile
     def slice_normalisation(self, slice_index: int,
                             location_size: Tuple[Tuple[int, int], Tuple[int, int]],
-                            single_run: bool, first_run: bool):
-        """Wrap for slide slice processing."""
+                            single_run: bool, first_run: bool, parallel: bool = True,
+                            scratch: Optional[ScratchArena] = None):
+        """Wrap for slide slice processing.
+        The tile arrays are taken from scratch (the worker's arena) if given.
+        """
+        if scratch is None:
+            scratch = ScratchArena()
         location, size = location_size
-        img = Normalisation.read_sector(
-            self.current_slide.os_slide, location, size)
-        LOGGER.info("slide sector in memory")
+        width, height = size
+        with self.stage("read", tile=slice_index, pixels=width * height,
+                        bytes_read=width * height * 3):
+            img = Normalisation.read_sector(
+                self.current_slide.os_slide, location, size)
+        LOGGER.progress_info("slide sector in memory")
         if first_run:  # use first slice as a reference for tmp and he calculation
-            # TODO check if temp and he are overwritten
-            s_cut, self.tmp, self.he = Normalisation.region_s(img,
-                                                              DEFAULTS.normalising_c,
-                                                              DEFAULTS.alpha,
-                                                              DEFAULTS.beta,
-                                                              DEFAULTS.max_s_ref)
-        else:
-            s_cut, _, _ = Normalisation.region_s(img,
-                                                 DEFAULTS.normalising_c,
-                                                 DEFAULTS.alpha,
-                                                 DEFAULTS.beta,
-                                                 DEFAULTS.max_s_ref,
-                                                 self.he)
-        LOGGER.info("s_cut, tmp, calculated")
-        c2 = Normalisation.s_final(s_cut, self.tmp)
-        del s_cut
-        # gc.collect()
-        for stain_type in DEFAULTS.stain_types():
-            restored_img = Normalisation.image_restore(c2,
-                                                       DEFAULTS.normalising_c,
-                                                       DEFAULTS.he_ref,
-                                                       size,
-                                                       output_type=stain_type)
-            LOGGER.info("image restored")
+            # transient estimation buffers (not kept in the worker's arena for the other tiles)
+            with self.stage("estimate", tile=slice_index, pixels=width * height):
+                _, self.current_slide.tmp, self.current_slide.he = Normalisation.region_s(
+                    img,
+                    DEFAULTS.normalising_c,
+                    DEFAULTS.alpha,
+                    DEFAULTS.beta,
+                    DEFAULTS.max_s_ref,
+                    parallel=parallel)
+            LOGGER.info("tmp, he calculated")
+            self.record_stains()
+        # all stain types are rendered in one pass over the tile
+        stain_types = DEFAULTS.stain_types()
+        with self.stage("restore", tile=slice_index, stain_types=stain_types,
+                        pixels=width * height):
+            restored_imgs = self.restore(img, stain_types,
+                                         out=scratch.array("tiles",
+                                                           (len(stain_types), height, width, 3),
+                                                           np.uint8),
+                                         parallel=parallel)
+        LOGGER.progress_info("image restored")
+        for stain_type, restored_img in zip(stain_types, restored_imgs):
             if not single_run:
-                # np.savez_compressed(Path(self.temp_path, f"{slice_index}_{stain_type}.npz"),
-                #                     slide_sector=restored_img)
                 # save as a tile in temp path
-                Normalisation.save_jpeg(Path(self.current_slide.temp_subpath,
-                                             f"{slice_index}_{stain_type}"),
-                                        restored_img)
+                self.save_tile(slice_index, location, stain_type, restored_img)
             else:
                 # ..or as an end-result in the norm_path
-                Normalisation.save_jpeg(Path(self.current_slide.norm_path,
-                                             f"{stain_type}_{self.current_slide.slide_path.stem}"),
-                                        restored_img)
+                with self.stage("encode", tile=slice_index, stain_type=stain_type,
+                                pixels=width * height) as event:
+                    Normalisation.save_jpeg(Path(self.current_slide.norm_path,
+                                                 f"{stain_type}_{self.current_slide.slide_path.stem}"),
+                                            restored_img)
+                    if self.metrics.enabled:
+                        event.update(bytes_written=self.output_bytes(stain_type))
                 # create additional tile TODO consirer removing?
                 if DEFAULTS.thumbnail:
                     SlideTiler.thumbnail_from_np(
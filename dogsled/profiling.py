@@ -0,0 +1,152 @@
+"""Profiling hooks.
+Switched on by DEFAULTS.profiling or the DOGSLED_PROFILE environment variable
+(e.g. DOGSLED_PROFILE=cprofile,tracemalloc), written to the norm path next to dogsled.log:
+- "cprofile": cProfile of every slide (cprofile_<slide>.prof & a cumulative-time summary)
+- "tracemalloc": traced allocation peak of every stage (tracemalloc.jsonl)
+- "line": line_profiler of the functions decorated with @profile (line_profile_<slide>.txt)
+=> production runs can be profiled without code edits.
+"""
+import io
+import os
+import json
+import pstats
+import cProfile
+import builtins
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Sequence
+
+from dogsled.defaults import DEFAULTS
+from dogsled.errors import UserInputError
+
+LOGGER = logging.getLogger(__name__)
+
+# functions decorated with @profile (line profiled if the "line" hook is used)
+PROFILED: List[Callable[..., Any]] = []
+
+
+def profile(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Register func for line profiling; kernprof's builtin profile is used if injected."""
+    if hasattr(builtins, "profile"):  # running under kernprof/memory_profiler
+        return builtins.profile(func)
+    PROFILED.append(func)
+    return func
+
+
+class Profiler:
+    """Profiling hooks of the slides and stages of one NormaliseSlides."""
+
+    HOOKS = ("cprofile", "tracemalloc", "line")
+    ENV_VAR = "DOGSLED_PROFILE"
+
+    def __init__(self, norm_path: Path, hooks: Sequence[str] = ()) -> None:
+        unknown = set(hooks) - set(self.HOOKS)
+        if unknown:
+            raise UserInputError(incorrect_data=", ".join(sorted(unknown)),
+                                 message=f"profiling hooks have to be some of {self.HOOKS}")
+        self.norm_path = Path(norm_path)
+        self.hooks = set(hooks)
+        self.enabled = bool(self.hooks)
+        self.allocations = "tracemalloc" in self.hooks
+        self.lock = threading.Lock()
+        # held by the slide being cProfiled: only one profiler can be active in the process
+        # (Python >= 3.12: "Another profiling tool is already active")
+        self.cprofile_lock = threading.Lock()
+        self.nested = threading.local()
+        self.line_profiler = None
+        if "line" in self.hooks:
+            try:
+                from line_profiler import LineProfiler
+            except ModuleNotFoundError:
+                raise UserInputError(message="line profiling requires line_profiler "
+                                             "(pip install line_profiler)")
+            self.line_profiler = LineProfiler(*PROFILED)
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def from_defaults(cls, norm_path: Path) -> "Profiler":
+        """Hooks of DEFAULTS.profiling and of the DOGSLED_PROFILE environment variable."""
+        hooks = list(DEFAULTS.profiling or [])
+        hooks += [hook.strip() for hook in os.environ.get(cls.ENV_VAR, "").split(",") if hook.strip()]
+        return cls(norm_path, hooks)
+
+    @contextmanager
+    def slide(self, slide_path: Path) -> Iterator[None]:
+        """cProfile and line-profile the slide (in the calling thread, tile worker threads are
+        not included); one slide is cProfiled at a time => slides started by other slide workers
+        meanwhile are not cProfiled.
+        """
+        if not (self.line_profiler or "cprofile" in self.hooks):
+            yield
+            return
+        profiler = None
+        if "cprofile" in self.hooks:
+            if self.cprofile_lock.acquire(blocking=False):
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                LOGGER.warning(f"{slide_path.name} is not cProfiled: another slide is profiled "
+                               f"meanwhile (use slide_workers=1 to profile every slide)")
+        if self.line_profiler:
+            self.line_profiler.enable_by_count()
+        try:
+            yield
+        finally:
+            if self.line_profiler:
+                self.line_profiler.disable_by_count()
+            if profiler:
+                profiler.disable()
+                self.cprofile_lock.release()
+                self.save_cprofile(profiler, slide_path.stem)
+            if self.line_profiler:
+                self.save_line_profile(slide_path.stem)
+
+    def save_cprofile(self, profiler: cProfile.Profile, slide_stem: str) -> None:
+        """pstats file & summary of the 50 functions with the highest cumulative time."""
+        path = Path(self.norm_path, f"cprofile_{slide_stem}.prof")
+        profiler.dump_stats(str(path))
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(50)
+        path.with_suffix(".txt").write_text(summary.getvalue(), encoding="utf-8")
+        LOGGER.info(f"cProfile saved to {path}")
+
+    def save_line_profile(self, slide_stem: str) -> None:
+        """Line timings of the @profile functions (accumulated over the slides profiled so far)."""
+        path = Path(self.norm_path, f"line_profile_{slide_stem}.txt")
+        with open(path, "w", encoding="utf-8") as line_profile:
+            self.line_profiler.print_stats(stream=line_profile)
+        LOGGER.info(f"line profile saved to {path}")
+
+    @contextmanager
+    def stage(self, context: ContextManager[Dict[str, Any]], stage: str,
+              slide: str) -> Iterator[Dict[str, Any]]:
+        """Traced allocation peak of a (metrics) stage, added to its event as peak_mb
+        and written to tracemalloc.jsonl; tracemalloc is process-wide => stages running
+        in other threads at the same time are included.
+        """
+        # peaks of the stages nested in this one (they reset the peak)
+        if not hasattr(self.nested, "peaks"):
+            self.nested.peaks = []
+        nested = self.nested.peaks
+        if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9; peak since start otherwise
+            tracemalloc.reset_peak()
+        nested.append(0)
+        with context as event:
+            try:
+                yield event
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, nested.pop())
+                if nested:
+                    nested[-1] = max(nested[-1], peak)
+            event.update(peak_mb=peak / 1024 ** 2)
+        record = {"slide": slide, "stage": stage, "peak_mb": peak / 1024 ** 2,
+                  "current_mb": current / 1024 ** 2,
+                  **{field: event[field] for field in ("tile", "stain_type") if field in event}}
+        with self.lock:
+            with open(Path(self.norm_path, "tracemalloc.jsonl"), "a", encoding="utf-8") as peaks:
+                peaks.write(json.dumps(record) + "\n")
@@ -0,0 +1,170 @@
+"""Cohort-level reference fitting.
+he_ref and max_s_ref are fitted from a set of reference slides with the Macenko maths used for
+single slides, but the sampled pixels are streamed through mergeable aggregates (OD moments
+for the covariance, fixed-bin histograms for the percentiles)
+=> memory is bounded by the pixels of the slides read at once, not by the cohort size.
+"""
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Any, Callable, List, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+import pyvips
+
+from dogsled.defaults import DEFAULTS
+from dogsled.normaliser import Normalisation, SlideTiler
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ODMoments:
+    """Count, sum and sum of outer products of OD values => covariance of all pixels seen."""
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.total = np.zeros(3)
+        self.outer = np.zeros((3, 3))
+
+    def update(self, od: npt.NDArray[Any]) -> "ODMoments":
+        """Add Nx3 OD values."""
+        od = od.astype(np.float64)
+        self.n += od.shape[0]
+        self.total += od.sum(axis=0)
+        self.outer += od.T @ od
+        return self
+
+    def merge(self, other: "ODMoments") -> "ODMoments":
+        """Add the moments of another set of pixels."""
+        self.n += other.n
+        self.total += other.total
+        self.outer += other.outer
+        return self
+
+    def covariance(self) -> npt.NDArray[Any]:
+        """Same as np.cov of all pixels."""
+        mean = self.total / self.n
+        return (self.outer - self.n * np.outer(mean, mean)) / (self.n - 1)
+
+
+class HistogramSketch:
+    """Fixed-bin histogram over lo..hi (out of range values go to the first/last bin);
+    percentiles are interpolated inside the bins => error <= bin width.
+    """
+
+    def __init__(self, lo: float, hi: float, bins: int = 1 << 16) -> None:
+        self.lo = lo
+        self.bins = bins
+        self.width = (hi - lo) / bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values: npt.NDArray[Any]) -> "HistogramSketch":
+        """Add values."""
+        self.counts += Normalisation.nb_histogram(np.ravel(values), self.lo, 1 / self.width,
+                                                  self.bins)
+        return self
+
+    def merge(self, other: "HistogramSketch") -> "HistogramSketch":
+        """Add the counts of a sketch with the same bins."""
+        self.counts += other.counts
+        return self
+
+    def percentile(self, q: float) -> float:
+        """Percentile of all values added (linear interpolation between order statistics)."""
+        cumulative = np.cumsum(self.counts)
+        n = int(cumulative[-1])
+        virtual = q / 100 * (n - 1)
+        k = int(np.floor(virtual))
+        order = []
+        for rank in (k, min(k + 1, n - 1)):
+            b = int(np.searchsorted(cumulative, rank, side="right"))
+            before = int(cumulative[b - 1]) if b else 0
+            order.append(self.lo + (b + (rank - before + 0.5) / self.counts[b]) * self.width)
+        return order[0] + (order[1] - order[0]) * (virtual - k)
+
+
+class Aggregates(tuple):
+    """Aggregates filled in the same pass, merged element-wise."""
+
+    def merge(self, other: "Aggregates") -> "Aggregates":
+        """Merge every aggregate with the matching one of the other pass."""
+        for aggregate, other_aggregate in zip(self, other):
+            aggregate.merge(other_aggregate)
+        return self
+
+
+class CohortReference:
+    """Fit he_ref and max_s_ref from reference slides (three streaming passes over the
+    sampled pixels: OD covariance, stain angles, stain concentrations).
+    """
+
+    def __init__(self, slide_paths: List[Path], workers: int = 1, source: str = "level") -> None:
+        if source not in ("level", "sampled"):
+            raise ValueError(f"unknown pixel source: {source}")
+        self.slide_paths = [Path(slide_path) for slide_path in slide_paths]
+        self.workers = max(workers, 1)
+        self.source = source
+
+    def od(self, slide_path: Path) -> npt.NDArray[Any]:
+        """Nx3 OD values of the pixels sampled from the slide
+        (same reads as stain_estimation "level" / "sampled").
+        """
+        LOGGER.info(f"reading {slide_path.name}")
+        if self.source == "level":
+            img = SlideTiler.low_res_sector(slide_path, DEFAULTS.estimation_max_side)
+        else:
+            img = SlideTiler.sampled_sectors(pyvips.Image.new_from_file(str(slide_path)),
+                                             DEFAULTS.estimation_samples,
+                                             DEFAULTS.estimation_sample_side)
+        return Normalisation.convert_od(img, DEFAULTS.normalising_c).astype(DEFAULTS.dtype)
+
+    def aggregate(self, per_slide: Callable[[npt.NDArray[Any]], Any]) -> Any:
+        """Apply per_slide to the OD values of every slide (in parallel) and merge the results."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda slide_path: per_slide(self.od(slide_path)),
+                               self.slide_paths)
+            return reduce(lambda merged, result: merged.merge(result), results)
+
+    @staticmethod
+    def tissue(od: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """Pixels with all OD values above beta (as in Normalisation.calculate_hem)."""
+        return od[~np.any(od < DEFAULTS.beta, axis=1)]
+
+    def fit(self) -> Tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """Fitted he_ref (3x2) and max_s_ref (2,)."""
+        LOGGER.info(f"fitting reference stains on {len(self.slide_paths)} slides")
+        moments = self.aggregate(lambda od: ODMoments().update(self.tissue(od)))
+        _, eigenvecs = np.linalg.eigh(moments.covariance())
+        plane = eigenvecs[:, 1:3]
+        plane = plane * np.where(plane.sum(axis=0) < 0, -1, 1)  # OD vectors are positive
+
+        angles = self.aggregate(lambda od: HistogramSketch(-np.pi, np.pi).update(
+            np.arctan2(*(self.tissue(od) @ plane).T[::-1])))
+        vectors = [plane @ np.array([np.cos(angle), np.sin(angle)])
+                   for angle in (angles.percentile(DEFAULTS.alpha),
+                                 angles.percentile(100 - DEFAULTS.alpha))]
+        # hematoxylin first (as in Normalisation.calculate_hem)
+        if vectors[0][0] < vectors[1][0]:
+            vectors = vectors[::-1]
+        he_ref = np.array(vectors).T
+
+        pinv = Normalisation.stain_pinv(he_ref)
+        # both stain saturations of a pixel come from the same projection => one pass
+        saturations = self.aggregate(lambda od: Aggregates(
+            HistogramSketch(-20, 20, 1 << 18).update(saturation) for saturation in (od @ pinv.T).T))
+        max_s_ref = np.array([saturation.percentile(99) for saturation in saturations])
+        return he_ref.astype(DEFAULTS.dtype), max_s_ref.astype(DEFAULTS.dtype)
+
+    @staticmethod
+    def save(path: Union[str, Path], he_ref: npt.NDArray[Any], max_s_ref: npt.NDArray[Any]) -> None:
+        """Save the fitted reference as .npz."""
+        np.savez(path, he_ref=he_ref, max_s_ref=max_s_ref)
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> None:
+        """Use a saved reference for normalisation (sets DEFAULTS.he_ref and DEFAULTS.max_s_ref)."""
+        reference = np.load(path)
+        DEFAULTS.he_ref = reference["he_ref"].astype(DEFAULTS.dtype)
+        DEFAULTS.max_s_ref = reference["max_s_ref"].astype(DEFAULTS.dtype)
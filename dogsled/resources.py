@@ -1,7 +1,8 @@
 """All reaource estimators live here."""
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+import math
 import logging
 import psutil
 
@@ -43,6 +44,60 @@ class ResourceEstimator:
         """Map of svs to jpeg."""
         return int(-2.28 + 1.51 * svs_size)
 
+    # peak bytes per tile pixel of the tile stages, measured by benchmark.MemoryCalibration
+    # (2048-8192 px tiles, 3 stain types; override by DEFAULTS.memory_model):
+    # read: RGBA sector from libvips (~4.5: kept by the RGB view of it through the whole tile)
+    # estimate (reference tile only, transient buffers): OD, tissue OD, projection, angles
+    #     and concentrations (~47.5)
+    # restore: one RGB output per stain type (3: scratch arena of the worker, kept until the
+    #     slides are finished)
+    # scratch: contiguous RGB copy of the sector (3, transient) + RGB background tile also kept
+    #     in the scratch arena of the worker (3)
+    MEMORY_MODEL = {"read": 5, "estimate": 48, "restore": 3, "scratch": 6}
+
+    @staticmethod
+    def memory_model() -> Dict[str, int]:
+        """Bytes per pixel of the tile stages (DEFAULTS.memory_model overrides the built-in ones)."""
+        return {**ResourceEstimator.MEMORY_MODEL, **(DEFAULTS.memory_model or {})}
+
+    @staticmethod
+    def tile_memory(max_side_px: int, outputs: int = 1, reference: bool = False) -> int:
+        """Estimate peak RAM (bytes) of one tile worker:
+        the read sector + the larger of the estimation (reference tile) and the scratch arena.
+        """
+        model = ResourceEstimator.memory_model()
+        stages = ResourceEstimator.scratch_memory(1, outputs)
+        if reference:
+            stages = max(stages, model["estimate"])
+        return max_side_px ** 2 * (model["read"] + stages)
+
+    @staticmethod
+    def scratch_memory(max_side_px: int, outputs: int = 1) -> int:
+        """Estimate the scratch arena (bytes) of one tile worker (outputs & background tile),
+        kept after the tile until the slides are finished.
+        """
+        model = ResourceEstimator.memory_model()
+        return max_side_px ** 2 * (model["restore"] * outputs + model["scratch"])
+
+    @staticmethod
+    def slide_memory(slide_wh: Tuple[int, int], max_side_px: int, outputs: int = 1) -> int:
+        """Estimate peak RAM (bytes) of one slide: all tile workers
+        or the NumPy stitcher (stitched rows + the stitched RGB image) if it needs more
+        ..next to the scratch arenas kept by the tile workers.
+        """
+        width, height = slide_wh
+        side = min(max_side_px, max(width, height))
+        if DEFAULTS.engine == "vips":  # only the reference tile is held in RAM
+            return ResourceEstimator.tile_memory(side)
+        tiles = max(ResourceEstimator.tile_memory(side, outputs, reference=True),
+                    ResourceEstimator.tile_memory(side, outputs) * max(DEFAULTS.tile_workers, 1))
+        if DEFAULTS.stream_tiles:  # + one row of tiles
+            return tiles + width * side * 3
+        if DEFAULTS.vips_stitcher or DEFAULTS.temp_tile_format == "raw":
+            return tiles
+        arenas = ResourceEstimator.scratch_memory(side, outputs) * max(DEFAULTS.tile_workers, 1)
+        return max(tiles, arenas + 2 * width * height * 3)
+
 
 class ResourceChecker:
     """Check how much RAM is available.
@@ -55,13 +110,94 @@ class ResourceChecker:
 
     @property
     def tile_size(self) -> int:
-        """Use RAM size to map to the tile size."""
+        """Use RAM size to map to the tile size (or plan it if DEFAULTS.tile_autotune)."""
+        if DEFAULTS.tile_autotune:
+            self._mpx = ResourceChecker.plan_tile_size(len(DEFAULTS.stain_types()))
+            return self._mpx
         available_mb = psutil.virtual_memory().available >> 20
         closest_mb = min(DEFAULTS.ram_megapixel.keys(),
                          key=lambda x: abs(x - available_mb))
         self._mpx = DEFAULTS.ram_megapixel[closest_mb]
         return self._mpx
 
+    # cgroup v2 / v1 memory limit and usage files
+    CGROUP_FILES = (("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+                    ("/sys/fs/cgroup/memory/memory.limit_in_bytes",
+                     "/sys/fs/cgroup/memory/memory.usage_in_bytes"))
+
+    @staticmethod
+    def cgroup_available() -> Optional[int]:
+        """Bytes left under the cgroup (container) memory limit; None if there is no limit."""
+        for limit_file, usage_file in ResourceChecker.CGROUP_FILES:
+            try:
+                limit = Path(limit_file).read_text().strip()
+                usage = int(Path(usage_file).read_text())
+            except (OSError, ValueError):
+                continue
+            if limit == "max" or int(limit) >= 1 << 60:  # v1 reports "no limit" as a huge number
+                return None
+            return max(int(limit) - usage, 0)
+        return None
+
+    @staticmethod
+    def available_memory() -> int:
+        """Available RAM (MB), limited by the cgroup memory limit."""
+        available = psutil.virtual_memory().available
+        cgroup = ResourceChecker.cgroup_available()
+        if cgroup is not None:
+            available = min(available, cgroup)
+        return available >> 20
+
+    @staticmethod
+    def memory_budget() -> int:
+        """RAM budget (MB) for normalisation: DEFAULTS.memory_budget_mb or available RAM."""
+        if DEFAULTS.memory_budget_mb:
+            return DEFAULTS.memory_budget_mb
+        return ResourceChecker.available_memory()
+
+    @staticmethod
+    def plan_tile_size(outputs: int = 1, align: int = 1, budget_mb: Optional[int] = None) -> int:
+        """Largest tile side (multiple of align, e.g. the source TIFF tile side) whose peak RAM,
+        the reference tile alone or DEFAULTS.tile_workers tiles at once, stays within
+        DEFAULTS.memory_headroom of the budget (shared by DEFAULTS.slide_workers slides).
+        """
+        if budget_mb is None:
+            budget_mb = ResourceChecker.memory_budget() // max(DEFAULTS.slide_workers, 1)
+        budget = (budget_mb << 20) * DEFAULTS.memory_headroom
+        per_px = max(ResourceEstimator.tile_memory(1, outputs, reference=True),
+                     ResourceEstimator.tile_memory(1, outputs) * max(DEFAULTS.tile_workers, 1))
+        side = math.isqrt(int(budget // per_px))
+        return max(align, side // align * align)
+
+    @staticmethod
+    def slide_tile_size(os_slide, max_side_px: int, outputs: int = 1) -> int:
+        """Maximum tile side of the slide: planned for it (aligned to its source tiles)
+        if DEFAULTS.tile_autotune, max_side_px otherwise.
+        """
+        if DEFAULTS.tile_autotune:
+            return ResourceChecker.plan_tile_size(outputs, ResourceChecker.source_tile_side(os_slide))
+        return max_side_px
+
+    @staticmethod
+    def source_tile_side(os_slide) -> int:
+        """Tile side of the source slide level 0 (1 if the slide is not tiled)."""
+        sides = [int(os_slide.get(field)) for field in ("openslide.level[0].tile-width",
+                                                        "openslide.level[0].tile-height")
+                 if os_slide.get_typeof(field)]
+        return max(sides, default=1)
+
+    @staticmethod
+    def tile_workers(max_side_px: int, outputs: int = 1) -> int:
+        """Number of parallel tile workers: DEFAULTS.tile_workers limited by
+        how many per-worker memory budgets fit in the available RAM.
+        """
+        if DEFAULTS.worker_memory_mb:
+            worker_mb = DEFAULTS.worker_memory_mb
+        else:
+            worker_mb = ResourceEstimator.tile_memory(max_side_px, outputs) >> 20
+        available_mb = ResourceChecker.available_memory()
+        return max(1, min(DEFAULTS.tile_workers, available_mb // max(worker_mb, 1)))
+
     @staticmethod
     def space(slide_paths: List[Path], norm_path: Path) -> Tuple[int, Optional[int], bool]:
         """Calculate required space for normalisation of the slides selected."""
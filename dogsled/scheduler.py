@@ -0,0 +1,88 @@
+"""Slide-level scheduler.
+Normalises several slides at once; a slide is started only when its estimated
+peak memory fits into the remaining RAM budget, the largest slides (by pixels) are started first.
+"""
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import pyvips
+
+from dogsled.defaults import DEFAULTS
+from dogsled.resources import ResourceChecker, ResourceEstimator
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class SlideJob:
+    """Class for holding a slide to normalise, its estimated peak memory and its size."""
+
+    slide_path: Path
+    memory_mb: int
+    # width x height of the slide (the peak memory of most outputs does not grow with it)
+    pixels: int = 0
+
+
+class SlideScheduler:
+    """Run slide jobs in parallel under a RAM budget (MB)."""
+
+    def __init__(self, workers: int, budget_mb: int) -> None:
+        self.workers = max(workers, 1)
+        self.budget_mb = budget_mb
+
+    @staticmethod
+    def slide_jobs(slide_paths: List[Path], max_side_px: int, outputs: int = 1) -> List[SlideJob]:
+        """Estimate the peak memory of every slide (only the slide header is read)
+        with the tile side the slide will be normalised with (planned if DEFAULTS.tile_autotune).
+        """
+        jobs = []
+        for slide_path in slide_paths:
+            slide = pyvips.Image.new_from_file(str(slide_path))
+            memory = ResourceEstimator.slide_memory((slide.width, slide.height),
+                                                    ResourceChecker.slide_tile_size(slide, max_side_px,
+                                                                                    outputs),
+                                                    outputs)
+            jobs.append(SlideJob(slide_path=slide_path, memory_mb=memory >> 20,
+                                 pixels=slide.width * slide.height))
+        return jobs
+
+    @staticmethod
+    def order(jobs: List[SlideJob]) -> List[SlideJob]:
+        """Largest slides first (longest processing time first => shorter makespan);
+        the memory estimate is only used for admission.
+        """
+        return sorted(jobs, key=lambda job: job.pixels, reverse=True)
+
+    def run(self, jobs: List[SlideJob], process: Callable[[Path], None]) -> None:
+        """Start the first (largest) pending job that fits into the remaining budget
+        whenever a worker is free; a job larger than the whole budget runs alone.
+        """
+        pending = self.order(jobs)
+        running: Dict[Future, SlideJob] = {}
+        available_mb = self.budget_mb
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                job = None
+                if len(running) < self.workers:
+                    job = next((job for job in pending if job.memory_mb <= available_mb), None)
+                    if job is None and pending and not running:
+                        job = pending[0]
+                if job is not None:
+                    LOGGER.info(f"starting {job.slide_path.name} (~{job.memory_mb} MB)")
+                    pending.remove(job)
+                    available_mb -= job.memory_mb
+                    running[pool.submit(process, job.slide_path)] = job
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    available_mb += running.pop(future).memory_mb
+                    future.result()  # re-raise errors of the slide
+
+    @classmethod
+    def from_defaults(cls) -> "SlideScheduler":
+        """Scheduler with DEFAULTS.slide_workers workers and the available RAM budget."""
+        return cls(workers=DEFAULTS.slide_workers,
+                   budget_mb=ResourceChecker.memory_budget())
@@ -0,0 +1,85 @@
+"""Reusable scratch buffers.
+The OD, mask, projection, concentration and output arrays of a tile are views into named byte
+buffers of a worker's arena; the buffers are sized to the largest tile of the slide and only grow
+=> no allocations per tile once the first tiles are processed, no RSS fragmentation over long runs.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ScratchArena:
+    """Named scratch buffers of one worker (used by one thread at a time)."""
+
+    # values per pixel reserved for every buffer (RGB/OD channels)
+    CHANNELS = 3
+
+    def __init__(self, pixels: int = 0) -> None:
+        # pixels of the largest tile => minimal capacity of a new buffer
+        self.pixels = pixels
+        self.buffers: Dict[str, npt.NDArray[Any]] = {}
+
+    def array(self, name: str, shape: Tuple[int, ...], dtype: Any) -> npt.NDArray[Any]:
+        """Uninitialised C-contiguous array of the shape & dtype backed by the named buffer;
+        valid until the same name is requested again.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < nbytes:
+            capacity = max(nbytes, self.pixels * self.CHANNELS * dtype.itemsize)
+            LOGGER.debug(f"scratch buffer {name}: {capacity / 1024 ** 2:.1f} MB")
+            buffer = self.buffers[name] = np.empty(capacity, dtype=np.uint8)
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of all buffers."""
+        return sum(buffer.size for buffer in self.buffers.values())
+
+
+class ScratchPool:
+    """Arenas of the workers of a normaliser: a worker takes an arena for a tile and returns
+    it afterwards => one arena per concurrently running worker, shared by the slide workers.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.free: List[ScratchArena] = []
+        self.pixels = 0
+
+    def reserve(self, tile_map: Dict[int, Tuple[Tuple[int, int], Tuple[int, int]]]) -> None:
+        """Size new buffers to the largest tile of the slide."""
+        pixels = max((width * height for _, (width, height) in tile_map.values()), default=0)
+        with self.lock:
+            self.pixels = max(self.pixels, pixels)
+
+    @contextmanager
+    def arena(self) -> Iterator[ScratchArena]:
+        """Arena for the block (not used by any other thread meanwhile)."""
+        with self.lock:
+            arena = self.free.pop() if self.free else ScratchArena()
+            arena.pixels = self.pixels
+        try:
+            yield arena
+        finally:
+            with self.lock:
+                self.free.append(arena)
+
+    def clear(self) -> None:
+        """Release the buffers (once all slides are normalised)."""
+        with self.lock:
+            self.free = []
+            self.pixels = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the buffers of the returned arenas."""
+        with self.lock:
+            return sum(arena.nbytes for arena in self.free)
@@ -4,17 +4,19 @@ Creates paquo project instance.
 TODO probably should remove the whole module
 """
 
-from typing import Union
+from typing import Union, Any
 from pathlib import Path
 import logging
-from typing import Tuple
-from dataclasses import dataclass
+from typing import Tuple, Dict
+from dataclasses import dataclass, field
 from collections import OrderedDict
 
+import numpy.typing as npt
 import pyvips
 from paquo.projects import QuPathProject
 
 from dogsled.paths import PathChecker
+from dogsled.manifest import TileManifest
 
 LOGGER = logging.getLogger(__name__)
 path_checker = PathChecker()
@@ -38,10 +40,25 @@ class CurrentSlide:
     os_slide: pyvips.vimage.Image = None
     # original slide width x height
     wh: Tuple[int, int] = None
+    # maximum tile side used for the slide
+    max_side_px: int = None
     # tile m x n matrix
     mn: Tuple[int, int] = None
     # tile location size tuples
     tile_map: OrderedDict[int, Tuple[Tuple[int, int], Tuple[int, int]]] = None
+    # tile index: fraction of tissue pixels (None if tissue detection is not used)
+    tissue: Dict[int, float] = None
+    # median RGB of the background pixels, shape (1, 3)
+    background: npt.NDArray[Any] = None
+    # slide-specific stain vectors and saturation scaling
+    he: npt.NDArray[Any] = None
+    tmp: npt.NDArray[Any] = None
+    # colour lookup tables {stain types: colour_lut} (built once he and tmp are known)
+    colour_lut: Dict[Tuple[str, ...], npt.NDArray[Any]] = field(default_factory=dict)
+    # fused kernel tables {stain types: restore_tables} (built once he and tmp are known)
+    restore_tables: Dict[Tuple[str, ...], Tuple[Any, ...]] = field(default_factory=dict)
+    # finished tiles of the slide (None if normalisation is not resumable)
+    manifest: TileManifest = None
 
 
 class QuPathSlides:
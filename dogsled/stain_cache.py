@@ -0,0 +1,125 @@
+"""Persistent stain parameter cache.
+Slide-specific he and tmp are stored on disk (one JSON file per slide and estimation setting)
+=> repeated runs on the same slide skip the reference estimation and go straight to the apply stage.
+"""
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+
+from dogsled.defaults import DEFAULTS
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StainCache:
+    """he/tmp of the slides keyed by slide identity and estimation parameters;
+    least recently used entries are evicted when there are more than max_entries.
+    """
+
+    def __init__(self, cache_path: Union[str, Path], max_entries: int = 1000,
+                 key_type: str = "stat") -> None:
+        self.cache_path = Path(cache_path)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.key_type = key_type
+
+    @classmethod
+    def from_defaults(cls) -> "StainCache":
+        """Cache at DEFAULTS.stain_cache_path or in the user cache folder."""
+        cache_path = DEFAULTS.stain_cache_path
+        if cache_path is None:
+            cache_path = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"), "dogsled")
+        return cls(cache_path, DEFAULTS.stain_cache_entries, DEFAULTS.stain_cache_key)
+
+    def slide_id(self, slide_path: Path) -> str:
+        """Slide identity: path, size & mtime ("stat") or size & md5 of the first
+        and last MB of the file ("content", survives moving/copying the slide).
+        """
+        stat = slide_path.stat()
+        if self.key_type == "content":
+            md5 = hashlib.md5(str(stat.st_size).encode())
+            with open(slide_path, "rb") as slide:
+                md5.update(slide.read(1 << 20))
+                slide.seek(max(stat.st_size - (1 << 20), 0))
+                md5.update(slide.read(1 << 20))
+            return md5.hexdigest()
+        return hashlib.md5(
+            f"{slide_path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+
+    @staticmethod
+    def params(max_side_px: int) -> Dict[str, Any]:
+        """Everything the estimated he and tmp depend on apart from the slide."""
+        params = {"stain_estimation": DEFAULTS.stain_estimation,
+                  "normalising_c": DEFAULTS.normalising_c,
+                  "alpha": DEFAULTS.alpha,
+                  "beta": DEFAULTS.beta,
+                  "percentile_tolerance": DEFAULTS.percentile_tolerance,
+                  "max_s_ref": np.asarray(DEFAULTS.max_s_ref).tolist()}
+        if DEFAULTS.stain_estimation == "tile":  # reference tile
+            params.update(max_side_px=max_side_px, first_tile=DEFAULTS.first_tile,
+                          tissue_mask=DEFAULTS.tissue_mask,
+                          background_intensity=DEFAULTS.background_intensity)
+        elif DEFAULTS.stain_estimation == "level":
+            params.update(estimation_max_side=DEFAULTS.estimation_max_side)
+        else:
+            params.update(estimation_samples=DEFAULTS.estimation_samples,
+                          estimation_sample_side=DEFAULTS.estimation_sample_side)
+        return params
+
+    def entry_path(self, slide_path: Path, params: Dict[str, Any]) -> Path:
+        """Cache file of the slide & parameters: <slide id>_<parameter hash>.json."""
+        params_id = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return Path(self.cache_path, f"{self.slide_id(slide_path)}_{params_id[:16]}.json")
+
+    def get(self, slide_path: Path, params: Dict[str, Any]
+            ) -> Optional[Tuple[npt.NDArray[Any], npt.NDArray[Any]]]:
+        """Cached he and tmp (None if not cached)."""
+        path = self.entry_path(slide_path, params)
+        try:
+            with open(path, "r", encoding="utf-8") as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)  # most recently used
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        LOGGER.info(f"cached stain parameters used for {slide_path.name}")
+        return np.array(entry["he"]), np.array(entry["tmp"], dtype=DEFAULTS.dtype)
+
+    def put(self, slide_path: Path, params: Dict[str, Any],
+            he: npt.NDArray[Any], tmp: npt.NDArray[Any]) -> None:
+        """Store he and tmp (atomically => safe for slides normalised at once), then evict."""
+        path = self.entry_path(slide_path, params)
+        temp_path = path.with_suffix(f".{os.getpid()}.{id(he)}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as entry_file:
+            json.dump({"slide": str(slide_path), "params": params,
+                       "he": np.asarray(he).tolist(), "tmp": np.asarray(tmp).tolist()},
+                      entry_file)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries above max_entries."""
+        entries = []
+        for entry in self.cache_path.glob("*.json"):
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:  # removed by another slide worker
+                pass
+        entries.sort()
+        for _, entry in entries[:max(len(entries) - self.max_entries, 0)]:
+            entry.unlink(missing_ok=True)
+
+    def invalidate(self, slide_path: Optional[Path] = None) -> int:
+        """Remove the entries of a slide (all settings) or the whole cache if slide_path is None.
+        Returns the number of removed entries.
+        """
+        pattern = f"{self.slide_id(Path(slide_path))}_*.json" if slide_path else "*.json"
+        entries = list(self.cache_path.glob(pattern))
+        for entry in entries:
+            entry.unlink(missing_ok=True)
+        return len(entries)
@@ -0,0 +1,109 @@
+"""Tile streaming.
+Normalised tile rows are handed to libvips as a raw (PPM) stream while they are produced
+=> the output file is encoded in one pass, no temporary tiles are written or decoded.
+Rows rendered once for several outputs are fanned out to one stream per output
+=> all outputs are encoded at the same time.
+"""
+import queue
+import logging
+import threading
+from typing import Any, Iterator, List, Optional, Sequence
+
+import numpy as np
+import numpy.typing as npt
+import pyvips
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TileStream:
+    """Sequential libvips image fed by rows of uint8 RGB pixels (height x width x 3).
+    Rows are requested only when libvips reads them => one row is held in RAM at a time.
+    """
+
+    def __init__(self, width: int, height: int,
+                 rows: Iterator[npt.NDArray[Any]]) -> None:
+        self.width = width
+        self.height = height
+        self.rows = rows
+        self.error: Optional[BaseException] = None
+        self._buffer = memoryview(f"P6\n{width} {height}\n255\n".encode())
+        # the source has to stay alive as long as libvips reads from it
+        self.source = pyvips.SourceCustom()
+        self.source.on_read(self.read)
+
+    def read(self, size: int) -> bytes:
+        """libvips read callback: next (at most) size bytes of the stream, b"" at the end."""
+        try:
+            while not len(self._buffer):
+                row = next(self.rows, None)
+                if row is None:
+                    return b""
+                self._buffer = memoryview(np.ascontiguousarray(row, dtype=np.uint8)).cast("B")
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+            return bytes(chunk)
+        except BaseException as error:  # errors can not cross the libvips callback
+            self.error = error
+            return b""
+
+    def image(self) -> pyvips.vimage.Image:
+        """Lazy image of the stream; has to be evaluated (saved) only once."""
+        return pyvips.Image.ppmload_source(self.source)
+
+    def check(self) -> None:
+        """Re-raise an error of the row producer after the image was evaluated."""
+        if self.error is not None:
+            raise self.error
+
+
+class RowFanOut:
+    """Rows of several outputs rendered together, handed to one TileStream per output.
+    A producer thread puts the row of every output into its bounded queue
+    => the outputs are consumed (encoded) at the same time, at most depth rows
+    per output are held in RAM.
+    """
+
+    def __init__(self, rows: Iterator[Sequence[npt.NDArray[Any]]], outputs: int,
+                 depth: int = 1) -> None:
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=depth) for _ in range(outputs)]
+        self.finished = [False] * outputs
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.produce, args=(rows,),
+                                       name="dogsled-rows", daemon=True)
+
+    def start(self) -> None:
+        """Start rendering the rows."""
+        self.thread.start()
+
+    def produce(self, rows: Iterator[Sequence[npt.NDArray[Any]]]) -> None:
+        """Distribute the rows; every output ends with None (also if the rows fail)."""
+        try:
+            for output_rows in rows:
+                for row_queue, row in zip(self.queues, output_rows):
+                    row_queue.put(row)
+        except BaseException as error:
+            self.error = error
+        finally:
+            for row_queue in self.queues:
+                row_queue.put(None)
+
+    def rows(self, output: int) -> Iterator[npt.NDArray[Any]]:
+        """Rows of the output (until all rows are produced or the producer failed)."""
+        while True:
+            row = self.queues[output].get()
+            if row is None:
+                self.finished[output] = True
+                return
+            yield row
+
+    def drain(self, output: int) -> None:
+        """Discard the remaining rows of an output which is not read anymore."""
+        while not self.finished[output]:
+            if self.queues[output].get() is None:
+                self.finished[output] = True
+
+    def check(self) -> None:
+        """Wait for the producer, re-raise its error."""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
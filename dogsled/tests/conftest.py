@@ -76,6 +76,18 @@ def qupath_project(test_slides):
         yield qupath_proj
 
 
+@pytest.fixture(scope="session")
+def synthetic_slide():
+    """Offline multi-tile slide (generated once per session)."""
+    from dogsled.synthetic import SyntheticSlide
+    synthetic_path = Path(DATA_PATH, "synthetic")
+    synthetic_path.mkdir(exist_ok=True)
+    slide_file = Path(synthetic_path, "synthetic-4096x3072.svs")
+    if not slide_file.is_file():
+        SyntheticSlide(4096, 3072).save(slide_file)
+    yield slide_file
+
+
 @pytest.fixture(scope="session")
 def norm_path():
     norm_path_ = Path(DATA_PATH, "normalised")
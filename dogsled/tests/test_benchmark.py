@@ -0,0 +1,131 @@
+import json
+
+import numpy as np
+import pytest
+
+from dogsled.__main__ import main
+from dogsled.benchmark import (KernelBenchmark, MemoryCalibration, PipelineBenchmark, StageTimer,
+                               defaults_override)
+from dogsled.defaults import DEFAULTS
+from dogsled.normaliser import LOGGER, Normalisation
+from dogsled.resources import ResourceEstimator
+
+
+def test_synthetic_tile():
+    """Synthetic tiles are deterministic and contain tissue & background."""
+    tile = KernelBenchmark.synthetic_tile(100)
+    assert tile.shape == (100, 100, 3) and tile.dtype == np.uint8
+    np.testing.assert_array_equal(tile, KernelBenchmark.synthetic_tile(100))
+    assert np.any(tile.min(axis=2) >= DEFAULTS.background_intensity)
+    assert np.any(tile.max(axis=2) < DEFAULTS.background_intensity)
+
+
+def test_kernel_cases():
+    """Only the float kernels are run for every dtype."""
+    benchmark = KernelBenchmark(sides=(64, 128), dtypes=("float32", "float64"))
+    cases = list(benchmark.cases())
+    assert ("nb_lstsq", 64, "float64") in cases
+    assert ("save_jpeg", 128, "uint8") in cases
+    assert ("lut_restore", 64, "uint8") in cases
+    assert len(cases) == 2 * (2 * len(KernelBenchmark.FLOAT_KERNELS) + len(KernelBenchmark.FIXED_DTYPES))
+    assert KernelBenchmark.megapixels("colour_lut", 64) == KernelBenchmark.megapixels("colour_lut", 128)
+    with pytest.raises(ValueError):
+        KernelBenchmark(kernels=("lstsq",))
+
+
+def test_kernel_benchmark(tmp_path):
+    """All kernels run; DEFAULTS.dtype is restored afterwards."""
+    dtype = DEFAULTS.dtype
+    results = KernelBenchmark(sides=(64,), dtypes=("float64",), repeats=1).run()
+    assert DEFAULTS.dtype is dtype
+    assert [result["kernel"] for result in results] == list(KernelBenchmark.KERNELS)
+    assert all(result["mpix_s"] > 0 and result["peak_mb"] >= 0 for result in results)
+
+    path = tmp_path / "baseline.json"
+    KernelBenchmark.save(path, results)
+    assert KernelBenchmark.load(path) == results
+    assert "MPix/s" in KernelBenchmark.table(results, results)
+
+
+def test_compare():
+    """Slower or more memory hungry cases are regressions, missing cases are ignored."""
+    baseline = [{"kernel": "nb_lstsq", "side": 512, "dtype": "float32",
+                 "mpix_s": 100.0, "peak_mb": 10.0}]
+    same = [dict(baseline[0], mpix_s=90.0, peak_mb=11.0)]
+    slower = [dict(baseline[0], mpix_s=50.0)]
+    bigger = [dict(baseline[0], peak_mb=30.0)]
+    other = [dict(baseline[0], side=1024, mpix_s=1.0)]
+    assert KernelBenchmark.compare(same, baseline) == []
+    assert len(KernelBenchmark.compare(slower, baseline)) == 1
+    assert "peak" in KernelBenchmark.compare(bigger, baseline)[0]
+    assert KernelBenchmark.compare(other, baseline) == []
+
+
+def test_bench_kernels_cli(tmp_path, capsys):
+    """python -m dogsled bench-kernels saves a baseline & fails on regressions."""
+    baseline = tmp_path / "baseline.json"
+    args = ["bench-kernels", "--sides", "64", "--kernels", "convert_od", "--dtypes", "float32",
+            "--repeats", "1"]
+    main(args + ["--save", str(baseline)])
+    assert "convert_od" in capsys.readouterr().out
+    results = KernelBenchmark.load(baseline)
+    KernelBenchmark.save(baseline, [dict(results[0], mpix_s=results[0]["mpix_s"] * 1000)])
+    with pytest.raises(SystemExit):
+        main(args + ["--baseline", str(baseline)])
+
+
+
+def test_memory_model():
+    """The built-in memory model is within 25 % of the bytes per pixel measured on a tile."""
+    measured = MemoryCalibration(side=2048).run()
+    for stage, bytes_per_px in ResourceEstimator.MEMORY_MODEL.items():
+        assert abs(measured[stage] - bytes_per_px) <= 0.25 * bytes_per_px, (stage, measured[stage])
+
+
+def test_defaults_override():
+    """DEFAULTS are restored, also after an error."""
+    tile_workers = DEFAULTS.tile_workers
+    with pytest.raises(RuntimeError):
+        with defaults_override(tile_workers=tile_workers + 3):
+            assert DEFAULTS.tile_workers == tile_workers + 3
+            raise RuntimeError
+    assert DEFAULTS.tile_workers == tile_workers
+
+
+def test_stage_timer(tmp_path):
+    """Stage functions are timed only within timing() and nested stages are not counted twice."""
+    read_sector = Normalisation.__dict__["read_sector"]
+    timer = StageTimer()
+    with timer.timing():
+        assert Normalisation.__dict__["read_sector"] is not read_sector
+        tile = KernelBenchmark.synthetic_tile(64)
+        timer.wrap("stitch", lambda: Normalisation.save_jpeg(tmp_path / "tile", tile))()
+    assert Normalisation.__dict__["read_sector"] is read_sector
+    assert timer.seconds["encode"] == 0 and timer.seconds["stitch"] > 0
+
+
+def test_pipeline_benchmark(synthetic_slide):
+    """Every combination of the grid is normalised; no log handlers are left behind."""
+    handlers = LOGGER.listener.handlers
+    results = PipelineBenchmark(synthetic_slide, sides=(2048,), workers=(1, 2),
+                                modes=("jpeg", "tif")).run()
+    assert LOGGER.listener.handlers == handlers and not LOGGER.log_files
+    assert [(result["mode"], result["workers"]) for result in results] == [
+        ("jpeg", 1), ("jpeg", 2), ("tif", 1), ("tif", 2)]
+    for result in results:
+        assert result["tiles"] > 1 and result["temp_bytes"] > 0
+        assert result["mpix_s"] > 0 and result["peak_rss_mb"] > 0
+        assert result["stages"]["read"] > 0 and result["stages"]["stitch"] > 0
+    with pytest.raises(ValueError):
+        PipelineBenchmark(synthetic_slide, modes=("png",))
+
+
+def test_bench_cli(tmp_path, capsys):
+    """python -m dogsled bench on a synthetic slide prints a table and saves JSON."""
+    output = tmp_path / "bench.json"
+    main(["bench", "--synthetic", "1024", "768", "--sides", "512", "--workers", "1",
+          "--modes", "stream", "--work-path", str(tmp_path), "--output", str(output)])
+    assert "stream" in capsys.readouterr().out
+    with open(output, encoding="utf-8") as bench:
+        results = json.load(bench)["results"]
+    assert results[0]["side"] == 512 and results[0]["temp_bytes"] == 0
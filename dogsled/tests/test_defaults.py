@@ -23,23 +23,54 @@ def defaults_source_full():
     DEFAULTS = {
         "show_results": False,
         "ram_megapixel": {1000: 1000, 1200100: 24500000},
+        "tile_workers": 1,
+        "worker_memory_mb": None,
+        "slide_workers": 1,
+        "memory_budget_mb": None,
+        "tile_autotune": False,
+        "memory_headroom": 0.8,
+        "memory_model": None,
         "output_type": [StainTypes.norm],
         "dtype": np.float64,
         "numba_dtype": numba.float32,
         "normalising_c": 255,
         "alpha": 0.0001,
         "beta": 0.0015,
+        "percentile_tolerance": 0.0,
         "temporary_folder_name": "dogsled_temp",
         "remove_temporary_files": True,
+        "temp_tile_format": "jpeg",
+        "resume": False,
         "jpeg_quality": 95,
         "vips_tiff_compression": "lzw",
+        "tiff_pyramid": False,
+        "tiff_format": "aperio",
         "thumbnail": True,
         "thumbnail_max_side": 6000,
         "vips_stitcher": False,
+        "stream_tiles": False,
         "OpenSlide_formats": [".svs", ".tif", ".tiff", ".scn",
                               ".vms", ".vmu", ".ndpi", ".mrxs",
                               ".svslide", ".bif"],
         "first_tile": "middle",
+        "tissue_mask": False,
+        "background_intensity": 220,
+        "stain_estimation": "tile",
+        "engine": "numpy",
+        "colour_lut_bits": 0,
+        "estimation_max_side": 4096,
+        "estimation_samples": 16,
+        "estimation_sample_side": 1024,
+        "stain_cache": False,
+        "stain_cache_path": None,
+        "stain_cache_entries": 1000,
+        "stain_cache_key": "stat",
+        "metrics": False,
+        "metrics_prometheus_path": None,
+        "trace": False,
+        "trace_path": None,
+        "profiling": [],
+        "log_interval": 0.5,
         "libvips_url": "https://github.com/libvips/build-win64-mxe/releases/download/v8.12.0/vips-dev-w64-web-8.12.0-static.zip",
         "libvips_md5": "9a5dc27f6e9aae423ea620447dc67f1e",
         "he_ref": np.array([[0.68923328, 0.17593921],
@@ -54,23 +85,54 @@ def defaults_source_full_wrong():
     DEFAULTS = {
         "show_resultS": False,
         "ram_megapixel": {1000: 1000, 1200100: 24500000},
+        "tile_workers": 1,
+        "worker_memory_mb": None,
+        "slide_workers": 1,
+        "memory_budget_mb": None,
+        "tile_autotune": False,
+        "memory_headroom": 0.8,
+        "memory_model": None,
         "output_type": [StainTypes.norm],
         "dtype": np.float64,
         "numba_dtype": numba.float32,
         "normalising_c": 255,
         "alpha": 0.0001,
         "beta": 0.0015,
+        "percentile_tolerance": 0.0,
         "temporary_folder_name": "dogsled_temp",
         "remove_temporary_files": True,
+        "temp_tile_format": "jpeg",
+        "resume": False,
         "jpeg_quality": 95,
         "vips_tiff_compression": "lzw",
+        "tiff_pyramid": False,
+        "tiff_format": "aperio",
         "thumbnail": True,
         "thumbnail_max_side": 6000,
         "vips_stitcher": False,
+        "stream_tiles": False,
         "OpenSlide_formats": [".svs", ".tif", ".tiff", ".scn",
                               ".vms", ".vmu", ".ndpi", ".mrxs",
                               ".svslide", ".bif"],
         "first_tile": "middle",
+        "tissue_mask": False,
+        "background_intensity": 220,
+        "stain_estimation": "tile",
+        "engine": "numpy",
+        "colour_lut_bits": 0,
+        "estimation_max_side": 4096,
+        "estimation_samples": 16,
+        "estimation_sample_side": 1024,
+        "stain_cache": False,
+        "stain_cache_path": None,
+        "stain_cache_entries": 1000,
+        "stain_cache_key": "stat",
+        "metrics": False,
+        "metrics_prometheus_path": None,
+        "trace": False,
+        "trace_path": None,
+        "profiling": [],
+        "log_interval": 0.5,
         "libvips_url": "https://github.com/libvips/build-win64-mxe/releases/download/v8.12.0/vips-dev-w64-web-8.12.0-static.zip",
         "libvips_md5": "9a5dc27f6e9aae423ea620447dc67f1e",
         "he_ref": np.array([[0.68923328, 0.17593921],
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from dogsled.manifest import TileManifest
+
+GRID = {"wh": [2220, 2967], "max_side_px": 1500, "temp_tile_format": "jpeg"}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest_ = TileManifest(tmp_path)
+    manifest_.start(GRID)
+    yield manifest_
+
+
+def test_manifest_resume(manifest, tmp_path):
+    """Records written by one run are read back by the next one."""
+    he = np.array([[0.6, 0.1], [0.7, 0.8], [0.6, 0.5]], dtype=np.float32)
+    tmp = np.array([1.1, 0.9], dtype=np.float32)
+    manifest.set_stains(he, tmp)
+    manifest.add(3, "norm", TileManifest.checksum(b"tile"))
+    resumed = TileManifest(tmp_path)
+    assert resumed.start(GRID)
+    np.testing.assert_array_equal(resumed.stains[0], he)
+    np.testing.assert_array_equal(resumed.stains[1], tmp)
+    assert resumed.done(3, "norm", TileManifest.checksum(b"tile"))
+    assert not resumed.done(3, "norm", TileManifest.checksum(b"changed tile"))
+    assert not resumed.done(3, "he", TileManifest.checksum(b"tile"))
+    assert not resumed.done(3, "norm", None)
+    assert not resumed.finished
+    resumed.finish()
+    assert TileManifest(tmp_path).finished
+
+
+def test_manifest_truncated(manifest, tmp_path):
+    """A record cut by a crash is ignored."""
+    manifest.add(0, "norm", "a")
+    with open(manifest.path, "a", encoding="utf-8") as manifest_file:
+        manifest_file.write('{"tile": 1, "stain_')
+    resumed = TileManifest(tmp_path)
+    assert resumed.done(0, "norm", "a")
+    assert (1, "norm") not in resumed.tiles
+
+
+def test_manifest_grid_changed(manifest, tmp_path):
+    """Tiles of a different tile grid are not reused."""
+    manifest.add(0, "norm", "a")
+    resumed = TileManifest(tmp_path)
+    assert not resumed.start(dict(GRID, max_side_px=1000))
+    assert not resumed.tiles
+    assert not TileManifest(tmp_path).tiles
+
+
+def test_checksum():
+    """Arrays are hashed as their raw bytes."""
+    tile = np.arange(12, dtype=np.uint8).reshape((2, 2, 3))
+    assert TileManifest.checksum(tile) == TileManifest.checksum(tile.tobytes())
+    assert TileManifest.checksum(tile[:, :1]) == TileManifest.checksum(tile[:, :1].tobytes())
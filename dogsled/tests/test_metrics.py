@@ -0,0 +1,80 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from dogsled.defaults import DEFAULTS
+from dogsled.metrics import MetricsRecorder
+from dogsled.normaliser import NormaliseSlides
+
+
+def events(path):
+    with open(path, encoding="utf-8") as metrics_file:
+        return [json.loads(line) for line in metrics_file]
+
+
+def test_stage(tmp_path):
+    """Stages are written as JSON lines with fields added within the block."""
+    metrics = MetricsRecorder(tmp_path / "metrics.jsonl")
+    with metrics.stage("read", slide="a.svs", tile=3, pixels=100) as event:
+        event.update(bytes_read=300)
+    with pytest.raises(ValueError):
+        with metrics.stage("encode", slide="a.svs"):
+            raise ValueError
+    read, encode = events(tmp_path / "metrics.jsonl")
+    assert read["stage"] == "read" and read["tile"] == 3 and read["bytes_read"] == 300
+    assert read["seconds"] >= 0 and "error" not in read
+    assert encode["error"] == "ValueError"
+    assert metrics.totals["read"]["pixels"] == 100 and metrics.totals["encode"]["errors"] == 1
+
+
+def test_disabled(tmp_path):
+    """Nothing is recorded without any output."""
+    metrics = MetricsRecorder()
+    with metrics.stage("read", pixels=100) as event:
+        event.update(bytes_read=300)
+    assert not metrics.enabled and metrics.totals == {}
+    metrics.export()
+    assert not list(tmp_path.iterdir())
+
+
+def test_prometheus(tmp_path):
+    """Totals per stage are exported as Prometheus counters."""
+    prometheus_path = tmp_path / "dogsled.prom"
+    metrics = MetricsRecorder(prometheus_path=prometheus_path)
+    for _ in range(2):
+        with metrics.stage("restore", pixels=10):
+            pass
+    metrics.export()
+    text = prometheus_path.read_text()
+    assert "# TYPE dogsled_stage_seconds_total counter" in text
+    assert 'dogsled_stage_calls_total{stage="restore"} 2' in text
+    assert 'dogsled_stage_pixels_total{stage="restore"} 20' in text
+    assert [path.name for path in tmp_path.iterdir()] == ["dogsled.prom"]
+
+
+def test_normalisation_metrics(synthetic_slide, tmp_path):
+    """All stages of a multi-tile slide are recorded."""
+    DEFAULTS.metrics = True
+    DEFAULTS.metrics_prometheus_path = tmp_path / "dogsled.prom"
+    DEFAULTS.ram_megapixel = {8000: 1500, 8001: 1500}
+    normaliser = NormaliseSlides(source_path=synthetic_slide.parent,
+                                 slide_names=synthetic_slide.name,
+                                 norm_path=tmp_path,
+                                 rewrite=True)
+    normaliser.start()
+    recorded = events(Path(tmp_path, "metrics.jsonl"))
+    stages = {event["stage"] for event in recorded}
+    assert {"read", "estimate", "restore", "encode", "stitch", "slide"} <= stages
+    tiles = len(normaliser.current_slide.tile_map)
+    # tiles without tissue are not read
+    assert 0 < sum(event["stage"] == "read" for event in recorded) <= tiles
+    assert sum(event["stage"] == "encode" for event in recorded) == tiles * len(DEFAULTS.stain_types())
+    slide = next(event for event in recorded if event["stage"] == "slide")
+    assert slide["slide"] == synthetic_slide.name and slide["pixels"] == 4096 * 3072
+    assert all(event["bytes_written"] > 0 for event in recorded if event["stage"] == "stitch")
+    assert 'stage="slide"' in (tmp_path / "dogsled.prom").read_text()
+    # restore default values for further tests
+    DEFAULTS.metrics = False
+    DEFAULTS.metrics_prometheus_path = None
+    DEFAULTS.ram_megapixel = {8000: 12000, 8001: 24500}
@@ -2,6 +2,8 @@ import os
 import platform
 import pickle
 import logging
+import shutil
+import threading
 from pathlib import Path
 from distutils import dir_util
 
@@ -30,8 +32,9 @@ else:
             message="was not able to load libvips; please follow https://www.libvips.org/install.html")
 
 
-from dogsled.normaliser import Normalisation, SlideTiler, NormaliseSlides
+from dogsled.normaliser import Normalisation, SlideTiler, NormaliseSlides, ProcessLogger, LOGGER as PROCESS_LOGGER
 from dogsled.defaults import DEFAULTS
+from dogsled.benchmark import defaults_override
 
 logger = logging.getLogger(__name__)
 
@@ -150,6 +153,225 @@ def test_normalisation(slice_sector_ref, slice_od_ref, slice_he_ref,
     assert (np.count_nonzero(slice_img_ref != img)/res)*100 < 1
 
 
+@pytest.mark.parametrize("output_type", ["norm", "he", "eo"])
+def test_fused_restore(slice_sector_ref, output_type):
+    """Fused uint8 kernel has to match the float restore path."""
+    s_cut, tmp, he = Normalisation.region_s(slice_sector_ref, DEFAULTS.normalising_c,
+                                            DEFAULTS.alpha, DEFAULTS.beta,
+                                            DEFAULTS.max_s_ref, DEFAULTS.he_ref)
+    c2 = Normalisation.s_final(s_cut, tmp)
+    img = Normalisation.image_restore(c2, DEFAULTS.normalising_c,
+                                      DEFAULTS.he_ref, (1110, 1110),
+                                      output_type=output_type)
+    out = np.empty((1110, 1110, 3), dtype=np.uint8)
+    fused = Normalisation.fused_restore(slice_sector_ref, he, tmp,
+                                        DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                        output_type=output_type, out=out)
+    assert fused is out
+    # float32 rounding may only move a few pixels by one intensity level
+    assert np.abs(fused.astype(int) - img).max() <= 1
+    assert (np.count_nonzero(fused != img)/img.size)*100 < 0.1
+
+
+@pytest.mark.parametrize("output_types", [["he", "eo", "norm"], ["norm", "eo"], ["he"]])
+def test_fused_restore_multi(slice_sector_ref, output_types):
+    """One pass over the tile renders the same outputs as separate passes."""
+    _, tmp, he = Normalisation.region_s(slice_sector_ref, DEFAULTS.normalising_c,
+                                        DEFAULTS.alpha, DEFAULTS.beta,
+                                        DEFAULTS.max_s_ref, DEFAULTS.he_ref)
+    out = np.empty((len(output_types), 1110, 1110, 3), dtype=np.uint8)
+    restored = Normalisation.fused_restore_multi(slice_sector_ref, he, tmp,
+                                                 DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                                 output_types=output_types, out=out)
+    assert restored is out
+    tables = Normalisation.restore_tables(he, tmp, DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                          output_types)
+    for _ in range(2):  # the tables are reused
+        np.testing.assert_array_equal(
+            restored, Normalisation.fused_restore_multi(slice_sector_ref, he, tmp,
+                                                        DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                                        output_types=output_types,
+                                                        tables=tables).reshape(out.shape))
+    for output_type, img in zip(output_types, restored):
+        single = Normalisation.fused_restore(slice_sector_ref, he, tmp,
+                                             DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                             output_type=output_type).reshape((1110, 1110, 3))
+        # every output type is rendered the same way alone or with the others
+        np.testing.assert_array_equal(img, single)
+
+
+@pytest.mark.parametrize("bits", [8, 6])
+def test_colour_lut(slice_sector_ref, bits):
+    """Colour table lookup matches the fused kernel (exactly for the full table)."""
+    output_types = ["norm", "he", "eo"]
+    _, tmp, he = Normalisation.region_s(slice_sector_ref, DEFAULTS.normalising_c,
+                                        DEFAULTS.alpha, DEFAULTS.beta,
+                                        DEFAULTS.max_s_ref, DEFAULTS.he_ref)
+    lut = Normalisation.colour_lut(he, tmp, DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                   output_types, bits=bits)
+    assert lut.shape == (3,) + (2 ** bits + (bits < 8),) * 3 + (3,)
+    fused = Normalisation.fused_restore_multi(slice_sector_ref, he, tmp,
+                                              DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                              output_types=output_types)
+    mapped = Normalisation.lut_restore(slice_sector_ref, lut)
+    if bits == 8:
+        np.testing.assert_array_equal(mapped, fused)
+    else:
+        # interpolation error of the quantised table
+        difference = np.abs(mapped.astype(int) - fused)
+        assert difference.mean() < 1 and np.percentile(difference, 99) <= 3
+
+
+def normalise_tifs(slide_path, norm_path, **defaults):
+    """Normalise the slide (raw temporary tiles, TIF output) with the DEFAULTS temporarily set
+    ..returns the normaliser and the normalised slides {stain type: (height, width, 3) array}.
+    """
+    values = {"ram_megapixel": {8000: 1500, 8001: 1500}, "temp_tile_format": "raw",
+              "vips_stitcher": True, "thumbnail": False}
+    values.update(defaults)
+    norm_path.mkdir()
+    with defaults_override(**values):
+        normaliser = NormaliseSlides(source_path=slide_path.parent,
+                                     slide_names=slide_path.name,
+                                     norm_path=norm_path,
+                                     rewrite=True)
+        normaliser.start()
+        stain_types = DEFAULTS.stain_types()
+    PROCESS_LOGGER.close_log_file(Path(norm_path, "dogsled.log"))
+    slides = {}
+    for stain_type in stain_types:
+        slide = pyvips.Image.new_from_file(str(Path(norm_path, f"{stain_type}_{slide_path.stem}.tif")))
+        slides[stain_type] = np.ndarray(buffer=slide.write_to_memory(), dtype=np.uint8,
+                                        shape=(slide.height, slide.width, slide.bands))
+    return normaliser, slides
+
+
+def test_colour_lut_normalisation(synthetic_slide, tmp_path):
+    """Slides normalised through the colour table match the computed ones."""
+    _, computed = normalise_tifs(synthetic_slide, Path(tmp_path, "0"), colour_lut_bits=0)
+    _, mapped = normalise_tifs(synthetic_slide, Path(tmp_path, "8"), colour_lut_bits=8)
+    for stain_type, slide in computed.items():
+        np.testing.assert_array_equal(slide, mapped[stain_type])
+
+
+def test_colour_lut_cache(synthetic_slide, tmp_path):
+    """Colour tables are cached per stain types (not per number of stain types)."""
+    normaliser, _ = normalise_tifs(synthetic_slide, Path(tmp_path, "6"), colour_lut_bits=6)
+    with defaults_override(colour_lut_bits=6):
+        he_eo = normaliser.colour_lut(["he", "eo"])
+        eo_he = normaliser.colour_lut(["eo", "he"])
+        assert normaliser.colour_lut(("he", "eo")) is he_eo
+    np.testing.assert_array_equal(he_eo[::-1], eo_he)
+
+
+def test_tile_workers_normalisation(synthetic_slide, tmp_path):
+    """Tiles normalised by concurrent workers give the same slides as sequential normalisation."""
+    _, sequential = normalise_tifs(synthetic_slide, Path(tmp_path, "1"), tile_workers=1)
+    # tiny per-worker budget => all 4 workers fit in the available memory
+    _, concurrent = normalise_tifs(synthetic_slide, Path(tmp_path, "4"), tile_workers=4,
+                                   worker_memory_mb=1)
+    for stain_type, slide in sequential.items():
+        np.testing.assert_array_equal(slide, concurrent[stain_type])
+
+
+def test_vips_engine_normalisation(synthetic_slide, tmp_path):
+    """Slides normalised by the lazy libvips pipeline match the NumPy engine."""
+    numpy_normaliser, numpy_slides = normalise_tifs(synthetic_slide, Path(tmp_path, "numpy"),
+                                                    engine="numpy")
+    vips_normaliser, vips_slides = normalise_tifs(synthetic_slide, Path(tmp_path, "vips"),
+                                                  engine="vips")
+    np.testing.assert_array_equal(numpy_normaliser.current_slide.he, vips_normaliser.current_slide.he)
+    np.testing.assert_array_equal(numpy_normaliser.current_slide.tmp, vips_normaliser.current_slide.tmp)
+    for stain_type, slide in numpy_slides.items():
+        vips_slide = vips_slides[stain_type]
+        assert vips_slide.shape == slide.shape
+        assert np.abs(vips_slide.astype(int) - slide).max() <= 1
+        assert (np.count_nonzero(vips_slide != slide)/slide.size)*100 < 0.1
+
+
+@pytest.mark.parametrize("colour_lut_bits", [0, 6])
+def test_background_normalisation(synthetic_slide, tmp_path, monkeypatch, colour_lut_bits):
+    """Tiles without tissue are written as the background colour normalised like the tissue
+    tiles (through the colour table if used), the other tiles match a normalisation without
+    the tissue mask.
+    """
+    _, unmasked = normalise_tifs(synthetic_slide, Path(tmp_path, "unmasked"), tissue_mask=False,
+                                 colour_lut_bits=colour_lut_bits)
+    tissue_fractions = SlideTiler.tissue_fractions
+    background_tiles = []
+
+    def no_tissue_last(mask, slide_wh, tile_map):
+        fractions = tissue_fractions(mask, slide_wh, tile_map)
+        fractions = dict.fromkeys(fractions, 1.0)  # the synthetic slide is all tissue
+        background_tiles.append(next(reversed(tile_map)))
+        fractions[background_tiles[-1]] = 0.0
+        return fractions
+    monkeypatch.setattr(SlideTiler, "tissue_fractions", staticmethod(no_tissue_last))
+    normaliser, masked = normalise_tifs(synthetic_slide, Path(tmp_path, "masked"),
+                                        tissue_mask=True, colour_lut_bits=colour_lut_bits)
+    assert len(background_tiles) == 1
+    current_slide = normaliser.current_slide
+    (left, top), (width, height) = current_slide.tile_map[background_tiles[0]]
+    stain_types = list(masked)
+    if colour_lut_bits:
+        colours = Normalisation.lut_restore(current_slide.background,
+                                            current_slide.colour_lut[tuple(stain_types)])
+    else:
+        colours = Normalisation.fused_restore_multi(current_slide.background, current_slide.he,
+                                                    current_slide.tmp, DEFAULTS.normalising_c,
+                                                    DEFAULTS.he_ref, output_types=stain_types)
+    for stain_type, colour in zip(stain_types, colours):
+        background = masked[stain_type][top:top + height, left:left + width]
+        assert (background == colour.reshape((1, 1, 3))).all()
+        masked[stain_type][top:top + height, left:left + width] = \
+            unmasked[stain_type][top:top + height, left:left + width]
+        np.testing.assert_array_equal(masked[stain_type], unmasked[stain_type])
+
+
+@pytest.mark.parametrize("output_type", ["norm", "he", "eo"])
+def test_vips_restore(slice_sector_ref, output_type):
+    """Lazy libvips pipeline has to match the fused kernel."""
+    _, tmp, he = Normalisation.region_s(slice_sector_ref, DEFAULTS.normalising_c,
+                                        DEFAULTS.alpha, DEFAULTS.beta,
+                                        DEFAULTS.max_s_ref, DEFAULTS.he_ref)
+    fused = Normalisation.fused_restore(slice_sector_ref, he, tmp,
+                                        DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                        output_type=output_type).reshape((1110, 1110, 3))
+    sector = pyvips.Image.new_from_memory(np.ascontiguousarray(slice_sector_ref).data,
+                                          1110, 1110, bands=3, format="uchar")
+    restored = Normalisation.vips_restore(sector, he, tmp, DEFAULTS.normalising_c,
+                                          DEFAULTS.he_ref, output_type=output_type)
+    img = np.ndarray(buffer=restored.write_to_memory(), dtype=np.uint8, shape=(1110, 1110, 3))
+    assert np.abs(img.astype(int) - fused).max() <= 1
+    assert (np.count_nonzero(img != fused)/img.size)*100 < 0.1
+
+
+@pytest.mark.parametrize("q", [0, DEFAULTS.alpha, 50, 99, 100 - DEFAULTS.alpha, 100])
+def test_hist_percentile(slice_od_ref, q):
+    """Exact histogram percentiles match np.percentile, approximate ones stay within tolerance."""
+    values = slice_od_ref[:, 0].astype(np.float32)
+    exact = Normalisation.hist_percentile(values, q, tolerance=0)
+    approximate = Normalisation.hist_percentile(values, q, tolerance=1e-3)
+    assert exact == np.percentile(values, q)
+    assert abs(approximate - np.percentile(values, q)) <= 1e-3
+
+def test_stain_estimation_sources(test_slides):
+    """Low resolution and sampled reads provide valid pixels for whole-slide estimation."""
+    slide_path = Path(DATA_PATH, "CMU-1-Small-Region.svs")
+    slide = pyvips.Image.new_from_file(str(slide_path))
+    low_res = SlideTiler.low_res_sector(slide_path, 512)
+    sampled = SlideTiler.sampled_sectors(slide, 4, 256)
+    assert low_res.shape[1] == 3 and low_res.dtype == np.uint8
+    assert low_res.shape[0] <= 512 * 512
+    assert sampled.shape == (4 * 256 * 256, 3)
+    for img in (low_res, sampled):
+        _, tmp, he = Normalisation.region_s(img, DEFAULTS.normalising_c,
+                                            DEFAULTS.alpha, DEFAULTS.beta,
+                                            DEFAULTS.max_s_ref)
+        assert he.shape == (3, 2)
+        np.testing.assert_allclose(np.linalg.norm(he, axis=0), 1, atol=1e-5)
+        assert np.all(tmp > 0)
+
 ############################################################################
 
 
@@ -209,6 +431,20 @@ def test_slicer(slices):
     assert result == slices
 
 
+def test_tissue_fractions():
+    """Tiles are mapped onto the thumbnail mask; the right half holds no tissue."""
+    mask = np.zeros((30, 40), dtype=bool)
+    mask[:, :20] = True
+    mask[:15, :10] = False
+    tile_map = SlideTiler.slicer(width_height_px=(4000, 3000),
+                                 max_side_px=2000)[1]
+    fractions = SlideTiler.tissue_fractions(mask, (4000, 3000), tile_map)
+    for i, ((left, top), (width, height)) in tile_map.items():
+        if left >= 2000:
+            assert fractions[i] == 0
+        else:
+            assert fractions[i] > 0
+
 def test_thumbnail_size():
     """If the slide size is 577392x464930 & max thumbnail size is 1200
     => 0.01039155374*577392 x 0.01039155374*464930
@@ -342,3 +578,179 @@ def test_vips_stitching(small_slide_ref_vips_tiff):
     assert (np.count_nonzero(ref_eo != tif_eo)/res)*100 < 1
     # restore default values for further tests
     DEFAULTS.ram_megapixel = {8000: 12000, 8001: 24500}
+
+
+def mismatched(ref, img, tolerance=0):
+    """Percentage of the values differing by more than the tolerance."""
+    assert ref.shape == img.shape
+    return np.count_nonzero(np.abs(ref.astype(int) - img) > tolerance) / ref.size * 100
+
+
+def test_stream_tiles(small_slide_ref_vips_tiff):
+    """Tiles streamed into a pyramidal TIF match the stitched TIF, no temporary tiles are written."""
+    temp_folder = Path(
+        NORM_PATH, DEFAULTS.temporary_folder_name, "CMU-1-Small-Region")
+    shutil.rmtree(temp_folder, ignore_errors=True)  # tiles left by previous tests
+    for stain_type in ("norm", "eo"):  # the outputs of a previous test are not compared
+        Path(NORM_PATH, f"{stain_type}_CMU-1-Small-Region.tif").unlink(missing_ok=True)
+    with defaults_override(stream_tiles=True, tiff_pyramid=True,
+                           ram_megapixel={8000: 1500, 8001: 1500}):
+        normaliser = NormaliseSlides(source_path=DATA_PATH,
+                                     slide_names="CMU-1-Small-Region.svs",
+                                     norm_path=NORM_PATH,
+                                     rewrite=True)
+        normaliser.start()
+    assert not temp_folder.exists() or not [file for file in temp_folder.iterdir()
+                                            if file.suffix in (".jpeg", ".raw")]
+    ref_norm, _, ref_eo = small_slide_ref_vips_tiff
+    # the reference went through JPEG tiles, the streamed tiles are not JPEG encoded
+    # => allow for 1% of values differing by more than the JPEG noise
+    for ref, stain_type in ((ref_norm, "norm"), (ref_eo, "eo")):
+        tif = SlideTiler.vips_imread(
+            str(Path(NORM_PATH, f"{stain_type}_CMU-1-Small-Region.tif")))
+        assert mismatched(ref, tif, tolerance=16) < 1
+    assert pyvips.Image.new_from_file(
+        str(Path(NORM_PATH, "norm_CMU-1-Small-Region.tif"))).get_n_pages() > 1
+
+
+def test_raw_tile_store(small_slide_ref):
+    """Tiles written in place on the raw canvas are saved without stitching; the canvas is removed."""
+    jpeg_path = Path(NORM_PATH, "norm_CMU-1-Small-Region.jpeg")
+    jpeg_path.unlink(missing_ok=True)  # the output of a previous test is not compared
+    with defaults_override(temp_tile_format="raw", vips_stitcher=False,
+                           ram_megapixel={8000: 1500, 8001: 1500}):
+        normaliser = NormaliseSlides(source_path=DATA_PATH,
+                                     slide_names="CMU-1-Small-Region.svs",
+                                     norm_path=NORM_PATH,
+                                     rewrite=True)
+        normaliser.start()
+    ref_norm, _, _ = small_slide_ref
+    jpeg_norm = SlideTiler.vips_imread(str(jpeg_path))
+    # the reference went through JPEG tiles, the raw canvas is JPEG encoded once
+    # => allow for 1% of values differing by more than the JPEG noise
+    assert mismatched(ref_norm, jpeg_norm, tolerance=16) < 1
+    temp_folder = Path(
+        NORM_PATH, DEFAULTS.temporary_folder_name, "CMU-1-Small-Region")
+    assert not list(temp_folder.glob("*.raw"))
+
+
+def test_ome_xml():
+    """Source resolution and magnification end up in the OME-XML."""
+    xml = SlideTiler.ome_xml("norm_slide", 2220, 2967, 0.499, 0.499, "20")
+    assert 'SizeX="2220"' in xml and 'SizeY="2967"' in xml
+    assert 'PhysicalSizeX="0.499"' in xml
+    assert 'NominalMagnification="20.0"' in xml
+    assert "PhysicalSizeX" not in SlideTiler.ome_xml("norm_slide", 2220, 2967)
+
+
+def test_ome_tiff():
+    """OME-TIFF pyramid levels are SubIFDs, the resolution of the source slide is kept."""
+    with defaults_override(stream_tiles=True, tiff_format="ome", tiff_pyramid=True,
+                           ram_megapixel={8000: 1500, 8001: 1500}):
+        normaliser = NormaliseSlides(source_path=DATA_PATH,
+                                     slide_names="CMU-1-Small-Region.svs",
+                                     norm_path=NORM_PATH,
+                                     rewrite=True)
+        normaliser.start()
+    tif = pyvips.Image.new_from_file(str(Path(NORM_PATH, "norm_CMU-1-Small-Region.tif")))
+    assert tif.get("n-subifds") > 0
+    assert "OME" in tif.get("image-description")
+    mpp_x = float(normaliser.current_slide.os_slide.get("openslide.mpp-x"))
+    assert abs(tif.xres - 1000 / mpp_x) < 1e-3
+
+
+def test_resume():
+    """Finished slides are skipped, finished tiles are not normalised again."""
+    with defaults_override(resume=True, remove_temporary_files=False, temp_tile_format="jpeg",
+                           ram_megapixel={8000: 1500, 8001: 1500}):
+        normaliser = NormaliseSlides(source_path=DATA_PATH,
+                                     slide_names="CMU-1-Small-Region.svs",
+                                     norm_path=NORM_PATH,
+                                     rewrite=True)
+        normaliser.start()
+        manifest = normaliser.current_slide.manifest
+        assert manifest.finished
+        assert len(manifest.tiles) == len(normaliser.current_slide.tile_map) * len(DEFAULTS.stain_types())
+        temp_folder = normaliser.current_slide.temp_subpath
+        tile_times = {tile: tile.stat().st_mtime_ns for tile in temp_folder.glob("*.jpeg")}
+        # the whole slide is skipped
+        normaliser.start()
+        assert {tile: tile.stat().st_mtime_ns for tile in temp_folder.glob("*.jpeg")} == tile_times
+        # interrupted run: one tile is missing, the others are re-used
+        lines = manifest.path.read_text().splitlines()
+        manifest.path.write_text("\n".join(line for line in lines if "finished" not in line) + "\n")
+        missing = Path(temp_folder, "0_norm.jpeg")
+        missing.unlink()
+        normaliser.start()
+        assert missing.exists()
+        for tile, mtime in tile_times.items():
+            if tile.name[0] != "0":
+                assert tile.stat().st_mtime_ns == mtime
+
+
+def test_aligned_slicer():
+    """Aligned tiles start at multiples of the tile side and cover the slide once."""
+    (m_rows, n_columns), tile_map = SlideTiler.slicer(width_height_px=(3451, 7463),
+                                                      max_side_px=1024, aligned=True)
+    assert (m_rows, n_columns) == (8, 4)
+    covered = np.zeros((7463, 3451), dtype=np.uint8)
+    for (left, top), (width, height) in tile_map.values():
+        assert left % 1024 == 0 and top % 1024 == 0
+        assert width <= 1024 and height <= 1024
+        covered[top:top + height, left:left + width] += 1
+    assert np.all(covered == 1)
+    # the stitchers expect the tiles in row order
+    assert [tile_map[i] for i in sorted(tile_map)] == sorted(
+        tile_map.values(), key=lambda location_size: location_size[0][::-1])
+
+
+def test_queued_logging(tmp_path):
+    """Records are written by the listener; only the tile progress is rate-limited per thread
+    and tile workers log with the slide progress of the thread which started them.
+    """
+    process_logger = ProcessLogger(logging.getLogger("dogsled.test_queued_logging"))
+    process_logger.logger.setLevel(logging.INFO)
+    assert not process_logger.running  # started with the first record or log file
+    log_path = tmp_path / "dogsled.log"
+    process_logger.log_file(log_path)
+    process_logger.log_file(log_path)
+    assert process_logger.running
+    assert len(process_logger.listener.handlers) == 2  # root forwarder & one file handler
+    process_logger.slide_list([Path("slide.svs")])
+    process_logger.current_slide(Path("slide.svs"))
+    process_logger.total_tiles(range(4))
+
+    def tile_worker(context):
+        with process_logger.tile_context(context):
+            process_logger.progress_info("worker tile")
+    with defaults_override(log_interval=60):
+        for tile_n in range(10):
+            process_logger.progress_info(f"tile {tile_n}")
+        worker = threading.Thread(target=tile_worker, args=(process_logger.snapshot(),))
+        worker.start()
+        worker.join()
+        for _ in range(2):
+            process_logger.info("slide status")
+        process_logger.warning("slide warning")
+    process_logger.close_log_file(log_path)
+    process_logger.close()
+    lines = log_path.read_text().splitlines()
+    assert len(lines) == 5
+    assert "Slide 1/1 slide.svs tile 0/4 tile 0" in lines[0]
+    assert "Slide 1/1 slide.svs tile 1/4 worker tile" in lines[1]
+    assert all("slide status" in line for line in lines[2:4]) and "slide warning" in lines[4]
+    assert process_logger.progress.tile_n == 0  # worker tiles are counted by the pool
+    assert len(process_logger.listener.handlers) == 1
+
+
+def test_log_file_handlers(synthetic_slide, tmp_path):
+    """Repeated normalisers of the same norm path share one log file handler."""
+    handlers = PROCESS_LOGGER.listener.handlers
+    for _ in range(2):
+        NormaliseSlides(source_path=synthetic_slide.parent,
+                        slide_names=synthetic_slide.name,
+                        norm_path=tmp_path,
+                        rewrite=True)
+    assert len(PROCESS_LOGGER.listener.handlers) == len(handlers) + 1
+    PROCESS_LOGGER.close_log_file(Path(tmp_path, "dogsled.log"))
+    assert PROCESS_LOGGER.listener.handlers == handlers
@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from dogsled.defaults import DEFAULTS
+from dogsled.errors import UserInputError
+from dogsled.metrics import MetricsRecorder
+from dogsled.normaliser import NormaliseSlides
+from dogsled.profiling import PROFILED, Profiler
+
+
+def test_profiled_functions():
+    """The functions decorated with @profile are registered for line profiling."""
+    names = {func.__name__ for func in PROFILED}
+    assert {"read_sector", "calculate_hem", "region_s", "image_restore",
+            "stitcher", "process_slide"} <= names
+
+
+def test_hooks(tmp_path, monkeypatch):
+    """Hooks are taken from DEFAULTS and the environment; unknown hooks are rejected."""
+    assert not Profiler.from_defaults(tmp_path).enabled
+    monkeypatch.setenv(Profiler.ENV_VAR, "cprofile, tracemalloc")
+    assert Profiler.from_defaults(tmp_path).hooks == {"cprofile", "tracemalloc"}
+    with pytest.raises(UserInputError):
+        Profiler(tmp_path, ["perf"])
+
+
+def test_stage_peaks(tmp_path):
+    """Nested stages do not hide the allocation peak of the outer stage."""
+    profiler = Profiler(tmp_path, ["tracemalloc"])
+    metrics = MetricsRecorder(collect=True)
+    with profiler.stage(metrics.stage("slide"), "slide", "a.svs") as slide:
+        with profiler.stage(metrics.stage("read", tile=0), "read", "a.svs") as read:
+            block = np.ones(1 << 22, dtype=np.uint8)
+            del block
+        with profiler.stage(metrics.stage("restore", tile=0), "restore", "a.svs"):
+            pass
+    assert read["peak_mb"] >= 4 and slide["peak_mb"] >= read["peak_mb"]
+    with open(Path(tmp_path, "tracemalloc.jsonl"), encoding="utf-8") as peaks:
+        stages = [json.loads(line)["stage"] for line in peaks]
+    assert stages == ["read", "restore", "slide"]
+
+
+def test_concurrent_slide_profiles(tmp_path):
+    """A slide started while another one is cProfiled is not profiled (one profiler at a time)."""
+    profiler = Profiler(tmp_path, ["cprofile"])
+    with profiler.slide(Path("a.svs")):
+        with profiler.slide(Path("b.svs")):
+            pass
+    assert Path(tmp_path, "cprofile_a.prof").exists()
+    assert not Path(tmp_path, "cprofile_b.prof").exists()
+    with profiler.slide(Path("b.svs")):
+        pass
+    assert Path(tmp_path, "cprofile_b.prof").exists()
+
+
+def test_slide_profiles(synthetic_slide, tmp_path):
+    """cProfile of the slide and tracemalloc peaks of its stages are saved in norm_path."""
+    DEFAULTS.profiling = ["cprofile", "tracemalloc"]
+    normaliser = NormaliseSlides(source_path=synthetic_slide.parent,
+                                 slide_names=synthetic_slide.name,
+                                 norm_path=tmp_path,
+                                 rewrite=True)
+    normaliser.start()
+    assert Path(tmp_path, f"cprofile_{synthetic_slide.stem}.prof").exists()
+    assert "process_slide" in Path(tmp_path, f"cprofile_{synthetic_slide.stem}.txt").read_text()
+    with open(Path(tmp_path, "tracemalloc.jsonl"), encoding="utf-8") as peaks:
+        assert {json.loads(line)["stage"] for line in peaks} >= {"read", "slide"}
+    # restore default values for further tests
+    DEFAULTS.profiling = []
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from dogsled.__main__ import main
+from dogsled.defaults import DEFAULTS
+from dogsled.reference import ODMoments, HistogramSketch, Aggregates, CohortReference
+
+DATA_PATH = Path(Path(__file__).parent, "data")
+
+
+@pytest.fixture
+def od():
+    rng = np.random.default_rng(0)
+    yield rng.gamma(2, 0.2, size=(30000, 3)).astype(np.float32)
+
+
+def test_od_moments(od):
+    """Merged moments of the parts give the covariance of all pixels."""
+    moments = ODMoments().update(od[:10000]).merge(ODMoments().update(od[10000:]))
+    np.testing.assert_allclose(moments.covariance(), np.cov(od.T), rtol=1e-6)
+
+
+@pytest.mark.parametrize("q", [DEFAULTS.alpha, 1, 50, 99, 100 - DEFAULTS.alpha])
+def test_histogram_sketch(od, q):
+    """Merged sketches stay within one bin width of np.percentile."""
+    sketch = HistogramSketch(-1, 4).update(od[:10000, 0]).merge(
+        HistogramSketch(-1, 4).update(od[10000:, 0]))
+    assert abs(sketch.percentile(q) - np.percentile(od[:, 0], q)) <= sketch.width
+
+
+def test_aggregates(od):
+    """Sketches filled in one pass merge like the separately filled ones."""
+    def sketches(part):
+        return Aggregates(HistogramSketch(-1, 4).update(column) for column in part.T)
+    merged = sketches(od[:10000]).merge(sketches(od[10000:]))
+    for i, sketch in enumerate(merged):
+        np.testing.assert_array_equal(sketch.counts, HistogramSketch(-1, 4).update(od[:, i]).counts)
+
+
+def test_cohort_reference(test_slides):
+    """Reference fitted on the test slides is a valid stain matrix."""
+    he_ref, max_s_ref = CohortReference(test_slides, workers=2).fit()
+    assert he_ref.shape == (3, 2) and max_s_ref.shape == (2,)
+    np.testing.assert_allclose(np.linalg.norm(he_ref, axis=0), 1, atol=1e-5)
+    assert np.all(he_ref > 0) and np.all(max_s_ref > 0)
+    # hematoxylin has the larger red OD
+    assert he_ref[0, 0] > he_ref[0, 1]
+
+
+def test_fit_reference_cli(test_slides, tmp_path):
+    """python -m dogsled fit-reference saves a reference which can be loaded into DEFAULTS."""
+    he_ref, max_s_ref = DEFAULTS.he_ref, DEFAULTS.max_s_ref
+    output = tmp_path / "reference.npz"
+    main(["fit-reference", str(test_slides[0]), "--output", str(output), "--source", "sampled"])
+    CohortReference.load(output)
+    assert DEFAULTS.he_ref.shape == (3, 2)
+    # restore default values for further tests
+    DEFAULTS.he_ref, DEFAULTS.max_s_ref = he_ref, max_s_ref
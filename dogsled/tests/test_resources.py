@@ -35,3 +35,62 @@ def test_space(test_slides, norm_path, space_required):
     _, required, all_svs = ResourceChecker.space(test_slides, norm_path)
     assert space_required >> 20 == required
     assert all_svs == True
+
+
+def test_tile_workers():
+    """Workers are limited by DEFAULTS.tile_workers and by the RAM budget per worker."""
+    ram_available = ResourceChecker.available_memory()
+    DEFAULTS.tile_workers = 4
+    DEFAULTS.worker_memory_mb = ram_available * 2
+    assert ResourceChecker.tile_workers(1000) == 1
+    DEFAULTS.worker_memory_mb = max(ram_available // 4, 1)
+    assert ResourceChecker.tile_workers(1000) == 4
+    DEFAULTS.worker_memory_mb = None
+    expected = min(4, ram_available // (ResourceEstimator.tile_memory(1000, 3) >> 20))
+    assert ResourceChecker.tile_workers(1000, 3) == max(1, expected)
+    # restore the values for further tests
+    DEFAULTS.tile_workers = 1
+
+
+@pytest.mark.parametrize("limit, usage, expected", [("max", "100", None),
+                                                    ("9223372036854771712", "100", None),
+                                                    (str(2 << 30), str(1 << 30), 1 << 30)])
+def test_cgroup_available(tmp_path, monkeypatch, limit, usage, expected):
+    """cgroup limit minus usage; no limit => None."""
+    (tmp_path / "memory.max").write_text(limit + "\n")
+    (tmp_path / "memory.current").write_text(usage + "\n")
+    monkeypatch.setattr(ResourceChecker, "CGROUP_FILES",
+                        ((str(tmp_path / "memory.max"), str(tmp_path / "memory.current")),))
+    assert ResourceChecker.cgroup_available() == expected
+    if expected is not None:
+        assert ResourceChecker.available_memory() <= expected >> 20
+
+
+@pytest.mark.parametrize("budget_mb", [500, 4000, 64000])
+@pytest.mark.parametrize("align", [1, 240, 512])
+def test_plan_tile_size(budget_mb, align):
+    """Planned tiles are aligned and their modelled peak stays within the budget."""
+    DEFAULTS.tile_workers = 2
+    side = ResourceChecker.plan_tile_size(outputs=3, align=align, budget_mb=budget_mb)
+    assert side % align == 0
+    peak = max(ResourceEstimator.tile_memory(side, 3, reference=True),
+               2 * ResourceEstimator.tile_memory(side, 3))
+    assert peak <= (budget_mb << 20) * DEFAULTS.memory_headroom or side == align
+    # the next aligned side would not fit
+    bigger = side + align
+    assert max(ResourceEstimator.tile_memory(bigger, 3, reference=True),
+               2 * ResourceEstimator.tile_memory(bigger, 3)) > (budget_mb << 20) * DEFAULTS.memory_headroom
+    # restore the values for further tests
+    DEFAULTS.tile_workers = 1
+
+
+def test_scratch_memory():
+    """The scratch arenas kept by the tile workers are included in the tile & slide peaks."""
+    DEFAULTS.tile_workers = 2
+    arena = ResourceEstimator.scratch_memory(1000, 3)
+    assert arena == 1000 ** 2 * (3 * 3 + 6)
+    assert ResourceEstimator.tile_memory(1000, 3) == 1000 ** 2 * 5 + arena
+    # NumPy stitcher: stitched rows & image next to the arenas of both workers
+    assert ResourceEstimator.slide_memory((8000, 6000), 1000, 3) == 2 * arena + 2 * 8000 * 6000 * 3
+    # restore the values for further tests
+    DEFAULTS.tile_workers = 1
@@ -0,0 +1,67 @@
+import threading
+from pathlib import Path
+
+import pytest
+import pyvips
+
+from dogsled.benchmark import defaults_override
+from dogsled.resources import ResourceChecker, ResourceEstimator
+from dogsled.scheduler import SlideJob, SlideScheduler
+
+
+@pytest.fixture
+def jobs():
+    return [SlideJob(slide_path=Path(f"{mb}.svs"), memory_mb=mb, pixels=mb * 10 ** 6)
+            for mb in (300, 700, 100, 500)]
+
+
+def record(started, running, peak, lock):
+    def process(slide_path):
+        with lock:
+            started.append(slide_path.stem)
+            running.append(int(slide_path.stem))
+            peak.append(sum(running))
+        with lock:
+            running.remove(int(slide_path.stem))
+    return process
+
+
+def test_largest_first(jobs):
+    started, running, peak = [], [], []
+    SlideScheduler(workers=1, budget_mb=10000).run(jobs, record(started, running, peak, threading.Lock()))
+    assert started == ["700", "500", "300", "100"]
+
+
+def test_order_by_pixels():
+    """Slides are ordered by size, not by the memory estimate (the same for tiled outputs)."""
+    jobs = [SlideJob(slide_path=Path(f"{pixels}.svs"), memory_mb=400, pixels=pixels)
+            for pixels in (10, 30, 20)]
+    assert [job.pixels for job in SlideScheduler.order(jobs)] == [30, 20, 10]
+
+
+@pytest.mark.parametrize("budget_mb", [100, 600, 800, 10000])
+def test_memory_budget(jobs, budget_mb):
+    started, running, peak = [], [], []
+    SlideScheduler(workers=3, budget_mb=budget_mb).run(jobs, record(started, running, peak, threading.Lock()))
+    assert sorted(started) == sorted(str(job.memory_mb) for job in jobs)
+    # a job larger than the whole budget is run alone
+    assert max(peak) <= max(budget_mb, 700)
+
+
+def test_error_propagates(jobs):
+    def process(slide_path):
+        raise RuntimeError(slide_path.stem)
+    with pytest.raises(RuntimeError):
+        SlideScheduler(workers=2, budget_mb=10000).run(jobs, process)
+
+
+def test_slide_jobs_planned_side(synthetic_slide):
+    """With tile_autotune the peak memory is estimated for the tile side planned for the slide."""
+    slide = pyvips.Image.new_from_file(str(synthetic_slide))
+    slide_wh = (slide.width, slide.height)
+    with defaults_override(tile_autotune=True, memory_budget_mb=200, slide_workers=2):
+        job, = SlideScheduler.slide_jobs([synthetic_slide], max_side_px=100000, outputs=3)
+        side = ResourceChecker.slide_tile_size(slide, 100000, 3)
+        assert side < max(slide_wh)
+        assert job.memory_mb == ResourceEstimator.slide_memory(slide_wh, side, 3) >> 20
+        assert job.memory_mb != ResourceEstimator.slide_memory(slide_wh, 100000, 3) >> 20
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from dogsled.benchmark import KernelBenchmark
+from dogsled.defaults import DEFAULTS
+from dogsled.normaliser import Normalisation, NormaliseSlides
+from dogsled.scratch import ScratchArena, ScratchPool
+
+
+def test_arena():
+    """Buffers are reused for smaller arrays and grow for larger ones."""
+    arena = ScratchArena(pixels=100)
+    od = arena.array("od", (100, 3), np.float32)
+    assert arena.nbytes == 100 * 3 * 4
+    smaller = arena.array("od", (50, 3), np.float32)
+    assert np.shares_memory(od, smaller) and smaller.flags.c_contiguous
+    assert arena.array("od", (100, 3), np.float64).dtype == np.float64
+    assert arena.nbytes == 100 * 3 * 8
+    assert not np.shares_memory(arena.array("tile", (10, 10, 3), np.uint8), od)
+
+
+def test_pool():
+    """Returned arenas are reused; concurrent workers get their own."""
+    pool = ScratchPool()
+    pool.reserve(OrderedDict({0: ((0, 0), (20, 10)), 1: ((20, 0), (5, 10))}))
+    assert pool.pixels == 200
+    with pool.arena() as arena:
+        assert arena.pixels == 200
+        with pool.arena() as other:
+            assert other is not arena
+    with pool.arena() as again:
+        assert again in (arena, other)
+    arenas = set()
+
+    def worker():
+        with pool.arena() as worker_arena:
+            arenas.add(id(worker_arena))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(arenas) <= len(pool.free) <= 4
+    pool.clear()
+    assert pool.nbytes == 0 and pool.pixels == 0
+
+
+def test_scratch_results():
+    """Kernels using scratch buffers return the same results as without them."""
+    img = KernelBenchmark.synthetic_tile(128).reshape((-1, 3))
+    arena = ScratchArena(pixels=128 * 128)
+    s_cut, tmp, he = Normalisation.region_s(img, DEFAULTS.normalising_c, DEFAULTS.alpha,
+                                            DEFAULTS.beta, DEFAULTS.max_s_ref)
+    for _ in range(2):  # second run reuses the buffers
+        scratch_s_cut, scratch_tmp, scratch_he = Normalisation.region_s(
+            img, DEFAULTS.normalising_c, DEFAULTS.alpha, DEFAULTS.beta,
+            DEFAULTS.max_s_ref, scratch=arena)
+        np.testing.assert_array_equal(s_cut, scratch_s_cut)
+        np.testing.assert_array_equal(tmp, scratch_tmp)
+        np.testing.assert_array_equal(he, scratch_he)
+    assert np.shares_memory(scratch_s_cut, arena.buffers["s_cut"])
+    s2 = Normalisation.s_final(s_cut, tmp)
+    for output_type in ("norm", "he", "eo"):
+        out = np.empty((128, 128, 3), dtype=np.uint8)
+        restored = Normalisation.image_restore(s2, DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                               (128, 128), output_type=output_type,
+                                               out=out, scratch=arena)
+        assert restored is out
+        np.testing.assert_array_equal(
+            restored, Normalisation.image_restore(s2, DEFAULTS.normalising_c, DEFAULTS.he_ref,
+                                                  (128, 128), output_type=output_type))
+
+
+def test_pool_after_reference_tile(synthetic_slide, tmp_path, monkeypatch):
+    """Only the tile outputs are kept in the arenas, not the estimation buffers."""
+    DEFAULTS.ram_megapixel = {8000: 1500, 8001: 1500}
+    normaliser = NormaliseSlides(source_path=synthetic_slide.parent,
+                                 slide_names=synthetic_slide.name,
+                                 norm_path=tmp_path,
+                                 rewrite=True)
+    monkeypatch.setattr(normaliser.scratch, "clear", lambda: None)
+    normaliser.start()
+    assert normaliser.scratch.free
+    for arena in normaliser.scratch.free:
+        assert set(arena.buffers) <= {"tile", "tiles"}
+    tile_bytes = normaliser.scratch.pixels * 3 * len(DEFAULTS.stain_types())
+    assert normaliser.scratch.nbytes <= len(normaliser.scratch.free) * 2 * tile_bytes
+    # restore default values for further tests
+    DEFAULTS.ram_megapixel = {8000: 12000, 8001: 24500}
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from dogsled.stain_cache import StainCache
+
+HE = np.array([[0.65, 0.07], [0.70, 0.99], [0.29, 0.11]])
+TMP = np.array([1.25, 0.75], dtype=np.float32)
+
+
+@pytest.fixture
+def slide(tmp_path):
+    slide_ = tmp_path / "slide.svs"
+    slide_.write_bytes(b"slide" * 1000)
+    yield slide_
+
+
+@pytest.mark.parametrize("key_type", ["stat", "content"])
+def test_stain_cache(tmp_path, slide, key_type):
+    """Stored parameters are returned for the same slide & settings only."""
+    cache = StainCache(tmp_path / "cache", key_type=key_type)
+    params = StainCache.params(1500)
+    assert cache.get(slide, params) is None
+    cache.put(slide, params, HE, TMP)
+    he, tmp = cache.get(slide, params)
+    np.testing.assert_array_equal(he, HE)
+    np.testing.assert_array_equal(tmp, TMP)
+    assert cache.get(slide, StainCache.params(1000)) is None
+    # changed slide
+    slide.write_bytes(b"other" * 1001)
+    assert cache.get(slide, params) is None
+
+
+def test_stain_cache_eviction(tmp_path):
+    """Least recently used entries are removed first."""
+    cache = StainCache(tmp_path / "cache", max_entries=2)
+    slides = []
+    for i in range(3):
+        slides.append(tmp_path / f"{i}.svs")
+        slides[-1].write_bytes(bytes([i]) * 10)
+    params = StainCache.params(1500)
+    cache.put(slides[0], params, HE, TMP)
+    cache.put(slides[1], params, HE, TMP)
+    for i, slide in enumerate(slides[:2]):
+        os.utime(cache.entry_path(slide, params), (1000 + i, 1000 + i))
+    cache.get(slides[0], params)  # slide 1 is now the least recently used
+    cache.put(slides[2], params, HE, TMP)
+    assert cache.get(slides[1], params) is None
+    assert cache.get(slides[0], params) is not None
+    assert cache.get(slides[2], params) is not None
+
+
+def test_stain_cache_invalidate(tmp_path, slide):
+    cache = StainCache(tmp_path / "cache")
+    cache.put(slide, StainCache.params(1500), HE, TMP)
+    cache.put(slide, StainCache.params(1000), HE, TMP)
+    assert cache.invalidate(slide) == 2
+    assert cache.get(slide, StainCache.params(1500)) is None
+    cache.put(slide, StainCache.params(1500), HE, TMP)
+    assert cache.invalidate() == 1
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import pyvips
+
+from dogsled.streaming import RowFanOut, TileStream
+
+
+def rows(height, width, row_height):
+    """Deterministic uint8 RGB rows of one image."""
+    img = (np.arange(height * width * 3) % 251).astype(np.uint8).reshape((height, width, 3))
+    yield from (img[top:top + row_height] for top in range(0, height, row_height))
+
+
+@pytest.mark.parametrize("row_height", [1, 7, 64])
+def test_tile_stream(row_height):
+    """Streamed rows are loaded by libvips as one image."""
+    stream = TileStream(50, 64, rows(64, 50, row_height))
+    image = stream.image()
+    img = np.ndarray(buffer=image.write_to_memory(), dtype=np.uint8, shape=(64, 50, 3))
+    stream.check()
+    np.testing.assert_array_equal(img, np.concatenate(list(rows(64, 50, row_height))))
+
+
+def test_tile_stream_error():
+    """Errors of the row producer are re-raised after the image was evaluated."""
+    def broken_rows():
+        yield np.zeros((8, 50, 3), dtype=np.uint8)
+        raise RuntimeError("tile failed")
+    stream = TileStream(50, 64, broken_rows())
+    with pytest.raises((RuntimeError, pyvips.Error)):
+        stream.image().write_to_memory()
+        stream.check()
+
+
+def test_row_fan_out():
+    """Rows rendered together are streamed to several images at the same time."""
+    fan_out = RowFanOut(zip(rows(64, 50, 8), rows(64, 50, 8)), outputs=2)
+    streams = [TileStream(50, 64, fan_out.rows(output)) for output in range(2)]
+    fan_out.start()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        images = list(pool.map(lambda stream: stream.image().write_to_memory(), streams))
+    fan_out.check()
+    for image in images:
+        img = np.ndarray(buffer=image, dtype=np.uint8, shape=(64, 50, 3))
+        np.testing.assert_array_equal(img, np.concatenate(list(rows(64, 50, 8))))
+
+
+def test_row_fan_out_drain():
+    """An output which is not read does not block the others; producer errors are re-raised."""
+    def broken_rows():
+        yield from zip(rows(64, 50, 8), rows(64, 50, 8))
+        raise RuntimeError("tile failed")
+    fan_out = RowFanOut(broken_rows(), outputs=2)
+    fan_out.start()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        drained = pool.submit(fan_out.drain, 1)
+        assert len(list(fan_out.rows(0))) == 8
+        drained.result()
+    with pytest.raises(RuntimeError):
+        fan_out.check()
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import numpy as np
+import pyvips
+
+from dogsled.__main__ import main
+from dogsled.defaults import DEFAULTS
+from dogsled.normaliser import NormaliseSlides, SlideTiler
+from dogsled.synthetic import SyntheticSlide
+
+
+def pixels(image):
+    return np.ndarray(buffer=image.write_to_memory(), dtype=np.uint8,
+                      shape=[image.height, image.width, image.bands])
+
+
+def test_synthetic_image():
+    """Pixels depend only on the seed; tissue and background are both present."""
+    img = pixels(SyntheticSlide(512, 384).image())
+    assert img.shape == (384, 512, 3)
+    np.testing.assert_array_equal(img, pixels(SyntheticSlide(512, 384).image()))
+    assert not np.array_equal(img, pixels(SyntheticSlide(512, 384, seed=1).image()))
+    background = img.min(axis=2) >= DEFAULTS.background_intensity
+    assert 0 < background.mean() < 1
+
+
+def test_synthetic_slide(synthetic_slide):
+    """Tiled pyramidal TIF with Aperio metadata."""
+    slide = pyvips.Image.new_from_file(str(synthetic_slide))
+    assert (slide.width, slide.height) == (4096, 3072)
+    assert slide.get_n_pages() > 1
+    assert slide.get("image-description").startswith("Aperio")
+    assert "MPP = 0.25" in slide.get("image-description")
+
+
+def test_synthetic_normalisation(synthetic_slide, tmp_path):
+    """Offline multi-tile normalisation of a synthetic slide."""
+    DEFAULTS.ram_megapixel = {8000: 1500, 8001: 1500}
+    normaliser = NormaliseSlides(source_path=synthetic_slide.parent,
+                                 slide_names=synthetic_slide.name,
+                                 norm_path=tmp_path,
+                                 rewrite=True)
+    normaliser.start()
+    assert len(normaliser.current_slide.tile_map) > 1
+    for stain_type in DEFAULTS.stain_types():
+        normalised = SlideTiler.vips_imread(
+            str(Path(tmp_path, f"{stain_type}_{synthetic_slide.stem}.jpeg")))
+        assert normalised.shape == (3072, 4096, 3)
+    # restore default values for further tests
+    DEFAULTS.ram_megapixel = {8000: 12000, 8001: 24500}
+
+
+def test_synthetic_slide_cli(tmp_path):
+    """python -m dogsled synthetic-slide writes a readable slide."""
+    output = tmp_path / "cli.svs"
+    main(["synthetic-slide", str(output), "--width", "600", "--height", "400", "--seed", "3"])
+    slide = pyvips.Image.new_from_file(str(output))
+    assert (slide.width, slide.height) == (600, 400)
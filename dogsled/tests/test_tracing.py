@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from dogsled.defaults import DEFAULTS
+from dogsled.normaliser import Normalisation, NormaliseSlides
+from dogsled.tracing import Tracer
+
+
+def test_disabled(tmp_path):
+    """Nothing is wrapped or written if tracing is off."""
+    convert_od = Normalisation.__dict__["convert_od"]
+    with Tracer.session(tmp_path) as tracer:
+        assert tracer is None
+        assert Normalisation.__dict__["convert_od"] is convert_od
+    assert not list(tmp_path.iterdir())
+
+
+def test_tracing(tmp_path):
+    """Calls are recorded as complete events; the functions are restored, also after an error."""
+    convert_od = Normalisation.__dict__["convert_od"]
+    tracer = Tracer(tmp_path / "trace.json")
+    with pytest.raises(ValueError):
+        with tracer.tracing():
+            Normalisation.convert_od(np.zeros((10, 3), dtype=np.uint8), 255)
+            raise ValueError
+    assert Normalisation.__dict__["convert_od"] is convert_od
+    with open(tmp_path / "trace.json", encoding="utf-8") as trace_file:
+        events = json.load(trace_file)["traceEvents"]
+    span = next(event for event in events if event["ph"] == "X")
+    assert span["name"] == "Normalisation.convert_od" and span["dur"] >= 0
+    assert any(event["name"] == "thread_name" and event["tid"] == span["tid"] for event in events)
+
+
+def test_normalisation_trace(synthetic_slide, tmp_path):
+    """Slide and tile spans of a multi-tile slide are traced."""
+    DEFAULTS.trace = True
+    DEFAULTS.ram_megapixel = {8000: 1500, 8001: 1500}
+    normaliser = NormaliseSlides(source_path=synthetic_slide.parent,
+                                 slide_names=synthetic_slide.name,
+                                 norm_path=tmp_path,
+                                 rewrite=True)
+    normaliser.start()
+    with open(Path(tmp_path, "trace.json"), encoding="utf-8") as trace_file:
+        spans = [event for event in json.load(trace_file)["traceEvents"] if event["ph"] == "X"]
+    slide = next(span for span in spans if span["name"] == "NormaliseSlides.process_slide")
+    assert slide["args"]["slide"] == synthetic_slide.name
+    tiles = {span["args"]["tile"] for span in spans
+             if span["name"] == "NormaliseSlides.tile_normalisation"}
+    assert tiles == set(normaliser.current_slide.tile_map)
+    assert any(span["name"] == "Normalisation.read_sector" for span in spans)
+    # restore default values for further tests
+    DEFAULTS.trace = False
+    DEFAULTS.ram_megapixel = {8000: 12000, 8001: 24500}
@@ -0,0 +1,31 @@
+import pytest
+
+from dogsled.wrapping import wrapped
+
+
+class Stages:
+
+    @staticmethod
+    def double(value):
+        return value * 2
+
+    def triple(self, value):
+        return value * 3
+
+
+def test_wrapped():
+    """Static methods and methods are wrapped within the block and restored, also after an error."""
+    double, triple = Stages.__dict__["double"], Stages.__dict__["triple"]
+    calls = []
+
+    def wrap(cls, name, func):
+        def counted(*args):
+            calls.append((cls.__name__, name))
+            return func(*args)
+        return counted
+    with pytest.raises(RuntimeError):
+        with wrapped([(Stages, "double"), (Stages, "triple")], wrap):
+            assert Stages.double(2) == 4 and Stages().triple(2) == 6
+            raise RuntimeError
+    assert calls == [("Stages", "double"), ("Stages", "triple")]
+    assert Stages.__dict__["double"] is double and Stages.__dict__["triple"] is triple
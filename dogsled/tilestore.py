@@ -0,0 +1,67 @@
+"""Lossless temporary tile store.
+One memory-mapped raw uint8 canvas (height x width x 3) per stain type in the temporary subfolder;
+tiles are written in place at their slide location and the canvas is handed to libvips as it is
+=> no JPEG generation loss, no decoding and no stitched copy of the slide in RAM.
+"""
+import logging
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+import pyvips
+
+from dogsled.slides import CurrentSlide
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RawTileStore:
+    """Behaviour class for the raw canvases of the current slide."""
+
+    @staticmethod
+    def path(current_slide: CurrentSlide, stain_type: str) -> Path:
+        """Canvas path of the stain type."""
+        return Path(current_slide.temp_subpath, f"{stain_type}.raw")
+
+    @staticmethod
+    def canvas(current_slide: CurrentSlide, stain_type: str, mode: str = "r+") -> np.memmap:
+        """Memory-mapped canvas of the whole slide."""
+        width, height = current_slide.wh
+        return np.memmap(RawTileStore.path(current_slide, stain_type), dtype=np.uint8,
+                         mode=mode, shape=(height, width, 3))
+
+    @staticmethod
+    def create(current_slide: CurrentSlide, stain_types: List[str]) -> None:
+        """Create (sparse) canvases which do not exist or do not match the slide size."""
+        width, height = current_slide.wh
+        for stain_type in stain_types:
+            path = RawTileStore.path(current_slide, stain_type)
+            if not path.exists() or path.stat().st_size != width * height * 3:
+                LOGGER.info(f"creating {stain_type} canvas")
+                with open(path, "wb") as canvas:
+                    canvas.truncate(width * height * 3)
+
+    @staticmethod
+    def write(current_slide: CurrentSlide, stain_type: str, location: Tuple[int, int],
+              tile: npt.NDArray[Any]) -> None:
+        """Write a (height, width, 3) tile in place; tiles do not overlap => thread-safe."""
+        left, top = location
+        height, width = tile.shape[:2]
+        canvas = RawTileStore.canvas(current_slide, stain_type)
+        canvas[top:top + height, left:left + width] = tile
+        canvas.flush()
+        del canvas
+
+    @staticmethod
+    def image(current_slide: CurrentSlide, stain_type: str) -> pyvips.vimage.Image:
+        """The canvas as a libvips image (the file is memory-mapped, not copied)."""
+        width, height = current_slide.wh
+        image = pyvips.Image.rawload(str(RawTileStore.path(current_slide, stain_type)),
+                                     width, height, 3)
+        return image.copy(interpretation="srgb")
+
+    @staticmethod
+    def remove(current_slide: CurrentSlide, stain_type: str) -> None:
+        """Remove the canvas of the stain type."""
+        RawTileStore.path(current_slide, stain_type).unlink(missing_ok=True)
@@ -0,0 +1,120 @@
+"""Timeline tracing.
+The Normalisation and SlideTiler stages and the per-slide/per-tile NormaliseSlides methods are
+recorded as spans per thread and written as Chrome trace JSON (chrome://tracing, ui.perfetto.dev)
+=> overlap of decoding, computing, encoding and stitching can be seen on a timeline.
+The stage functions are wrapped only while tracing => no cost when tracing is disabled.
+"""
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from dogsled.defaults import DEFAULTS
+from dogsled.wrapping import wrapped
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Tracer:
+    """Collects complete ("X") trace events of the traced functions of all threads."""
+
+    file_name = "trace.json"
+    # class name => traced functions (static methods or NormaliseSlides methods)
+    TARGETS = {"Normalisation": ("read_sector", "convert_od", "calculate_hem", "nb_lstsq",
+                                 "calculate_sp", "region_s", "image_restore", "fused_restore",
+                                 "fused_restore_multi", "colour_lut", "lut_restore", "vips_restore",
+                                 "save_jpeg"),
+               "SlideTiler": ("low_res_sector", "sampled_sectors", "jpeg_stitcher", "stitcher",
+                              "raw_stitcher", "vips_stitcher", "save_tif", "vips_writer",
+                              "thumbnail_from_image", "thumbnail_from_np", "tissue_mask"),
+               "NormaliseSlides": ("process_slide", "estimate_stains", "reference_stains",
+                                   "tissue_detection", "tile_normalisation", "slice_normalisation",
+                                   "background_normalisation", "render_tile", "save_tile", "stitch_output",
+                                   "vips_normalisation", "stream_normalisation")}
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[int, str] = {}
+        self.start_ns = perf_counter_ns()
+
+    @classmethod
+    @contextmanager
+    def session(cls, norm_path: Path) -> Iterator[Optional["Tracer"]]:
+        """Trace the block if DEFAULTS.trace (written to DEFAULTS.trace_path
+        or norm_path/trace.json); does nothing otherwise.
+        """
+        if not DEFAULTS.trace:
+            yield None
+            return
+        tracer = cls(DEFAULTS.trace_path or Path(norm_path, cls.file_name))
+        with tracer.tracing():
+            yield tracer
+
+    @staticmethod
+    def span_args(cls_name: str, args: Tuple[Any, ...]) -> Dict[str, Any]:
+        """Slide name and tile index of NormaliseSlides methods."""
+        if cls_name != "NormaliseSlides":
+            return {}
+        normaliser = args[0]
+        span_args = {"slide": normaliser.current_slide.slide_path.name}
+        if len(args) > 1 and isinstance(args[1], int):
+            span_args["tile"] = args[1]
+        return span_args
+
+    def wrap(self, cls_name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """func recording a span per call."""
+        name = f"{cls_name}.{func.__name__}"
+
+        @wraps(func)
+        def traced(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = perf_counter_ns()
+                thread = threading.current_thread()
+                self.threads.setdefault(thread.ident, thread.name)
+                # list.append is atomic => no lock on the hot path
+                self.events.append({"name": name, "cat": cls_name, "ph": "X",
+                                    "ts": (start - self.start_ns) / 1000,
+                                    "dur": (end - start) / 1000,
+                                    "pid": os.getpid(), "tid": thread.ident,
+                                    "args": self.span_args(cls_name, args)})
+        return traced
+
+    def targets(self) -> List[Tuple[type, str]]:
+        """Classes & names of the traced functions."""
+        # imported here: dogsled.normaliser is not needed unless tracing
+        from dogsled import normaliser
+        return [(getattr(normaliser, cls_name), name)
+                for cls_name, names in self.TARGETS.items() for name in names]
+
+    def trace(self) -> Dict[str, Any]:
+        """Chrome trace JSON object (with thread names)."""
+        metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+                     "args": {"name": "dogsled"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                      "args": {"name": thread_name}}
+                     for tid, thread_name in self.threads.items()]
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+    def save(self) -> None:
+        """Write the trace file."""
+        with open(self.path, "w", encoding="utf-8") as trace_file:
+            json.dump(self.trace(), trace_file)
+        LOGGER.info(f"trace saved to {self.path}")
+
+    @contextmanager
+    def tracing(self) -> Iterator["Tracer"]:
+        """Trace the block; the trace is saved also if the block fails."""
+        try:
+            with wrapped(self.targets(), lambda cls, name, func: self.wrap(cls.__name__, func)):
+                yield self
+        finally:
+            self.save()
@@ -222,10 +222,11 @@ class FileData:
         # tempfile.TemporaryDirectory(suffix=None, prefix=slide_stem, dir=temp_path)
         if temp_path:
             temp_path = path_checker.str_to_path(temp_path)
-        else:
+        elif not DEFAULTS.stream_tiles:  # streamed tiles do not need a temporary folder
             temp_path = Path(path_holder.norm_slide_path,
                              DEFAULTS.temporary_folder_name,)
-        path_creator.create_path(temp_path, rewrite=rewrite_flag)
+        if temp_path:  # resumed normalisation re-uses the temporary folder
+            path_creator.create_path(temp_path, rewrite=rewrite_flag or DEFAULTS.resume)
         path_holder.temp_path = temp_path
 
         return path_holder
@@ -0,0 +1,27 @@
+"""Temporary wrapping of class functions.
+The stage timer of the benchmarks and the tracer replace the pipeline functions by instrumented
+wrappers only while they are active => no cost otherwise.
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+
+@contextmanager
+def wrapped(targets: Iterable[Tuple[type, str]],
+            wrap: Callable[[type, str, Callable[..., Any]], Callable[..., Any]]) -> Iterator[None]:
+    """Replace the functions (static methods or methods) of the classes by wrap(cls, name, function)
+    within the block; the originals are restored afterwards, also after an error.
+    """
+    originals: List[Tuple[type, str, Any]] = []
+    try:
+        for cls, name in targets:
+            original = cls.__dict__[name]
+            originals.append((cls, name, original))
+            if isinstance(original, staticmethod):
+                setattr(cls, name, staticmethod(wrap(cls, name, original.__func__)))
+            else:
+                setattr(cls, name, wrap(cls, name, original))
+        yield
+    finally:
+        for cls, name, original in reversed(originals):
+            setattr(cls, name, original)